@@ -2,14 +2,19 @@ import traceback
 import sys
 import os
 import logging
-import shutil
 import threading
 from pathlib import Path
-import zipfile
 
-from flask import Flask, render_template, Response, jsonify, send_from_directory
+from flask import (
+    Flask,
+    render_template,
+    Response,
+    jsonify,
+    request,
+    send_from_directory,
+    stream_with_context,
+)
 from flask_cors import CORS
-from flask_caching import Cache
 from flask_compress import Compress
 
 import db
@@ -33,11 +38,22 @@ from topas_portal import correlations_preprocess as cp
 from topas_portal import fetch_data_matrix as hp
 from topas_portal import differential_expression as differential_test
 from topas_portal import genomics_preprocess as genomics_process
+from topas_portal import patient_report_store as report_store
+from topas_portal import response_cache
+from topas_portal import result_tables
+from topas_portal import dimensionality_reduction
+from topas_portal import sample_metadata
+from topas_portal import density_plots
+from topas_portal import qc_summary
+from topas_portal import detection_index
 
 
 config = {
-    "CACHE_TYPE": "SimpleCache",  # Flask-Caching related configs
-    "CACHE_DEFAULT_TIMEOUT": 300,
+    # Flask-Caching related configs, shared by all workers, see response_cache.py
+    "CACHE_TYPE": "FileSystemCache",
+    "CACHE_DIR": os.path.join(settings.PORTAL_CACHE_DIR, "responses"),
+    "CACHE_THRESHOLD": settings.RESPONSE_CACHE_MAX_ENTRIES,
+    "CACHE_DEFAULT_TIMEOUT": settings.RESPONSE_CACHE_TIMEOUT,
 }
 UPLOAD_FOLDER = "./uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -58,12 +74,24 @@ app.url_map.converters["data_type"] = routing_converters.DataTypeConverter
 app.url_map.converters["intensity_unit"] = routing_converters.IntensityUnitConverter
 app.url_map.converters["include_ref"] = routing_converters.IncludeRefConverter
 
-cache = Cache(app)
+response_cache.cache.init_app(app)
 Compress(app)
 
 
+def load_all_data_and_build_reports():
+    cohorts_db.load_all_data()
+    sample_metadata.build_sample_metadata(cohorts_db)
+    density_plots.build_background_histograms(cohorts_db)
+    qc_summary.build_qc_summaries(cohorts_db)
+    detection_index.build_detection_bitmaps(cohorts_db)
+    bp.build_topas_scores_long_formats(cohorts_db)
+    report_store.start_building_patient_reports(cohorts_db)
+    if settings.WARM_UP_DIMENSIONALITY_REDUCTION:
+        dimensionality_reduction.warm_up()
+
+
 def start_background_loader():
-    thread = threading.Thread(target=cohorts_db.load_all_data)
+    thread = threading.Thread(target=load_all_data_and_build_reports)
     thread.daemon = True  # Allows thread to exit when the main program exits
     thread.start()
 
@@ -79,6 +107,8 @@ with app.app_context():
     from compartments.entityscore_app import entityscore_page
     from compartments.overview_app import overview_page
     from compartments.z_scoring_app import zscoring_page
+    from compartments.signature_app import signature_page
+    from compartments.jobs_app import jobs_page
 
     if cohorts_db.config.do_load_data_on_startup():
         start_background_loader()
@@ -93,8 +123,10 @@ app.register_blueprint(integration_page)
 app.register_blueprint(entityscore_page)
 app.register_blueprint(overview_page)
 app.register_blueprint(zscoring_page)
+app.register_blueprint(signature_page)
+app.register_blueprint(jobs_page)
 
-CORS(app)
+CORS(app, expose_headers=[result_tables.TOTAL_COUNT_HEADER])
 
 logging.basicConfig(filename=settings.PORTAL_LOG_FILE, level=logging.ERROR)
 
@@ -144,8 +176,8 @@ def column_names():
     return jsonify(settings.front_end_col_names)
 
 
-@cache.cached(timeout=50)
 @app.route(ApiRoutes.PATIENT_REPORT_TABLE)
+@response_cache.cached_response
 def get_patient_report_table(
     cohort_index: int, patient: str, level: utils.DataType, downloadmethod: str
 ):
@@ -163,6 +195,12 @@ def get_patient_report_table(
     Returns:
         Response: jsonified dataframe with patient report table.
     """
+    if downloadmethod == "onfly":
+        return utils.df_to_json(
+            report_store.get_patient_report(
+                cohorts_db, cohort_index, patient, utils.DataType(level)
+            )
+        )
     return utils.df_to_json(
         pp.get_reports_per_patient(
             cohorts_db,
@@ -174,7 +212,66 @@ def get_patient_report_table(
     )
 
 
-@cache.cached(timeout=50)
+@app.route(ApiRoutes.PATIENT_REPORT_TABLE_BATCH)
+@response_cache.conditional_response
+# http://localhost:3832/0/patient_reports_batch/protein/I007-031-108742;I007-031-108743
+# http://localhost:3832/0/patient_reports_batch/protein/all
+def get_patient_report_tables_batch(
+    cohort_index: int, level: utils.DataType, patients: str
+):
+    """Streams the report tables of several patients as a single tab separated file.
+
+    Args:
+        cohort_index (int): cohort index
+        level (utils.DataType): modality to get reports for, see utils.DataType.
+        patients (str): patient identifiers separated by semicolons, or "all"
+
+    Returns:
+        Response: streamed tsv file with a 'Sample name' column
+    """
+    if patients == "all":
+        patients = (
+            cohorts_db.get_patient_metadata_df(cohort_index)["Sample name"]
+            .unique()
+            .tolist()
+        )
+    else:
+        patients = patients.split(";")
+
+    unknown_patients = report_store.get_unknown_patients(cohorts_db, cohort_index, patients)
+    if unknown_patients:
+        return f"Unknown patients: {';'.join(unknown_patients)}", 404
+
+    try:
+        level = utils.DataType(level)
+    except ValueError as err:
+        return str(err), 400
+    return Response(
+        stream_with_context(
+            report_store.iter_patient_reports_csv(
+                cohorts_db, cohort_index, patients, level
+            )
+        ),
+        mimetype="text/tab-separated-values",
+        headers={
+            "Content-Disposition": f"attachment; filename=patient_reports_{level.value}.tsv"
+        },
+    )
+
+
+@app.route(ApiRoutes.PATIENT_REPORT_STORE_STATUS)
+# http://localhost:3832/0/patient_reports_store/status
+def patient_report_store_status(cohort_index: int):
+    return jsonify(report_store.get_build_status(cohort_index))
+
+
+@app.route(ApiRoutes.PATIENT_REPORT_STORE_BUILD)
+# http://localhost:3832/0/patient_reports_store/build
+def build_patient_report_store(cohort_index: int):
+    report_store.start_building_patient_reports(cohorts_db, [cohort_index])
+    return jsonify(report_store.get_build_status(cohort_index))
+
+
 @app.route(ApiRoutes.PATIENT_REPORT_TABLE_XLSX)
 # http://localhost:3832/0/patient_reports/I007-031-108742
 def get_patient_reports_as_attachment(cohort_index: int, patients: str):
@@ -190,42 +287,28 @@ def get_patient_reports_as_attachment(cohort_index: int, patients: str):
     reports_dir = cohorts_db.get_report_dir(cohort_index)
     patients = patients.split(";")
 
-    def get_patient_report_path(patient_identifier: str):
-        return (
-            reports_dir + "/Reports/" + patient_identifier + "_proteomics_results.xlsx"
+    paths_to_patient_results = []
+    for patient in patients:
+        path_to_patient_results = (
+            reports_dir + "/Reports/" + patient + "_proteomics_results.xlsx"
         )
-
-    if len(patients) == 1:
-        path_to_patient_results = get_patient_report_path(patients[0])
         if not os.path.exists(path_to_patient_results):
-            return f"Unable to download report for {patients[0]}", 400
-        shutil.copy(path_to_patient_results, app.config["UPLOAD_FOLDER"])
+            return f"Unable to download report for {patient}", 400
+        paths_to_patient_results.append(path_to_patient_results)
+
+    if len(paths_to_patient_results) == 1:
         return send_from_directory(
-            app.config["UPLOAD_FOLDER"],
-            Path(path_to_patient_results).name,
+            reports_dir + "/Reports",
+            Path(paths_to_patient_results[0]).name,
             as_attachment=True,
         )
-    elif len(patients) > 1:
-        paths_to_patient_results = []
-        for patient in patients:
-            path_to_patient_results = get_patient_report_path(patient)
-            if not os.path.exists(path_to_patient_results):
-                return f"Unable to download report for {patient}", 400
-            paths_to_patient_results.append(path_to_patient_results)
-
-        output_zipfile = os.path.join(
-            app.config["UPLOAD_FOLDER"], "patient_reports.zip"
-        )
-        with zipfile.ZipFile(output_zipfile, "w") as zipFile:
-            for path_to_patient_results in paths_to_patient_results:
-                zipFile.write(
-                    path_to_patient_results,
-                    Path(path_to_patient_results).name,
-                    compress_type=zipfile.ZIP_STORED,
-                )  # no compression, because Excel files are already binary
-        return send_from_directory(
-            app.config["UPLOAD_FOLDER"], Path(output_zipfile).name, as_attachment=True
-        )
+
+    # streamed without compression, because Excel files are already compressed
+    return Response(
+        utils.iter_zip_stored(paths_to_patient_results),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=patient_reports.zip"},
+    )
 
 
 # http://localhost:3832/entityscore/status
@@ -239,6 +322,7 @@ def entity_models_status():
 
 # http://localhost:3832/correlation/fpkmprotein/0
 @app.route(ApiRoutes.CORRELATION_FPKM_PROTEIN)
+@response_cache.cached_response
 def get_protein_fpkm_correlation(cohort_index: int):
     """
     Computes the correlation between protein abundance and transcript expression (FPKM) for a given cohort.
@@ -292,7 +376,7 @@ def get_oncokb_cnv_annotation(identifier: str, cnv_type: str):
 @app.route(ApiRoutes.RELOAD)
 # http://localhost:3832/reload
 def reload():
-    cohorts_db.load_all_data()
+    load_all_data_and_build_reports()
     return Response("Uploaded!")
 
 
@@ -381,6 +465,13 @@ def get_the_insilico_peptide_digested():
 def reload_current_cohort(cohort: str):
     cohorts_db.config.reload_config()
     cohorts_db.provider.load_tables(cohorts_db.config, cohort_names=[cohort])
+    cohort_index = cohorts_db.config.get_cohort_index(cohort)
+    sample_metadata.build_sample_metadata(cohorts_db, [cohort_index])
+    density_plots.build_background_histograms(cohorts_db, [cohort_index])
+    qc_summary.build_qc_summaries(cohorts_db, [cohort_index])
+    detection_index.build_detection_bitmaps(cohorts_db, [cohort_index])
+    bp.build_topas_scores_long_formats(cohorts_db, [cohort_index])
+    report_store.start_building_patient_reports(cohorts_db, [cohort_index])
     return Response("Updated!")
 
 
@@ -394,6 +485,7 @@ def path_checker(path: str):
 
 #####################################################################
 @app.route(ApiRoutes.ANNOTATION_MODALITY)
+@response_cache.conditional_response
 # http://localhost:3832/annotation/0/allpatients
 # http://localhost:3832/annotation/0/allbatch
 # http://localhost:3832/annotation/0/allentities
@@ -404,17 +496,44 @@ def get_all_modality_possibilities(cohort_index: int, modality: str):
 
 
 @app.route(ApiRoutes.VENN_PATIENT_COMPARE)
+@response_cache.conditional_response
 # http://localhost:3832/venn/0/patientcompare/fp/C3L-00032-1
 def get_patients_proteins(cohort_index: int, pp_fp: str, patientslists: str):
-    return pp.get_patients_proteins_as_json(
-        cohorts_db, cohort_index, pp_fp, patientslists
-    )
+    try:
+        return pp.get_patients_proteins_as_json(
+            cohorts_db, cohort_index, pp_fp, patientslists
+        )
+    except ValueError as err:
+        return str(err), 400
 
 
 @app.route(ApiRoutes.VENN_BATCH_COMPARE)
+@response_cache.conditional_response
 # http://localhost:3832/venn/0/batchcompare/fp/1_2_43
 def get_batches_proteins(cohort_index: int, pp_fp: str, batchlists: str):
-    return pp.get_batches_proteins_as_json(cohorts_db, cohort_index, pp_fp, batchlists)
+    try:
+        return pp.get_batches_proteins_as_json(cohorts_db, cohort_index, pp_fp, batchlists)
+    except ValueError as err:
+        return str(err), 400
+
+
+@app.route(ApiRoutes.VENN_COMPARE)
+@response_cache.conditional_response
+# http://localhost:3832/venn/0/compare/fp/patients/C3L-00032-1;C3L-00080-1
+# http://localhost:3832/venn/0/compare/pp/batches/1;2;43?region=1;2
+def get_venn_comparison(cohort_index: int, pp_fp: str, modality: str, groups: str):
+    region = request.args.get("region")
+    try:
+        comparison = detection_index.compare_groups(
+            detection_index.get_detection_bitmap(cohorts_db, cohort_index, pp_fp),
+            modality,
+            groups.split(";"),
+            region.split(";") if region else None,
+        )
+    except ValueError as err:
+        # unknown data layer, modality or groups of the region
+        return str(err), 400
+    return jsonify(comparison)
 
 
 @app.route(ApiRoutes.UPDATE_LOG)
@@ -431,7 +550,14 @@ def get_error_log():
     return jsonify(log)
 
 
+@app.route(ApiRoutes.CACHE_STATS)
+# http://localhost:3832/cache/stats
+def get_cache_stats():
+    return jsonify(response_cache.get_stats())
+
+
 @app.route(ApiRoutes.PATIENT_CENTRIC_PP_INTENSITY)
+@response_cache.conditional_response
 # http://localhost:3832/patientcentric/ppintensity/0/fp
 # http://localhost:3832/patientcentric/ppintensity/0/pp
 def get_sum_intensities_pp_level(cohort_index: int, dtype: str):
@@ -439,41 +565,57 @@ def get_sum_intensities_pp_level(cohort_index: int, dtype: str):
         return {}  # this query is too slow in the database
 
     return utils.df_to_json(
-        pp.sum_intensities_across_all_patients(cohorts_db, cohort_index, dtype=dtype)
+        qc_summary.get_sum_intensities(cohorts_db, cohort_index, dtype)
     )
 
 
 @app.route(ApiRoutes.PATIENT_CENTRIC_PROTEIN_COUNTS)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/patientcenteric/proteincounts/0/fp
 def get_identifications_frequency(cohort_index: int, fp_pp: str):
     if settings.DATABASE_MODE:
         return {}  # this query is too slow in the database
 
     return utils.df_to_json(
-        pp.identifications_across_all_patients(cohorts_db, fp_pp, cohort_index)
+        qc_summary.get_identifications(cohorts_db, cohort_index, fp_pp)
     )
 
 
+@app.route(ApiRoutes.PATIENT_CENTRIC_BATCH_COUNTS)
+@response_cache.cached_response
+# http://localhost:3832/patientcentric/batchcounts/0
+def get_batch_counts(cohort_index: int):
+    if settings.DATABASE_MODE:
+        return {}  # this query is too slow in the database
+
+    return utils.df_to_json(qc_summary.get_batch_counts(cohorts_db, cohort_index))
+
+
 @app.route(ApiRoutes.TOPAS)
+@response_cache.conditional_response
 # http://localhost:3832/topas/0/ALK/topas_score
 def topas(cohort_index: int, topas_names: str, score_type: str):
     return bp.get_topas_data(cohorts_db, cohort_index, topas_names, score_type)
 
 
 @app.route(ApiRoutes.TOPAS_ANNOTATIONS)
+@response_cache.conditional_response
 # http://localhost:3832/topas/annotations
 def topas_annotations():
     return utils.df_to_json(cohorts_db.get_topas_annotation_df())
 
 
 @app.route(ApiRoutes.TOPAS_LOLLIPOP)
+@response_cache.conditional_response
 # http://localhost:3832/topas/lolipopdata/0/I002-025-226610
 def get_circular_barplot_data(cohort_index: int, patient: str):
     return utils.df_to_json(
         bp.get_circular_barplot_data_pathways(
-            cohorts_db.get_topas_scores_df(
-                cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
+            bp.get_topas_scores_long_df(
+                cohorts_db,
+                cohort_index,
+                utils.IntensityUnit.Z_SCORE,
+                patient_name=patient,
             ),
             patient,
         )
@@ -481,6 +623,7 @@ def get_circular_barplot_data(cohort_index: int, patient: str):
 
 
 @app.route(ApiRoutes.TOPAS_LOLLIPOP_TUMOR)
+@response_cache.conditional_response
 # http://localhost:3832/topas/lolipopdata/0/I002-025-226610/tumor_antigen
 def get_circular_barplot_data_tumor(cohort_index: int, patient: str):
     return utils.df_to_json(
@@ -494,6 +637,7 @@ def get_circular_barplot_data_tumor(cohort_index: int, patient: str):
 
 
 @app.route(ApiRoutes.TOPAS_EXPRESSION_DOWNSTREAM)
+@response_cache.conditional_response
 # http://localhost:3832/topas/lolipopdata/expression/0/I002-025-226610/downstream_signaling
 def get_lolipopexpression_down_stream(cohort_index: int, patient: str):
     return utils.df_to_json(
@@ -503,8 +647,11 @@ def get_lolipopexpression_down_stream(cohort_index: int, patient: str):
                 intensity_unit=utils.IntensityUnit.Z_SCORE,
                 patient_name=patient,
             ),
-            cohorts_db.get_topas_scores_df(
-                cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
+            bp.get_topas_scores_long_df(
+                cohorts_db,
+                cohort_index,
+                utils.IntensityUnit.Z_SCORE,
+                patient_name=patient,
             ),
             patient,
             type_to_filter="downstream signaling",
@@ -513,6 +660,7 @@ def get_lolipopexpression_down_stream(cohort_index: int, patient: str):
 
 
 @app.route(ApiRoutes.PROTEIN_LIST)
+@response_cache.conditional_response
 # http://localhost:3832/0/protein/list
 def get_list_proteins(cohort_index: int, level: str):
     return jsonify(
@@ -529,6 +677,7 @@ def get_list_proteins(cohort_index: int, level: str):
 
 
 @app.route(ApiRoutes.TOPAS_EXPRESSION_RTK)
+@response_cache.conditional_response
 # http://localhost:3832/topas/lolipopdata/expression/0/I002-025-226610/rtk
 def get_lolipopexpression_rtk(cohort_index: int, patient: str):
     return utils.df_to_json(
@@ -538,8 +687,11 @@ def get_lolipopexpression_rtk(cohort_index: int, patient: str):
                 intensity_unit=utils.IntensityUnit.Z_SCORE,
                 patient_name=patient,
             ),
-            cohorts_db.get_topas_scores_df(
-                cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
+            bp.get_topas_scores_long_df(
+                cohorts_db,
+                cohort_index,
+                utils.IntensityUnit.Z_SCORE,
+                patient_name=patient,
             ),
             patient,
             type_to_filter="RTK",
@@ -548,32 +700,35 @@ def get_lolipopexpression_rtk(cohort_index: int, patient: str):
 
 
 @app.route(ApiRoutes.TOPAS_IDS)
+@response_cache.conditional_response
 # http://localhost:3832/topas/0/topasids
 def topas_unique(cohort_index: int, categories: str):
     return bp.get_topas_unique(cohorts_db.get_topas_scores_df(cohort_index), categories)
 
 
 @app.route(ApiRoutes.TOPAS_SUBSCORE)
+@response_cache.conditional_response
 # http://localhost:3832/topas/subscore/0/ABL
 def topas_subtype(cohort_index: int, topasname: str):
     return bp.get_topas_subscore_data(cohorts_db, cohort_index, topasname)
 
 
 @app.route(ApiRoutes.SAMPLE_ANNOTATION)
+@response_cache.conditional_response
 # http://localhost:3832/0/sampleanot
 def sample_annotation(cohort_index: int):
     return utils.df_to_json(cohorts_db.get_sample_annotation_df(cohort_index))
 
 
 @app.route(ApiRoutes.PATIENTS)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/0/patients
 def patients(cohort_index: int):
     return utils.df_to_json(cohorts_db.get_patient_metadata_df(cohort_index))
 
 
 @app.route(ApiRoutes.PATIENTS_GENOMICS_ANNOTATIONS)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/0/patients/genomics_annotations/EGFR
 def patients_genomics_annotations(cohort_index: int, identifier: str):
     patients_meta_df = cohorts_db.get_patient_metadata_df(cohort_index).copy()
@@ -587,25 +742,23 @@ def patients_genomics_annotations(cohort_index: int, identifier: str):
 
 
 @app.route(ApiRoutes.PATIENTS_METADATA)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/0/metadata
 def patientsmetadata(cohort_index: int):
-    sample_annotation_df = cohorts_db.get_sample_annotation_df(cohort_index)
-    if "Entity" in sample_annotation_df.columns:
-        sample_annotation_df = sample_annotation_df.drop(["Entity"], axis=1)
-    patien_meta_df = cohorts_db.get_patient_metadata_df(cohort_index)
-    final_df = utils.merge_with_patients_meta_df(sample_annotation_df, patien_meta_df)
+    final_df = sample_metadata.get_sample_metadata(cohorts_db, cohort_index).get_annotated_samples_df()
     final_df = final_df.fillna('n.d.')
     return utils.df_to_json(final_df)
 
 
 @app.route(ApiRoutes.PATIENTS_METADATA_FIELDS)
+@response_cache.conditional_response
 # http://localhost:3832/0/metadata/fields
 def patients_meta_fields(cohort_index: int):
     return jsonify(sorted(cohorts_db.get_patient_metadata_df(cohort_index).columns))
 
 
 @app.route(ApiRoutes.PATIENTS_METADATA_FIELD_VALUES)
+@response_cache.conditional_response
 # http://localhost:3832/0/metadata/fields/code_oncotree
 def unique_field_intereset(cohort_index: int, fieldname: str):
     unique_items = (
@@ -619,6 +772,7 @@ def unique_field_intereset(cohort_index: int, fieldname: str):
 
 
 @app.route(ApiRoutes.PATIENTS_BY_FIELD_INTEREST)
+@response_cache.conditional_response
 # http://localhost:3832/0/metadata/fields/code_oncotree/patients/UCEC
 def get_patientslist_by_fieldname(
     cohort_index: int, fieldname: str, field_interest: str
@@ -635,6 +789,7 @@ def get_patientslist_by_fieldname(
 
 
 @app.route(ApiRoutes.PATIENTS_ALL_ENTITIES)
+@response_cache.conditional_response
 # http://localhost:3832/patients/0/all_entities
 def get_patients_entities(cohort_index: int):
     return utils.df_to_json(cohorts_db.get_patients_entities_df(cohort_index))
@@ -642,6 +797,7 @@ def get_patients_entities(cohort_index: int):
 
 # http://localhost:3832/genomics/EGFR
 @app.route(ApiRoutes.GENOMICS_IDENTIFIER)
+@response_cache.conditional_response
 def get_genomes(identifier: str):
     genomics_df = genomics_process.get_genomics_alterations_per_identifier(
         cohorts_db, identifier
@@ -652,6 +808,7 @@ def get_genomes(identifier: str):
 
 # http://localhost:3832/oncokb/EGFR
 @app.route(ApiRoutes.ONCOKB_IDENTIFIER)
+@response_cache.conditional_response
 def get_oncokb(identifier: str):
     genomics_df = genomics_process.get_genomics_alterations_per_identifier(
         cohorts_db, identifier, annotation_type="oncoKB_annotations"
@@ -661,12 +818,14 @@ def get_oncokb(identifier: str):
 
 
 @app.route(ApiRoutes.DENSITY_FPKM)
+@response_cache.conditional_response
 # http://localhost:3832/density/fpkm/EGFR/z_scored
 def density_calc_fpkm(identifier: str, intensity_unit: utils.IntensityUnit):
     return transcript.get_density_calc_fpkm(cohorts_db, identifier, intensity_unit)
 
 
 @app.route(ApiRoutes.DENSITY_PROTEIN)
+@response_cache.conditional_response
 # http://localhost:3832/0/density/protein/EGFR/z_scored
 def density_calc_protein(
     cohort_index: int, identifier: str, intensity_unit: utils.IntensityUnit
@@ -677,10 +836,12 @@ def density_calc_protein(
 
 
 @app.route(ApiRoutes.IMPORTANT_PHOSPHO)
+@response_cache.conditional_response
 # http://localhost:3832/0/important_phospho/EGFR
 def get_important_phospho(cohort_index: int, identifier: str):
     return bp.get_topas_subscore_data_per_type(
-        cohorts_db.get_report_dir(cohort_index),
+        cohorts_db,
+        cohort_index,
         identifier,
         sub_type="important phosphorylation",
         return_json=True,
@@ -688,7 +849,7 @@ def get_important_phospho(cohort_index: int, identifier: str):
 
 
 @app.route(ApiRoutes.ABUNDANCE)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/0/protein/abundance/EGFR/noimpute
 # http://localhost:3832/0/fpkm/abundance/EGFR/noimpute
 # http://localhost:3832/0/kinase/abundance/EGFR/noimpute
@@ -712,11 +873,12 @@ def abundance(
 
 
 @app.route(ApiRoutes.CORRELATION)
-@cache.cached(timeout=50)
+@response_cache.cached_response
 # http://localhost:3832/0/topas_score/correlation/protein/EGFR/z_scored
 # http://localhost:3832/0/phospho_score/correlation/protein/EGFR/intensity
 # http://localhost:3832/0/fpkm/correlation/protein/EGFR/z_scored
 # http://localhost:3832/0/important_phosphorylation/correlation/protein/EGFR/z_scored
+# http://localhost:3832/0/fpkm/correlation/protein/EGFR/z_scored?limit=200&sort=FDR&max_fdr=0.05&min_abs_r=0.3
 def correlation(
     cohort_index: int,
     level: utils.DataType,
@@ -734,10 +896,12 @@ def correlation(
         level_2,
         intensity_unit,
         patients_list=patients_list,
+        query=result_tables.ResultTableQuery.from_request_args(request.args),
     )
 
 
 @app.route(ApiRoutes.BATCH_EFFECT)
+@response_cache.conditional_response
 # http://localhost:3832/batcheffect/expression_level/0/ABL/1,23,24/plot
 # http://localhost:3832/batcheffect/phospho_level/0/ABL/1,23,24/plot
 # http://localhost:3832/batcheffect/kinase_level/0/ALK/1,23,24/plot
@@ -759,9 +923,11 @@ def batch_effect(
 
 
 @app.route(ApiRoutes.DIFFERENTIAL)
+@response_cache.cached_response
 # http://localhost:3832/differential/0/intensity/index_346_286_463/index_444_514_592
 # http://localhost:3832/differential/0/phosphopeptides/index_346_286_463/index
 # http://localhost:3832/differential/0/topasscores/index_346_286_463/index_444_514_592
+# http://localhost:3832/differential/0/intensity/index_346_286_463/index?limit=200&sort=fdr&max_pvalue=0.01&min_abs_fc=1
 def get_t_test_json(
     cohort_index: int,
     grp1_ind: str,
@@ -769,7 +935,7 @@ def get_t_test_json(
     level: utils.DataType,
     y_axis_type: str,
 ):
-    return utils.df_to_json(
+    return result_tables.result_table_to_json(
         differential_test.get_data_for_t_test(
             cohorts_db,
             cohort_index,
@@ -777,7 +943,9 @@ def get_t_test_json(
             grp2_ind,
             level,
             y_axis_type,
-        )
+        ),
+        result_tables.ResultTableQuery.from_request_args(request.args),
+        differential_test.DIFFERENTIAL_COLUMNS,
     )
 
 
@@ -790,6 +958,12 @@ def handle_cohort_data_not_loaded_error(err):
     return "", f"400 {type(err).__name__}: {err}"
 
 
+@app.errorhandler(result_tables.InvalidResultTableQueryError)
+def handle_invalid_result_table_query(err):
+    """Bad paging, sort or filter arguments of /correlation, /differential and job results"""
+    return str(err), 400
+
+
 @app.errorhandler(Exception)
 def handle_exception(err):
     portal_logger(f"{type(err).__name__}: {err}", log_list=error_log)
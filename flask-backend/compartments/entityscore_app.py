@@ -1,11 +1,17 @@
+import functools
+import os
+
 import pandas as pd
 import pickle
 import numpy as np
 from flask import Blueprint, jsonify
+from scipy.special import expit
 
 import db
 from topas_portal import utils
 from topas_portal import settings 
+from topas_portal import imputation
+from topas_portal.result_cache import CohortResultCache
 
 
 entityscore_page = Blueprint(
@@ -23,82 +29,53 @@ PROTEINS_NORMALIZED_PICKLE = cohorts_db.config.config.get('entity_models_normali
 
 
 
-def get_the_probalities_df(df_Z_scores_clean,final_models):
-    all_probalities = {x:calculation_entity_probabilities(df_Z_scores_clean,final_models[x]) for x in list(final_models.keys())}
-    first_key = list(final_models.keys())[0]
-    ref_model_df = all_probalities[first_key]
-    ref_model_df = ref_model_df.rename(columns={'Probability':first_key})
-    list_all_entities = list(all_probalities.keys())
-    list_all_entities.remove(first_key)
-    for entity in list_all_entities:
-        try:
-            other_entity_df = all_probalities[entity]
-            other_entity_df = other_entity_df.rename(columns={'Probability':entity})
-            ref_model_df = ref_model_df.merge(other_entity_df,on='Gene names',how='outer')
-        except:
-            continue
-        
-    ref_model_df = ref_model_df.round(3)
-    return ref_model_df.rename(columns={utils.ColumnNames.GENE_NAME:utils.ColumnNames.SAMPLE_NAME})
+MODEL_METRIC_COLUMNS = ['Intercept', 'F1_1', 'F1_0', 'F1_weighted', 'MCC_score']
+
+entity_scores_cache = CohortResultCache("entity_scores", max_entries=16)
 
 
 
-def run_preprocessing_pipeline(df_Z_scores_cj,FINAL_MODELS_PICKLE):
-    model_proteins, final_models = prepare_model_proteins(FINAL_MODELS_PICKLE)
+def load_compiled_entity_models(picklize_file_path:str):
+    """Returns the compiled models, the pickle is only read again if it was modified"""
+    return _load_compiled_entity_models(picklize_file_path, os.path.getmtime(picklize_file_path))
 
-    #df_normalized_ = do_protein_normalization(PROTEINS_NORMALIZED_PICKLE,model_proteins,df_prt_,df_ent_)
-    df_Z_scores_clean = do_protein_imputaiton(df_Z_scores_cj,model_proteins)
-    return df_Z_scores_clean, final_models
 
+@functools.lru_cache(maxsize=4)
+def _load_compiled_entity_models(picklize_file_path:str, modification_time:float):
+    return compile_entity_models(read_picke_file(picklize_file_path))
 
 
-def prepare_model_proteins(picklize_file_path):
-    final_models = read_picke_file(picklize_file_path)
-    model_prote = []
-    for i in final_models.values():
-        model_prote += list(i.columns)   
 
-    model_prote = set(model_prote)
-    model_prote.remove('Intercept')
-    model_prote.remove('F1_1')
-    model_prote.remove('F1_0')
-    model_prote.remove('F1_weighted')
-    model_prote.remove('MCC_score')
-    model_proteins = list(model_prote)
-    return model_proteins, final_models
+def compile_entity_models(final_models:dict):
+    """
+    Stacks the logistic regression models of all entities into one coefficient matrix
+    final_models: dictionary of entity -> one row dataframe with the protein coefficients, 'Intercept' and the model metrics
+    returns: coefficients (models x proteins, 0 for proteins not in a model), which model uses which protein and the intercepts
+    """
+    coefficients = {entity: model_df.iloc[0].drop(MODEL_METRIC_COLUMNS, errors='ignore') for entity, model_df in final_models.items()}
+    coefficients_df = pd.DataFrame(coefficients).T
+    uses_protein_df = coefficients_df.notna()
+    coefficients_df = coefficients_df.fillna(0).astype(float)
+    intercepts = pd.Series({entity: model_df.iloc[0]['Intercept'] for entity, model_df in final_models.items()}, dtype=float)
+    return coefficients_df, uses_protein_df, intercepts.loc[coefficients_df.index]
+
 
 
-def calculation_entity_probabilities (df_clean , df_coefficients):
+def calculation_entity_probabilities(df_clean:pd.DataFrame, coefficients_df:pd.DataFrame, uses_protein_df:pd.DataFrame, intercepts:pd.Series):
     """
-    df_clean: Dataframe used for calculate coefficients. Initial dataset, with  Sample name	+ code_oncotree + proteins intensities. and imputated, or removed NaN values 
-    
-    df_coefficients: result from the coefficients analysis, obtained from the function "log_reg_results_stats"
-    example: CHDM_probs = calculation_entity_probabilities(df_Z_scores_clean,final_models['CHDM'])
-    
-    """  
-    try:  
-        df = df_clean.iloc[:, :1].copy()
-        
-        # Initialize coeff with the appropriate shape based on df_initial_HO
-        coeff = np.zeros(df.shape[0])
-        
-        for i in df_coefficients.iloc[:, :-5].columns:
-            print(i)
-            try:
-                # Perform dot product and accumulate results in coeff
-                coeff += df_clean[i] * df_coefficients.iloc[0][i]
-            except KeyError:
-                print(f"Protein {i} not found. Check its intensity")
-                continue
-        
-        coeff_sum = coeff
-        probability = logistic_function(coeff_sum + df_coefficients.iloc[0]['Intercept'])
-        
-        # Insert probability into df
-        df.insert(1, "Probability", probability)
-        return df
-    except:
-        return pd.DataFrame()
+    df_clean: imputed Z-scores, samples x proteins
+    coefficients_df, uses_protein_df, intercepts: compiled models, see compile_entity_models
+    returns: probabilities samples x models, proteins missing in the data do not contribute to the scores
+    and models using a protein that still has missing values after imputation get NaN
+    example: probabilities_df = calculation_entity_probabilities(df_Z_scores_clean, *load_compiled_entity_models(FINAL_MODELS_PICKLE))
+    """
+    proteins = coefficients_df.columns.intersection(df_clean.columns)
+    intensities = df_clean[proteins].to_numpy(dtype=float)
+    missing = np.isnan(intensities)
+
+    logits = np.nan_to_num(intensities) @ coefficients_df[proteins].to_numpy().T + intercepts.to_numpy()
+    logits[(missing.astype(float) @ uses_protein_df[proteins].to_numpy(dtype=float).T) > 0] = np.nan
+    return pd.DataFrame(logistic_function(logits), index=df_clean.index, columns=coefficients_df.index)
 
 
 
@@ -112,7 +89,7 @@ def picklize_file(what_to_picklize:dict,where_to_save:str):
 
 
 def logistic_function(x):    
-    return 1/ (1 + np.exp(-x))
+    return expit(x)
 
 
 
@@ -127,53 +104,6 @@ def normalization_new_data(dataframe, dict_mean_std):
     
 
 
-def impute_normal_down_shift_distribution(unimputerd_dataframe:pd.DataFrame ,column_wise=True, width=0.3, downshift=1.8, seed=2):
-    """ 
-    Performs imputation across a matrix columnswise
-    https://rdrr.io/github/jdreyf/jdcbioinfo/man/impute_normal.html#google_vignette
-    :width: Scale factor for the standard deviation of imputed distribution relative to the sample standard deviation.
-    :downshift: Down-shifted the mean of imputed distribution from the sample mean, in units of sample standard deviation.
-    :seed: Random seed
-    
-    """
-    print('The size of the data Frame before imputation')
-    print(unimputerd_dataframe.shape)
-    unimputerd_df = unimputerd_dataframe.iloc[:,:]
-    unimputerd_matrix = unimputerd_df.replace({pd.NA: np.nan}, inplace=True) #Added to modify pandas's NAN values into  numpy NAN values
-    unimputerd_matrix = unimputerd_df.to_numpy()
-    columns_names = unimputerd_df.columns
-    rownames = unimputerd_df.index
-    unimputerd_matrix[~np.isfinite(unimputerd_matrix)] = None
-    main_mean = np.nanmean(unimputerd_matrix)
-    main_std = np.nanstd(unimputerd_matrix)
-    np.random.seed(seed = seed)
-    def impute_normal_per_vector(temp:np.ndarray,width=width, downshift=downshift):
-        """ Performs imputation for a single vector """
-        if column_wise:
-            temp_sd = np.nanstd(temp)
-            temp_mean = np.nanmean(temp)
-        else:
-            # over all matrix
-            temp_sd = main_std
-            temp_mean = main_mean
-
-        shrinked_sd = width * temp_sd
-        downshifted_mean = temp_mean - (downshift * temp_sd) 
-        n_missing = np.count_nonzero(np.isnan(temp))
-        temp[np.isnan(temp)] = np.random.normal(loc=downshifted_mean, scale=shrinked_sd, size=n_missing)
-        if n_missing > 0:
-            print 
-        return temp
-    final_matrix = np.apply_along_axis(impute_normal_per_vector, 0, unimputerd_matrix)
-    final_df = pd.DataFrame(final_matrix)
-    final_df.index = rownames
-    final_df.columns = columns_names
-    
-    return final_df
-
-
-
-
 def clean_df (intensity_df:pd.DataFrame, metadata_df:pd.DataFrame ):
     intensity_df = intensity_df.transpose()
     intensity_df.reset_index(inplace=True)
@@ -210,20 +140,25 @@ def do_protein_normalization(path_to_picke_file,model_proteins,df_prt_,df_ent_):
 
 
 
-def do_protein_imputaiton(df_Z_scores_cj,model_proteins):
-    df_Z_scores = df_Z_scores_cj.transpose(copy=True) #Transforming Z-scores file to obtain values and info
-    df_Z_scores = df_Z_scores.reset_index()
-    df_Z_scores = df_Z_scores.replace('zscore_','', regex=True) 
-    df_Z_scores.rename(columns = df_Z_scores.iloc[0], inplace=True)
-    df_Z_scores.drop(axis=0, index=0, inplace=True)
-    df_Z_scores = pd.concat([df_Z_scores.iloc[:,:2], df_Z_scores.filter(items=model_proteins)], axis=1)# filter by proteins from model 
-    df_z_imputed = impute_normal_down_shift_distribution(df_Z_scores.iloc[:,1:]) #Imputated dataframe of the Z-scored values
-    # Checking for possible remaining columns/proteins still with NA values
-    na_columns = df_z_imputed.isna().any()
-    # Filter to get only columns where there are NaN values
-    na_columns_true = na_columns[na_columns].index.tolist()
-    print("Columns with NaN values:", na_columns_true)
-    return pd.concat([df_Z_scores.iloc[:,0], df_z_imputed], axis=1)# filter by proteins from model 
+def do_protein_imputaiton(df_Z_scores_cj:pd.DataFrame, model_proteins, cohort_ind=None):
+    """Imputed Z-scores of the model proteins as a samples x proteins matrix"""
+    df_Z_scores = df_Z_scores_cj[df_Z_scores_cj.index.isin(model_proteins)]
+    df_Z_scores = df_Z_scores[~df_Z_scores.index.duplicated(keep='first')].transpose()
+    df_Z_scores.index = df_Z_scores.index.str.replace('zscore_', '', regex=True)
+    df_z_imputed = imputation.get_imputed_df(
+        df_Z_scores,
+        cohort_ind,
+        (utils.DataType.FULL_PROTEOME, utils.IntensityUnit.Z_SCORE),
+        imputation.ImputationMethod.NORMAL_DOWN_SHIFT,
+        seed=2,
+    ) #Imputated dataframe of the Z-scored values
+    # proteins without any value in the cohort cannot be imputed
+    na_columns = df_z_imputed.columns[df_z_imputed.isna().any()]
+    if len(na_columns) > 0:
+        cohorts_db.logger.log_message(
+            f"Entity scores: proteins with missing values after imputation: {na_columns.tolist()}"
+        )
+    return df_z_imputed
 
 
 
@@ -238,32 +173,35 @@ def get_list_classifiers():
 
 
 
-@entityscore_page.route("/entityscore/<cohort_ind>")
-# http://localhost:3832/entityscore/0
-def get_entity_scores_cohort(cohort_ind):
-    """"""
-
+def get_entity_probabilities_df(cohort_ind, models_pickle:str) -> pd.DataFrame:
+    coefficients_df, uses_protein_df, intercepts = load_compiled_entity_models(models_pickle)
     df_Z_scores = cohorts_db.get_protein_abundance_df(cohort_ind,intensity_unit=utils.IntensityUnit.Z_SCORE)
-    df_Z_scores[utils.ColumnNames.GENE_NAME] = df_Z_scores.index
-    first_column = df_Z_scores.pop(utils.ColumnNames.GENE_NAME) 
-    df_Z_scores.insert(0, utils.ColumnNames.GENE_NAME, first_column) 
-    df_Z_scores.reset_index(drop=True, inplace=True)
+    df_Z_scores_clean = do_protein_imputaiton(df_Z_scores, coefficients_df.columns, cohort_ind)
+    all_probalities = calculation_entity_probabilities(df_Z_scores_clean, coefficients_df, uses_protein_df, intercepts)
+    all_probalities = all_probalities.round(3).fillna(0)
+    all_probalities.insert(0, utils.ColumnNames.SAMPLE_NAME, all_probalities.index.str.replace(settings.PATIENT_PREFIX,'',regex=True))
+    all_probalities = all_probalities.reset_index(drop=True)
 
     df_ent_ = cohorts_db.get_patient_metadata_df(cohort_ind)
-    df_Z_scores_clean, final_models = run_preprocessing_pipeline(df_Z_scores,FINAL_MODELS_PICKLE)
-    all_probalities = get_the_probalities_df(df_Z_scores_clean,final_models)
-    all_probalities = all_probalities.fillna(0)
-    all_probalities[utils.ColumnNames.SAMPLE_NAME] = all_probalities[utils.ColumnNames.SAMPLE_NAME].str.replace(settings.PATIENT_PREFIX,'',regex=True)
     try:
         final_df = all_probalities.merge(df_ent_[[utils.ColumnNames.SAMPLE_NAME,'code_oncotree']],on=utils.ColumnNames.SAMPLE_NAME)
     except:
         final_df = all_probalities  # in case code_oncotree does not exist in the data
     list_cols_to_exclude = ['EPIS','DDLS','MPNS','MFH'] # these classifiers are not reliable
     list_cols_to_exclude = [x for x in list_cols_to_exclude if x in  final_df.columns]
-    try:
-        final_df = final_df.drop(columns = list_cols_to_exclude)
-    except:
-        pass
-    print(final_df.columns)
-    return utils.df_to_json(final_df)
+    return final_df.drop(columns = list_cols_to_exclude)
+
+
+
 
+@entityscore_page.route("/entityscore/<cohort_ind>")
+# http://localhost:3832/entityscore/0
+def get_entity_scores_cohort(cohort_ind):
+    """Probabilities of all entity classifiers for all patients of a cohort, cached until the cohort or models change"""
+    models_pickle = cohorts_db.config.config.get('entity_models', FINAL_MODELS_PICKLE)
+    final_df = entity_scores_cache.get_or_compute(
+        cohort_ind,
+        (models_pickle, os.path.getmtime(models_pickle)),
+        lambda: get_entity_probabilities_df(cohort_ind, models_pickle),
+    )
+    return utils.df_to_json(final_df)
@@ -0,0 +1,175 @@
+import pandas as pd
+from flask import Blueprint, jsonify, request
+
+import db
+from topas_portal.routes import ApiRoutes
+from topas_portal import jobs
+from topas_portal import utils
+from topas_portal import result_tables
+from topas_portal import correlations_preprocess as cp
+from topas_portal import differential_expression as differential_test
+from compartments import qc_app
+from compartments import entityscore_app
+
+
+jobs_page = Blueprint(
+    "jobs_page",
+    __name__,
+    static_folder="../dist/static",
+    template_folder="../dist",
+)
+
+cohorts_db = db.cohorts_db
+
+
+def _run_qc_job(
+    cohorts_db,
+    report_progress,
+    input_data_type: str,
+    cohort_index: str,
+    dimensionality_reduction_method: str,
+    use_ref: str = "noref",
+    use_replicate: str = "replicate",
+    custom_patients: str = "all",
+    imputation_ratio: str = "0.9",
+    meta_col: str = None,
+    min_num: str = "4",
+    before_cluster: str = "beforeCluster",
+):
+    """PCA/UMAP of all genes as returned by /qc/all/..., or silhouette scores as /qc/sil/all/... if meta_col is given"""
+    report_progress(0.1, f"Running {dimensionality_reduction_method}")
+    return qc_app.main(
+        utils.DataType(input_data_type),
+        cohort_index,
+        dimensionality_reduction_method,
+        use_ref,
+        use_replicate,
+        topas_genes=[],
+        meta_col_silhoutte=meta_col,
+        do_only_silhouette=meta_col is not None,
+        min_num_patients=int(min_num),
+        before_cluster=before_cluster == "beforeCluster",
+        custom_list_patients=custom_patients,
+        min_sample_occurrence_ratio=float(imputation_ratio),
+    )
+
+
+def _run_correlation_job(
+    cohorts_db,
+    report_progress,
+    cohort_index: str,
+    level: str,
+    identifier: str,
+    level_2: str,
+    intensity_unit: str,
+    patients_list: str = "all",
+) -> pd.DataFrame:
+    correlation_df, error_code = cp.get_correlation_table(
+        cohorts_db,
+        int(cohort_index),
+        identifier,
+        utils.DataType(level),
+        utils.DataType(level_2),
+        utils.IntensityUnit(intensity_unit),
+        patients_list=None if patients_list == "all" else patients_list.split(","),
+    )
+    if correlation_df is None:
+        raise ValueError(error_code)
+    return correlation_df
+
+
+def _run_differential_job(
+    cohorts_db,
+    report_progress,
+    cohort_index: str,
+    level: str,
+    grp1_ind: str,
+    grp2_ind: str,
+    y_axis_type: str = "p_values",
+) -> pd.DataFrame:
+    return differential_test.get_data_for_t_test(
+        cohorts_db,
+        int(cohort_index),
+        grp1_ind,
+        grp2_ind,
+        utils.DataType(level),
+        y_axis_type,
+    )
+
+
+def _run_entity_scores_job(cohorts_db, report_progress, cohort_index: str) -> pd.DataFrame:
+    models_pickle = cohorts_db.config.config.get(
+        "entity_models", entityscore_app.FINAL_MODELS_PICKLE
+    )
+    return entityscore_app.get_entity_probabilities_df(cohort_index, models_pickle)
+
+
+jobs.register_job_type("qc", _run_qc_job)
+jobs.register_job_type("correlation", _run_correlation_job, cp.CORRELATION_COLUMNS)
+jobs.register_job_type(
+    "differential", _run_differential_job, differential_test.DIFFERENTIAL_COLUMNS
+)
+jobs.register_job_type("entity_scores", _run_entity_scores_job)
+
+
+@jobs_page.route(ApiRoutes.JOBS)
+# http://localhost:3832/jobs
+def list_jobs():
+    return jsonify(jobs.list_jobs())
+
+
+@jobs_page.route(ApiRoutes.JOB_SUBMIT, methods=["GET", "POST"])
+# http://localhost:3832/jobs/submit/qc?cohort_index=0&input_data_type=fp&dimensionality_reduction_method=umap
+# http://localhost:3832/jobs/submit/correlation?cohort_index=0&level=protein&identifier=EGFR&level_2=psite&intensity_unit=z_scored
+# http://localhost:3832/jobs/submit/differential?cohort_index=0&level=protein&grp1_ind=I007-031-108742&grp2_ind=index
+# http://localhost:3832/jobs/submit/entity_scores?cohort_index=0
+def submit_job(job_type: str):
+    """Submits a job with the query arguments (or JSON body) as parameters, returns its state with the job id"""
+    params = request.args.to_dict()
+    if request.is_json:
+        params.update({key: str(value) for key, value in request.get_json().items()})
+    try:
+        state = jobs.submit_job(cohorts_db, job_type, params)
+    except ValueError as err:
+        return str(err), 400
+    return jsonify(state)
+
+
+@jobs_page.route(ApiRoutes.JOB_STATUS)
+# http://localhost:3832/jobs/0123456789abcdef
+def job_status(job_id: str):
+    state = jobs.get_job_state(job_id)
+    if state is None:
+        return f"Unknown job {job_id}", 404
+    return jsonify(state)
+
+
+@jobs_page.route(ApiRoutes.JOB_RESULT)
+# http://localhost:3832/jobs/0123456789abcdef/result
+# http://localhost:3832/jobs/0123456789abcdef/result?limit=200&sort=FDR
+def job_result(job_id: str):
+    """Result of a finished job, tables can be paged, sorted and filtered like /correlation and /differential"""
+    try:
+        result = jobs.get_job_result(job_id)
+    except ValueError as err:
+        return str(err), 409
+    if isinstance(result, pd.DataFrame):
+        job_type = jobs.get_job_type(jobs.get_job_state(job_id)["type"])
+        try:
+            return result_tables.result_table_to_json(
+                result,
+                result_tables.ResultTableQuery.from_request_args(request.args),
+                job_type.result_columns,
+            )
+        except result_tables.InvalidResultTableQueryError as err:
+            return str(err), 400
+    return jsonify(result)
+
+
+@jobs_page.route(ApiRoutes.JOB_CANCEL)
+# http://localhost:3832/jobs/0123456789abcdef/cancel
+def cancel_job(job_id: str):
+    state = jobs.cancel_job(job_id)
+    if state is None:
+        return f"Unknown job {job_id}", 404
+    return jsonify(state)
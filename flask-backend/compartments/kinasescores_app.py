@@ -2,6 +2,8 @@ from flask import Blueprint
 
 import db
 from topas_portal import utils
+from topas_portal import sample_metadata
+from topas_portal import response_cache
 import topas_portal.kinase_scores_prepare as kinase_prepare
 
 
@@ -19,6 +21,7 @@ cohorts_db = db.cohorts_db
 @kinasescore_page.route(
     "/kinasescores/<cohort_index>/<patient_or_entity>/<selected_patient_or_entities>/<selected_kinases>/<plot_type>/<one_vs_all>"
 )
+@response_cache.conditional_response
 # http://localhost:3832/kinasescores/0/entity/UCEC/ABL1/heatmap/none_vs_all
 # http://localhost:3832/kinasescores/0/entity/UCEC/ABL1/dendro/none_vs_all
 # http://localhost:3832/kinasescores/0/entity/UCEC/ABL1/swarm/none_vs_all
@@ -31,11 +34,7 @@ def kinase_scores_plot(
     one_vs_all=False,
 ):
     """Returns a plotly heatmap with dendrograms as json"""
-    sample_annotation_df = cohorts_db.get_sample_annotation_df(cohort_index)
-    if "Entity" in sample_annotation_df.columns:
-        sample_annotation_df = sample_annotation_df.drop(["Entity"], axis=1)
-    patien_meta_df = cohorts_db.get_patient_metadata_df(cohort_index)
-    final_df = utils.merge_with_patients_meta_df(sample_annotation_df, patien_meta_df)
+    final_df = sample_metadata.get_sample_metadata(cohorts_db, cohort_index).get_annotated_samples_df()
     annotation_df = final_df.dropna()
 
     if one_vs_all == "one_vs_all":
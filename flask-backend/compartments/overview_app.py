@@ -1,7 +1,8 @@
 
-from topas_portal.plotly_preprocess import get_piechart
 from flask import Blueprint, jsonify
 from topas_portal import settings
+from topas_portal import response_cache
+from topas_portal import qc_summary
 import db
 import pandas as pd
 
@@ -16,6 +17,13 @@ overview_page = Blueprint(
 
 cohorts_db = db.cohorts_db
 
+def get_piechart(label_list, value_list):
+    # plotly is imported on first use, it slows down the worker start
+    from topas_portal import plotly_preprocess
+
+    return plotly_preprocess.get_piechart(label_list, value_list)
+
+
 def get_entity_count(meta_df,meta_type:str,least_number:int=10):
     """
     meta_df: pd.dataframe: it is the patients meta data
@@ -32,6 +40,7 @@ def get_entity_count(meta_df,meta_type:str,least_number:int=10):
 
 
 @overview_page.route("/overview/entity_count/<cohort_ind>/<meta_type>/<least_number>")
+@response_cache.conditional_response
 # http://localhost:3832/overview/entity_count/0/code_oncotree/10
 def get_entity_scores_cohort(cohort_ind,meta_type,least_number):
     return get_entity_count(cohorts_db.get_patient_metadata_df(cohort_ind).copy(),meta_type=meta_type,least_number=int(least_number))
@@ -45,16 +54,10 @@ def get_meta_types():
     
 
 @overview_page.route("/overview/mod_seq_type/<cohort_ind>")
+@response_cache.conditional_response
 # http://localhost:3832/overview/mod_seq_type/0
 def get_phospho_data_type(cohort_ind):
-    df = cohorts_db.get_psite_abundance_df(cohort_ind).dropna(how='all')
-    df['mod_type'] = None
-    df['mod_type'][df.index.str.contains('pT')] = 'Phospho Threonine'
-    df['mod_type'][df.index.str.contains('pS')] = 'Phospho Serine'
-    df['mod_type'][df.index.str.contains('pY')] = 'Phospho Tyrosine'
-    countsdata = df['mod_type'].value_counts()
+    countsdata = qc_summary.get_modification_type_counts(cohorts_db, cohort_ind)
     value_list = countsdata.tolist()
     label_list = countsdata.index.tolist()
     return get_piechart(label_list,value_list)
-
-
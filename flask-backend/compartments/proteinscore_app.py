@@ -4,6 +4,7 @@ import db
 from flask import Blueprint, jsonify
 
 from topas_portal import utils
+from topas_portal import response_cache
 
 
 proteinscore_page = Blueprint(
@@ -49,6 +50,7 @@ def get_protein_scores(cohort_index: int, item_name: str):
 
 
 @proteinscore_page.route("/proteinscore/<cohort_ind>/patient/<patient_name>")
+@response_cache.conditional_response
 # http://localhost:3832/proteinscore/0/patient/I007-031-108742
 def get_protein_scores_per_patient(cohort_ind, patient_name):
     """The list of metadata to show in the QC coloring combobox"""
@@ -56,6 +58,7 @@ def get_protein_scores_per_patient(cohort_ind, patient_name):
 
 
 @proteinscore_page.route("/proteinscore/<cohort_index>/patients_list")
+@response_cache.conditional_response
 # http://localhost:3832/proteinscore/0/patients_list
 def get_protein_patients_list(cohort_index):
     """The list of metadata to show in the QC coloring combobox"""
@@ -9,10 +9,11 @@ import numpy as np
 import db
 from topas_portal import utils
 from topas_portal import settings
+from topas_portal import response_cache
+from topas_portal import silhouette
+from topas_portal import sample_metadata
 import topas_portal.pca_umap as qc_meta
 
-from sklearn.metrics import silhouette_samples
-
 qc_page = Blueprint(
     "qc_page", __name__, static_folder="../dist/static", template_folder="../dist"
 )
@@ -33,7 +34,8 @@ def main(
     before_cluster: bool = True,
     custom_list_patients = [],
     min_sample_occurrence_ratio = 0.9,
-    
+    project_to_reference: bool = False,
+    approximate_silhouette: Optional[bool] = None,
 ):
     """
     Performs PCA or UMAP dimensionality reduction on proteomics or phospho-proteomics data 
@@ -52,6 +54,8 @@ def main(
         before_cluster (bool): If True, uses data before clustering for silhouette analysis. Defaults to True.
         custom_list_patients (Any): A list of patient sample names or 'all' to use all samples. Defaults to an empty list.
         min_sample_occurrence_ratio (float): Minimum required occurrence ratio for a sample to be considered. Defaults to 0.9.
+        project_to_reference (bool): If True, projects the samples into the reference embedding of the layer (fitted on all patients) instead of refitting. Defaults to False.
+        approximate_silhouette (Optional[bool]): If True, approximates the silhouette scores with a subset of the samples. Defaults to None, which approximates them only for very large cohorts.
 
     Returns:
         Dict[str, Any]: A dictionary containing:
@@ -98,6 +102,15 @@ def main(
     patients_df = cohorts_db.get_patient_metadata_df(cohort_index)
     if not custom_list_patients == 'all':
         patients_df = patients_df[patients_df['Sample name'].isin(custom_list_patients)]
+
+    reference_model = None
+    if project_to_reference:
+        reference_model = qc_meta.get_reference_model(
+            cohort_index,
+            input_data_type,
+            dimensionality_reduction_method,
+            min_sample_occurrence_ratio=min_sample_occurrence_ratio,
+        )
     all_principal_dfs, all_principal_variances, imputed_data, metadata_df = (
         qc_meta.do_pca(
             topas_genes,
@@ -109,7 +122,9 @@ def main(
             include_reference_channels=use_ref,
             dimensionality_reduction_method=dimensionality_reduction_method,
             include_replicates=use_replicate,
-            only_ref_channels=only_ref_channels
+            only_ref_channels=only_ref_channels,
+            reference_model=reference_model,
+            return_imputed_data=do_only_silhouette and before_cluster,
         )
     )
 
@@ -126,6 +141,8 @@ def main(
             metadata_df.set_index("Sample name"),
             meta_col_silhoutte,
             min_num_patients=min_num_patients,
+            cohort_index=cohort_index,
+            approximate=approximate_silhouette,
         )
 
     pc_df = pd.DataFrame(all_principal_dfs[0])
@@ -135,9 +152,10 @@ def main(
     )
     pc_df["Sample name"] = pc_df["Sample"]
     pc_df = pc_df[["Sample name", "pc1", "pc2", "Sample"]]
-    pc_df = utils.merge_with_sample_annotation_df(pc_df, sample_annotation_df)
+    cohort_sample_metadata = sample_metadata.get_sample_metadata(cohorts_db, cohort_index)
+    pc_df = cohort_sample_metadata.merge_with_sample_annotation(pc_df)
     print(pc_df)
-    pc_df = utils.merge_with_patients_meta_df(pc_df, patients_df)
+    pc_df = cohort_sample_metadata.merge_with_patients_meta(pc_df)
     print(pc_df)
     pcs_vars = all_principal_variances[0]
     string_cols = settings.QC_STRING_META  # meta data with string values
@@ -158,20 +176,22 @@ def main(
 
     var1 = 0
     var2 = 0
-    if dimensionality_reduction_method == "ppca":
+    if dimensionality_reduction_method in ["ppca", "rsvd", "softimpute"]:
         var1 = round(pcs_vars[0], 2)
         var2 = round(pcs_vars[1], 2)
 
     # SCALING THE PCS BETWEEN -1 AND 1
-    pc_df[pc_cols[0]] = np.interp(
-        pc_df[pc_cols[0]], (pc_df[pc_cols[0]].min(), pc_df[pc_cols[0]].max()), (-0.95, 0.95)
-    )
-    pc_df[pc_cols[1]] = np.interp(
-        pc_df[pc_cols[1]], (pc_df[pc_cols[1]].min(), pc_df[pc_cols[1]].max()), (-0.95, 0.95)
-    )
+    pc_ranges = [(pc_df[pc_col].min(), pc_df[pc_col].max()) for pc_col in pc_cols[:2]]
+    if reference_model is not None:
+        # same scale for every projection, samples outside the reference end up at the border
+        pc_ranges = reference_model.component_ranges
+    pc_df[pc_cols[0]] = np.interp(pc_df[pc_cols[0]], pc_ranges[0], (-0.95, 0.95))
+    pc_df[pc_cols[1]] = np.interp(pc_df[pc_cols[1]], pc_ranges[1], (-0.95, 0.95))
     pc_df["index"] = pc_df.index
     pcs_dict = pc_df.to_dict(orient="records")
     pcs_dict = {"dataFrame": pcs_dict, "pcVars": [var1, var2]}
+    if reference_model is not None:
+        pcs_dict["reference"] = reference_model.get_info()
 
     return pcs_dict
 
@@ -181,12 +201,16 @@ def calculate_silhouette_scores(
     meta_df: pd.DataFrame,
     meta_col_silhoutte: str,
     min_num_patients: int = 4,
+    cohort_index: Optional[int] = None,
+    approximate: Optional[bool] = None,
 ) -> pd.DataFrame:
     """
     calculates the silhoette score per sample
     :silhoutte_input_df: an indexed data frame with the patients as the index
     :meta_data_df: an indexed data frame with the patient ids as the index
     :meta_col_silhouette: the column name used as the class labels
+    :cohort_index: caches the distances between the samples for this cohort, such that they are reused for other meta_col_silhouette
+    :approximate: see silhouette.get_silhouette_samples
     """
     meta_data_df = meta_df.copy()
     count_dict = meta_data_df[meta_col_silhoutte].value_counts().to_dict()
@@ -194,11 +218,13 @@ def calculate_silhouette_scores(
     meta_data_df = meta_data_df[meta_data_df["count"] >= int(min_num_patients)]
 
     common_samples = utils.intersection(meta_data_df.index, silhoutte_input_df.index)
-    silhoutte_input_df = silhoutte_input_df.loc[common_samples, :].to_numpy()
     meta_data = meta_data_df.loc[common_samples, meta_col_silhoutte].to_numpy()
+    silhouette_scores = silhouette.get_silhouette_samples(
+        silhoutte_input_df, common_samples, meta_data, cohort_index, approximate=approximate
+    )
 
     silhouete_df = pd.DataFrame(
-        list(zip(silhouette_samples(silhoutte_input_df, meta_data), meta_data)),
+        list(zip(silhouette_scores, meta_data)),
         columns=["silhouette_score", "meta_data"],
     )
 
@@ -236,6 +262,7 @@ def metadata():
 @qc_page.route(
     "/qc/all/<input_data_type>/<cohort_index>/<dimensionality_reduction_method>/<use_ref>/<use_replicate>/<custom_patients>/<imputation_ratio>"
 )
+@response_cache.cached_response
 # http://localhost:3832/qc/all/fp/Intensity/0/ppca/noref/replicate/0.9
 def quality_control_all_genes(
     input_data_type,
@@ -261,6 +288,65 @@ def quality_control_all_genes(
     return Response(json.dumps(PCA_umap_dic), mimetype="application/json")
 
 
+@qc_page.route(
+    "/qc/project/<input_data_type>/<cohort_index>/<dimensionality_reduction_method>/<use_ref>/<use_replicate>/<custom_patients>/<imputation_ratio>"
+)
+# http://localhost:3832/qc/project/fp/0/ppca/noref/replicate/all/0.9
+# http://localhost:3832/qc/project/fp/0/umap/ref/noreplicate/H021-UQBN7H-T2,H021-S1WQZ5-M1/0.9
+def quality_control_project_to_reference(
+    input_data_type,
+    cohort_index,
+    dimensionality_reduction_method,
+    use_ref,
+    use_replicate,
+    custom_patients,
+    imputation_ratio
+):
+    """
+    Like /qc/all, but projects the samples into the reference embedding of the layer, fitted
+    once on all patients of the cohort, such that the coordinates are comparable between
+    batches, patient selections and reloads. The reference embedding is only fitted if it does
+    not exist yet, see /qc/reference/refit to fit it again.
+    """
+    PCA_umap_dic = main(
+        utils.DataType(input_data_type),
+        cohort_index,
+        dimensionality_reduction_method,
+        use_ref,
+        use_replicate,
+        topas_genes=[],
+        custom_list_patients=custom_patients,
+        min_sample_occurrence_ratio=float(imputation_ratio),
+        project_to_reference=True,
+    )
+    return Response(json.dumps(PCA_umap_dic), mimetype="application/json")
+
+
+@qc_page.route(
+    "/qc/reference/refit/<input_data_type>/<cohort_index>/<dimensionality_reduction_method>/<imputation_ratio>",
+    methods=["POST"],
+)
+# curl -X POST http://localhost:3832/qc/reference/refit/fp/0/umap/0.9
+def refit_reference_embedding(
+    input_data_type,
+    cohort_index,
+    dimensionality_reduction_method,
+    imputation_ratio
+):
+    """
+    Fits the reference embedding of the layer again on all patients of the cohort and replaces
+    the stored one, which is shared by all following /qc/project requests.
+    """
+    reference_model = qc_meta.get_reference_model(
+        int(cohort_index),
+        utils.DataType(input_data_type),
+        dimensionality_reduction_method,
+        min_sample_occurrence_ratio=float(imputation_ratio),
+        refit=True,
+    )
+    return jsonify(reference_model.get_info())
+
+
 @qc_page.route("/uploadGenes", methods=["POST"])
 def useruploadGenes():
     """Upload a file with the names of the proteins one perline as a one column csv"""
@@ -368,7 +454,16 @@ def sil_df_all_genes(
         min_num_patients=min_num,
         before_cluster=beforeCluster,
         custom_list_patients = custom_patients,
-        min_sample_occurrence_ratio=imputation_ratio
+        min_sample_occurrence_ratio=imputation_ratio,
+        approximate_silhouette=_get_approximate_arg(),
     )
 
     return utils.df_to_json(sil_df)
+
+
+def _get_approximate_arg() -> Optional[bool]:
+    """?approximate=true/false forces or disables approximate silhouette scores"""
+    approximate = request.args.get("approximate")
+    if approximate is None:
+        return None
+    return approximate == "true"
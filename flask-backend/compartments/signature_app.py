@@ -0,0 +1,64 @@
+import db
+
+from flask import Blueprint, current_app, jsonify, request
+
+from topas_portal import utils
+import topas_portal.IFN_topas_scoring as signature_scoring
+
+
+signature_page = Blueprint(
+    "signature_page",
+    __name__,
+    static_folder="../dist/static",
+    template_folder="../dist",
+)
+
+cohorts_db = db.cohorts_db
+
+
+@signature_page.route("/signature/upload", methods=["POST"])
+def upload_signature():
+    """Upload a file with the gene names of a signature one per line, returns the signature id to score it with"""
+    if "file" not in request.files:
+        return "No signature file uploaded", 400
+    try:
+        lines = request.files["file"].read().decode("UTF-8").splitlines()
+    except UnicodeDecodeError as err:
+        return f"{type(err).__name__}: {err}", 400
+    signature_genes = [line.strip() for line in lines if line.strip()]
+    if len(signature_genes) == 0:
+        return "The signature file contains no gene names", 400
+
+    signature_id = signature_scoring.register_signature(
+        signature_genes, current_app.config["UPLOAD_FOLDER"]
+    )
+    return jsonify({"signature_id": signature_id, "num_genes": len(set(signature_genes))})
+
+
+@signature_page.route("/signature/<cohort_index>/<signature>/<aggregation>/<score_type>")
+# http://localhost:3832/signature/0/IFI27,ISG15,MX1/sum/topas_score
+# http://localhost:3832/signature/0/sig_0123456789abcdef/mean/z_score
+def get_signature_scores(cohort_index, signature, aggregation, score_type):
+    """Scores all patients of a cohort for a comma separated gene list or an uploaded signature id"""
+    try:
+        signature_genes = signature_scoring.resolve_signature_genes(
+            signature, current_app.config["UPLOAD_FOLDER"]
+        )
+    except FileNotFoundError as err:
+        return str(err), 404
+
+    if aggregation not in signature_scoring.SIGNATURE_AGGREGATIONS:
+        return (
+            f"Unknown aggregation {aggregation}, "
+            f"expected one of {signature_scoring.SIGNATURE_AGGREGATIONS}",
+            400,
+        )
+
+    signature_scores_df = signature_scoring.get_signature_scores(
+        cohorts_db,
+        cohort_index,
+        signature_genes,
+        score_type=score_type,
+        aggregation=aggregation,
+    )
+    return utils.df_to_json(signature_scores_df)
@@ -1,8 +1,10 @@
 import pandas as pd
 
 import topas_portal.fetch_data_matrix as data
+from topas_portal import response_cache
 from flask import Blueprint
-from topas_portal.utils import calculate_z_scores,df_to_json,DataType,IntensityUnit,merge_with_patients_meta_df
+from topas_portal.utils import calculate_z_scores,df_to_json,DataType,IntensityUnit
+from topas_portal import sample_metadata
 import db
 
 
@@ -16,13 +18,13 @@ zscoring_page = Blueprint(
 
 cohorts_db = db.cohorts_db
 
-def main(annot_df:pd.DataFrame,meta_df:pd.DataFrame,patient_identifiers:list,identifier:str,metadata_type:str):
+def main(annot_df:pd.DataFrame,cohort_sample_metadata:sample_metadata.SampleMetadata,patient_identifiers:list,identifier:str,metadata_type:str):
     """
     Computes z-scores for annotation data based on metadata and returns the processed results in JSON format.
 
     Args:
         annot_df (pd.DataFrame): The annotation DataFrame containing sample-related data.
-        meta_df (pd.DataFrame): The metadata DataFrame containing patient information.
+        cohort_sample_metadata (SampleMetadata): The sample and patient metadata of the cohort.
         patient_identifiers (List[str]): A list of possible categories or values relevant to the analysis.
         identifier (str): The identifier used for grouping or reference in the analysis.
         meta_col (str): The metadata column to be used for z-score calculations.
@@ -31,13 +33,13 @@ def main(annot_df:pd.DataFrame,meta_df:pd.DataFrame,patient_identifiers:list,ide
         str: A JSON-formatted string containing the processed z-score data.
 
     Notes:
-        - Merges `annot_df` with `meta_df` based on the "Sample name" column.
+        - Merges `annot_df` with the patient metadata based on the "Sample name" column.
         - Computes z-scores for the specified metadata column using `calculate_sub_df_zscores`.
         - Applies post-processing using `post_process_final_df`.
         - Fills NaN values in the z-scores column with the minimum value minus one.
         - Converts the final DataFrame into JSON format using `df_to_json`.
     """
-    raw_df = merge_with_patients_meta_df(annot_df,meta_df)
+    raw_df = cohort_sample_metadata.merge_with_patients_meta(annot_df)
     zscores_df = calculate_sub_df_zscores(raw_df,patient_identifiers,identifier,metadata_type)
     zscores_df = post_process_final_df(zscores_df)
     return df_to_json(zscores_df)
@@ -107,6 +109,7 @@ def post_process_final_df(df:pd.DataFrame) -> pd.DataFrame:
 
 
 @zscoring_page.route("/zscore/<level>/<int:cohort_index>/<identifier>/<patient_identifiers>/<metadata_type>")
+@response_cache.conditional_response
 # http://localhost:3832/zscore/protein/0/EGFR/MASTER,CATCH/Program
 def get_subcohort_zscores(level: str, cohort_index: int, identifier: str, patient_identifiers: str, metadata_type: str):
     """
@@ -163,9 +166,9 @@ def get_subcohort_zscores(level: str, cohort_index: int, identifier: str, patien
     else: 
         input_df['Sample name'] = input_df.index
     
-    meta_df = cohorts_db.get_patient_metadata_df(cohort_index)
+    cohort_sample_metadata = sample_metadata.get_sample_metadata(cohorts_db, cohort_index)
 
-    return main(input_df,meta_df,patient_identifiers,identifier,metadata_type)
+    return main(input_df,cohort_sample_metadata,patient_identifiers,identifier,metadata_type)
 
 
     
\ No newline at end of file
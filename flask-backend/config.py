@@ -2,10 +2,21 @@ import json
 
 from topas_portal import settings
 from topas_portal import utils
+from topas_portal import result_cache
 
 # imports just for type hints
 from logger import CohortLogger
 
+# config entries with the input files that are shared by all cohorts
+GLOBAL_DATA_CONFIG_KEYS = [
+    "transcriptomics_path_z_scored",
+    "transcriptomics_path_not_z_scored",
+    "genomics_path",
+    "oncokb_path",
+    "basket_annotation_path",
+    "fasta_file",
+]
+
 
 class CohortConfig:
     def __init__(self, config_file: str, logger: CohortLogger):
@@ -98,6 +109,29 @@ class CohortConfig:
     def get_drug_annotation_path(self) -> str:
         return self.config["drug_annotation_path"]
 
+    def get_cohort_data_fingerprint(self, cohort_name: str) -> str:
+        """Changes when the input files or settings of the cohort change."""
+        cohort_config = {
+            key: values[cohort_name]
+            for key, values in self.get_config().items()
+            if isinstance(values, dict) and cohort_name in values
+        }
+        return result_cache.get_files_fingerprint(
+            [
+                cohort_config.get("report_directory"),
+                cohort_config.get("sample_annotation_path"),
+                cohort_config.get("patient_annotation_path"),
+            ],
+            json.dumps(cohort_config, sort_keys=True),
+        )
+
+    def get_global_data_fingerprint(self) -> str:
+        """Changes when the input files shared by all cohorts change."""
+        config = self.get_config()
+        return result_cache.get_files_fingerprint(
+            [config.get(key) for key in GLOBAL_DATA_CONFIG_KEYS]
+        )
+
 
 def get_config_path():
     config_path = settings.PORTAL_CONFIG_FILE
@@ -0,0 +1,65 @@
+import os
+
+os.environ["CONFIG_FILE_PATH"] = "tests/test_config.json"
+
+import numpy as np
+import pandas as pd
+
+from compartments import entityscore_app
+
+
+def _model_df(coefficients, intercept, seed):
+    """One row model as in the entity models pickle: coefficients, intercept, then the metrics"""
+    metrics = np.random.default_rng(seed).random(4)
+    return pd.DataFrame(
+        [[*coefficients.values(), intercept, *metrics]],
+        columns=[*coefficients.keys(), "Intercept", "F1_1", "F1_0", "F1_weighted", "MCC_score"],
+    )
+
+
+def _per_model_probabilities(df_clean, df_coefficients):
+    """Probabilities of a single model, as computed before the models were compiled"""
+    coeff = np.zeros(df_clean.shape[0])
+    for protein in df_coefficients.iloc[:, :-5].columns:
+        if protein not in df_clean.columns:
+            continue
+        coeff = coeff + df_clean[protein].to_numpy() * df_coefficients.iloc[0][protein]
+    return entityscore_app.logistic_function(coeff + df_coefficients.iloc[0]["Intercept"])
+
+
+def test_compiled_models_match_per_model_scores():
+    final_models = {
+        "LUAD": _model_df({"EGFR": 0.8, "KRAS": -0.5, "ALK": 1.2}, -0.3, seed=0),
+        "CHDM": _model_df({"TBXT": 2.0, "KRT8": 0.4}, 0.1, seed=1),
+        # MISSING is not measured in the cohort and does not contribute
+        "SCLC": _model_df({"ASCL1": 1.5, "MISSING": 3.0, "EGFR": -0.2}, -1.0, seed=2),
+        # MYC is still missing for the second sample after imputation
+        "BRCA": _model_df({"ESR1": 0.9, "MYC": 0.7}, 0.2, seed=3),
+    }
+    proteins = ["EGFR", "KRAS", "ALK", "TBXT", "KRT8", "ASCL1", "ESR1", "MYC", "TP53"]
+    df_clean = pd.DataFrame(
+        np.random.default_rng(4).standard_normal((5, len(proteins))),
+        index=[f"pat_{i}" for i in range(5)],
+        columns=proteins,
+    )
+    df_clean.loc["pat_1", "MYC"] = np.nan
+
+    coefficients_df, uses_protein_df, intercepts = entityscore_app.compile_entity_models(
+        final_models
+    )
+    assert "MCC_score" not in coefficients_df.columns
+    assert "Intercept" not in coefficients_df.columns
+    assert not uses_protein_df.loc["CHDM", "EGFR"]
+    probabilities = entityscore_app.calculation_entity_probabilities(
+        df_clean, coefficients_df, uses_protein_df, intercepts
+    )
+
+    assert list(probabilities.columns) == list(final_models)
+    pd.testing.assert_index_equal(probabilities.index, df_clean.index)
+    for entity, model_df in final_models.items():
+        np.testing.assert_allclose(
+            probabilities[entity].to_numpy(), _per_model_probabilities(df_clean, model_df)
+        )
+    assert np.isnan(probabilities.loc["pat_1", "BRCA"])
+    assert probabilities.drop(index="pat_1")["BRCA"].notna().all()
+    assert probabilities.drop(columns="BRCA").notna().all().all()
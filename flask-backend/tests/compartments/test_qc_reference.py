@@ -0,0 +1,46 @@
+import os
+
+os.environ["CONFIG_FILE_PATH"] = "tests/test_config.json"
+
+import pytest
+from app import app
+from compartments import qc_app
+
+
+class FakeReferenceModel:
+    def get_info(self):
+        return {"method": "umap", "numSamples": 3}
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+
+def test_reference_embedding_is_only_refitted_by_post(client, monkeypatch):
+    calls = []
+
+    def get_reference_model(cohort_index, plot_type, method_name, **kwargs):
+        calls.append((cohort_index, plot_type, method_name, kwargs))
+        return FakeReferenceModel()
+
+    monkeypatch.setattr(qc_app.qc_meta, "get_reference_model", get_reference_model)
+
+    # the generic error handler of the app reports the 405 as an error response
+    response = client.get("/qc/reference/refit/fp/0/umap/0.9")
+    assert response.status_code != 200
+    assert "405 Method Not Allowed" in response.get_data(as_text=True)
+    assert calls == []
+
+    response = client.post("/qc/reference/refit/fp/0/umap/0.9")
+    assert response.status_code == 200
+    assert response.get_json() == {"method": "umap", "numSamples": 3}
+    assert calls == [
+        (
+            0,
+            qc_app.utils.DataType.FP,
+            "umap",
+            {"min_sample_occurrence_ratio": 0.9, "refit": True},
+        )
+    ]
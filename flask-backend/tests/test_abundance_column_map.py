@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from topas_portal import prexp_preprocess
+
+
+def _abundances_df():
+    return pd.DataFrame(
+        [[1.0, np.nan, 3.0, 4.0, "EGFR", 5.0, 2.0, np.nan]],
+        columns=[
+            "pat_b Z-score",
+            "pat_b Intensity",
+            "pat_a Z-score",
+            "pat_a Intensity",
+            "Gene names",
+            "pat_c-R2 Z-score",
+            "pat_c-R2 Intensity",
+            "pat_d Z-score",
+        ],
+        index=["EGFR"],
+    )
+
+
+def _expected_table(abundances):
+    abundances_table = prexp_preprocess.get_expression_data_from_abundance_df(abundances)
+    abundances_table = prexp_preprocess.add_is_replicate_column(abundances_table)
+    return abundances_table
+
+
+def test_gathered_table_matches_pivot():
+    abundances = _abundances_df()
+    column_map = prexp_preprocess.AbundanceColumnMap(abundances.columns)
+
+    pd.testing.assert_frame_equal(
+        column_map.get_expression_data(abundances),
+        _expected_table(abundances),
+        check_names=False,
+    )
+
+
+def test_gathered_table_with_fold_changes_matches_pivot():
+    abundances = _abundances_df().drop(columns="Gene names")
+    abundances.insert(0, "pat_a FC", 0.5)
+    column_map = prexp_preprocess.AbundanceColumnMap(abundances.columns)
+
+    pd.testing.assert_frame_equal(
+        column_map.get_expression_data(abundances),
+        _expected_table(abundances),
+        check_names=False,
+    )
+    pd.testing.assert_frame_equal(
+        prexp_preprocess.add_occurence_rank(column_map.get_expression_data(abundances)),
+        prexp_preprocess.add_occurence_rank(_expected_table(abundances)),
+        check_names=False,
+    )
+
+
+def test_column_map_is_rebuilt_for_other_columns():
+    abundances = _abundances_df()
+    level = prexp_preprocess.utils.DataType.FULL_PROTEOME
+    include_ref = prexp_preprocess.utils.IncludeRef.EXCLUDE_REF
+
+    column_map = prexp_preprocess.get_abundance_column_map(
+        41, level, include_ref, abundances.columns
+    )
+    assert (
+        prexp_preprocess.get_abundance_column_map(41, level, include_ref, abundances.columns.copy())
+        is column_map
+    )
+    other_columns = abundances.columns.drop("pat_d Z-score")
+    assert (
+        prexp_preprocess.get_abundance_column_map(41, level, include_ref, other_columns)
+        is not column_map
+    )
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from topas_portal import utils
+from topas_portal import density_plots
+
+
+def _abundance_df():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.standard_normal((30, 6)),
+        index=[f"protein_{i}" for i in range(30)],
+        columns=["pat_1", "pat_2", "pat_3", "pat_4", "ref_1", "ref_2"],
+    )
+    df.iloc[2, 1] = np.nan
+    return df
+
+
+def test_density_plot_matches_utils():
+    df = _abundance_df()
+    samples_list = ["pat_1", "pat_2", "pat_3", "pat_4", "pat_5"]
+    background_histogram = density_plots.BackgroundHistogram(df, samples_list)
+
+    for identifier in ["protein_2", "protein_7"]:
+        pd.testing.assert_frame_equal(
+            background_histogram.get_density_plot_df(df.loc[[identifier]], identifier),
+            utils.count_df_to_density_plot_df(df, identifier, samples_list),
+        )
+
+
+def test_density_plot_of_all_columns_matches_utils():
+    df = _abundance_df()
+    background_histogram = density_plots.BackgroundHistogram(df)
+
+    pd.testing.assert_frame_equal(
+        background_histogram.get_density_plot_df(df, "protein_3"),
+        utils.count_df_to_density_plot_df(df, "protein_3", list(df.columns)),
+    )
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from topas_portal import detection_index
+
+
+def _intensity_df(n_features=21, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.standard_normal((n_features, 5))
+    values[rng.random(values.shape) < 0.4] = np.nan
+    return pd.DataFrame(
+        values,
+        index=[f"protein_{i}" for i in range(n_features)],
+        columns=["pat_1", "pat_2", "pat_3", "pat_4", "ref_1"],
+    )
+
+
+def _sample_annotation_df():
+    return pd.DataFrame(
+        {
+            "Sample name": ["pat_1", "pat_2", "pat_3", "pat_4", "pat_5"],
+            "Batch_No": [1, 1, 2, 2, 3],
+        }
+    )
+
+
+def test_members_match_detected_features():
+    intensity_df = _intensity_df()
+    sample_annotation_df = _sample_annotation_df()
+    bitmap = detection_index.DetectionBitmap(intensity_df, sample_annotation_df)
+
+    for patient in ["pat_1", "pat_4"]:
+        expected = set(intensity_df.index[intensity_df[patient].notna()])
+        members = bitmap.get_members(bitmap.get_patient_bits(patient))
+        assert sorted(members) == sorted(expected)
+
+    # a batch detects the features with an intensity in all of its samples
+    for batch, samples in [("1", ["pat_1", "pat_2"]), ("2", ["pat_3", "pat_4"]), ("3", [])]:
+        if samples:
+            expected = set(intensity_df.index[intensity_df[samples].notna().all(axis=1)])
+        else:
+            expected = set()
+        members = bitmap.get_members(bitmap.get_batch_bits(batch))
+        assert sorted(members) == sorted(expected)
+
+
+def test_unknown_data_layer_is_rejected():
+    with pytest.raises(ValueError):
+        detection_index.get_detection_bitmap(None, 0, "protein")
+    with pytest.raises(ValueError):
+        detection_index.get_detection_bitmap(None, 0, "unknown")
+
+
+def test_compare_groups_matches_sets():
+    intensity_df = _intensity_df()
+    bitmap = detection_index.DetectionBitmap(intensity_df, _sample_annotation_df())
+    groups = ["pat_1", "pat_2", "pat_3"]
+    sets = [set(intensity_df.index[intensity_df[group].notna()]) for group in groups]
+
+    result = detection_index.compare_groups(
+        bitmap, "patients", groups, region=["pat_1", "pat_3"]
+    )
+
+    assert result["sizes"] == {group: len(s) for group, s in zip(groups, sets)}
+    assert result["intersection"] == len(sets[0] & sets[1] & sets[2])
+    assert result["union"] == len(sets[0] | sets[1] | sets[2])
+    assert result["unique"]["pat_2"] == len(sets[1] - sets[0] - sets[2])
+    assert len(result["regions"]) == 7
+    assert sum(region["count"] for region in result["regions"]) == result["union"]
+    assert set(result["region"]["members"]) == (sets[0] & sets[2]) - sets[1]
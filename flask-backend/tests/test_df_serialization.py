@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+from topas_portal import utils
+
+
+def _example_df():
+    return pd.DataFrame(
+        {
+            "Gene names": ["EGFR", "SRC", None],
+            "r": [0.5, np.nan, -0.25],
+            "n": np.array([3, 4, 5], dtype=np.int64),
+        }
+    )
+
+
+def test_df_to_json_records():
+    records = json.loads(utils.df_to_json_records(_example_df()).decode())
+    assert records == [
+        {"Gene names": "EGFR", "r": 0.5, "n": 3},
+        {"Gene names": "SRC", "r": None, "n": 4},
+        {"Gene names": None, "r": -0.25, "n": 5},
+    ]
+
+
+def test_df_to_json_negotiates_format():
+    app = Flask(__name__)
+    df = _example_df()
+
+    with app.test_request_context("/", headers={"Accept": "application/json"}):
+        response = utils.df_to_json(df)
+        assert response.mimetype == utils.JSON_MIMETYPE
+        assert isinstance(json.loads(response.get_data().decode()), list)
+
+    with app.test_request_context("/?orient=columns"):
+        columns = json.loads(utils.df_to_json(df).get_data().decode())
+        assert columns == {
+            "Gene names": ["EGFR", "SRC", None],
+            "r": [0.5, None, -0.25],
+            "n": [3, 4, 5],
+        }
+
+    with app.test_request_context("/", headers={"Accept": utils.ARROW_STREAM_MIMETYPE}):
+        response = utils.df_to_json(df)
+        # falls back to JSON if pyarrow cannot be imported
+        if utils.df_to_arrow_stream(df) is None:
+            assert response.mimetype == utils.JSON_MIMETYPE
+        else:
+            assert response.mimetype == utils.ARROW_STREAM_MIMETYPE
+
+
+def test_json_fallback_writes_null(monkeypatch):
+    monkeypatch.setattr(utils, "orjson", None)
+    df = _example_df()
+
+    assert json.loads(utils.df_to_json_records(df))[1] == {"Gene names": "SRC", "r": None, "n": 4}
+    assert json.loads(utils.df_to_json_columns(df))["r"] == [0.5, None, -0.25]
@@ -0,0 +1,163 @@
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from topas_portal import dimensionality_reduction as dr
+
+
+def _low_rank_df(n_samples=60, n_features=40, rank=3, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n_samples, rank)) @ rng.standard_normal((rank, n_features))
+    return pd.DataFrame(x + 0.01 * rng.standard_normal((n_samples, n_features)))
+
+
+def test_randomized_pca_matches_pca():
+    df = _low_rank_df()
+
+    pca = dr.get_dimensionality_reduction_method("PCA")
+    expected = pca.fit_transform(df).to_numpy()
+    rsvd = dr.get_dimensionality_reduction_method("RSVD")
+    transformed = rsvd.fit_transform(df).to_numpy()
+
+    # principal components are only defined up to their sign
+    signs = np.sign((expected * transformed).sum(axis=0))
+    np.testing.assert_allclose(transformed * signs, expected, atol=1e-3)
+    np.testing.assert_allclose(
+        rsvd.get_explained_variances(), pca.get_explained_variances(), atol=1e-4
+    )
+    np.testing.assert_allclose(rsvd.transform(df).to_numpy(), transformed, atol=1e-3)
+
+
+def test_soft_impute_pca_recovers_missing_values():
+    df = _low_rank_df()
+    rng = np.random.default_rng(1)
+    missing = rng.random(df.shape) < 0.2
+    df_missing = df.mask(missing)
+
+    soft_impute = dr.get_dimensionality_reduction_method("SOFTIMPUTE")
+    transformed = soft_impute.fit_transform(df_missing)
+
+    assert transformed.shape == (len(df.index), 2)
+    imputed = soft_impute._imputed_data.to_numpy()
+    assert not np.isnan(imputed).any()
+    np.testing.assert_array_equal(imputed[~missing], df.to_numpy()[~missing])
+    error = np.abs(imputed[missing] - df.to_numpy()[missing])
+    assert np.median(error) < 0.1 * np.abs(df.to_numpy()).mean()
+
+    # the embedding agrees with PCA of the complete data up to the sign
+    expected = dr.get_dimensionality_reduction_method("PCA").fit_transform(df).to_numpy()
+    for component in range(2):
+        correlation = np.corrcoef(expected[:, component], transformed[component])[0, 1]
+        assert abs(correlation) > 0.95
+
+
+def test_masked_ridge_matches_ridge_per_row():
+    rng = np.random.default_rng(2)
+    x = rng.standard_normal((30, 12))
+    observed = rng.random(x.shape) < 0.5
+    observed[3] = False
+    factors = rng.standard_normal((12, 4))
+    regularization = 0.5 * np.eye(4)
+
+    x_observed = sparse.csr_matrix((x[observed], np.nonzero(observed)), shape=x.shape)
+    solutions = dr._solve_masked_ridge(x_observed, factors, regularization)
+
+    for row in range(x.shape[0]):
+        row_factors = factors[observed[row]]
+        expected = np.linalg.solve(
+            row_factors.T @ row_factors + regularization, row_factors.T @ x[row, observed[row]]
+        )
+        np.testing.assert_allclose(solutions[row], expected, atol=1e-10)
+
+
+def test_soft_impute_scales_with_observed_values():
+    # a dense fit of this shape would need 10^10 entries per iteration
+    n_rows, n_columns, num_observed = 200_000, 50_000, 20_000
+    rng = np.random.default_rng(3)
+    rows = rng.integers(0, n_rows, num_observed)
+    columns = rng.integers(0, n_columns, num_observed)
+    x_observed = sparse.csr_matrix(
+        (rng.standard_normal(num_observed), (rows, columns)), shape=(n_rows, n_columns)
+    )
+
+    soft_impute = dr.CohortSoftImputePCA(rank=3, max_iter=5)
+    a, b = soft_impute._fit_low_rank(x_observed, rank=3)
+
+    assert a.shape == (n_rows, 3)
+    assert b.shape == (n_columns, 3)
+    assert np.isfinite(a).all() and np.isfinite(b).all()
+
+
+def test_soft_impute_imputes_the_low_rank_reconstruction(monkeypatch):
+    df = _low_rank_df(n_samples=25, n_features=15)
+    rng = np.random.default_rng(4)
+    missing = rng.random(df.shape) < 0.3
+    df_missing = df.mask(missing)
+    # fill the matrix in blocks of a few rows
+    monkeypatch.setattr(dr, "CHUNK_SIZE", 40)
+
+    soft_impute = dr.get_dimensionality_reduction_method("SOFTIMPUTE")
+    fit_low_rank = soft_impute._fit_low_rank
+    factors = []
+
+    def _fit_low_rank(x_observed, rank):
+        factors.extend(fit_low_rank(x_observed, rank))
+        return factors
+
+    monkeypatch.setattr(soft_impute, "_fit_low_rank", _fit_low_rank)
+    soft_impute.fit_transform(df_missing)
+
+    a, b = factors
+    x = df_missing.to_numpy()
+    means, stds = np.nanmean(x, axis=0), np.nanstd(x, axis=0)
+    expected = (a @ b.T) * stds + means
+    imputed = soft_impute._imputed_data
+    pd.testing.assert_index_equal(imputed.columns, df.columns)
+    np.testing.assert_allclose(imputed.to_numpy()[missing], expected[missing])
+    np.testing.assert_array_equal(imputed.to_numpy()[~missing], x[~missing])
+
+    # the total variance covers the observed and the imputed values
+    standardized = np.where(missing, a @ b.T, (x - means) / stds)
+    _, singular_values, _ = np.linalg.svd(a @ b.T)
+    np.testing.assert_allclose(
+        soft_impute.get_explained_variances(),
+        np.square(singular_values[:2]) / np.square(standardized).sum(),
+    )
+
+
+def test_soft_impute_keeps_a_single_dense_copy():
+    # 32 MB of mostly missing values, the fit itself only takes memory per observed value
+    n_samples, n_features = 800, 5_000
+    rng = np.random.default_rng(5)
+    x = np.full((n_samples, n_features), np.nan)
+    observed = rng.random(x.shape) < 0.01
+    x[observed] = rng.standard_normal(observed.sum())
+    df = pd.DataFrame(x)
+    del x, observed
+
+    soft_impute = dr.get_dimensionality_reduction_method("SOFTIMPUTE")
+    tracemalloc.start()
+    try:
+        soft_impute.fit_transform(df)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert not soft_impute._imputed_data.isna().any().any()
+    # the imputed copy plus the sparse observed values and one block of the reconstruction
+    assert peak < 1.5 * df.memory_usage().sum()
+
+
+def test_heavy_modules_are_imported_on_first_use():
+    code = (
+        "import sys; import topas_portal.dimensionality_reduction; "
+        "print(any(m in sys.modules for m in ['umap', 'phate', 'numba']))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from logger import CohortLogger
+from topas_portal import result_cache
+from topas_portal import embedding_cache
+
+
+def _expression_df():
+    return pd.DataFrame(
+        np.arange(12, dtype=float).reshape(3, 4),
+        index=["pat_1", "pat_2", "pat_3"],
+        columns=["EGFR", "SRC", "MET", "ALK"],
+    )
+
+
+def test_embedding_is_reused_from_memory_and_disk(tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return embedding_cache.Embedding(
+            pd.DataFrame({0: [1.0, 2.0, 3.0], 1: [0.0, 1.0, 0.0]}), [0.5, 0.2]
+        )
+
+    def get_embedding(expression_df, key=("fp", "pca")):
+        return embedding_cache.get_embedding(
+            expression_df, 11, "cohort_11", key, compute, CohortLogger(), cache_dir=tmp_path
+        )
+
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(11, "data_1")
+
+    embedding = get_embedding(_expression_df())
+    assert get_embedding(_expression_df()) is embedding
+    assert len(calls) == 1
+
+    # a reload drops the memory cache, the persisted embedding is used
+    result_cache.invalidate_cohort(11)
+    reloaded = get_embedding(_expression_df())
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(reloaded.transformed_df, embedding.transformed_df)
+    assert reloaded.explained_variances == [0.5, 0.2]
+
+    # other parameters, samples or data give other embeddings
+    get_embedding(_expression_df(), key=("fp", "umap"))
+    get_embedding(_expression_df().iloc[:2])
+    result_cache.set_data_fingerprint(11, "data_2")
+    result_cache.invalidate_cohort(11)
+    get_embedding(_expression_df())
+    assert len(calls) == 4
+    assert all(
+        f.name.startswith("global-data_2_")
+        for f in (tmp_path / "cohort_11" / "embeddings").iterdir()
+    )
@@ -0,0 +1,70 @@
+import pandas as pd
+
+from logger import CohortLogger
+import topas_portal.file_loaders.genomics as genomics_loader
+import topas_portal.genomics_preprocess as genomics_process
+
+
+def test_load_genomics_table_long_format(tmp_path):
+    genomics_path = tmp_path / "genomics.csv"
+    pd.DataFrame(
+        {
+            "Sample name": ["S1", "S2", "S3"],
+            "EGFR": ["cnv:AMP_snv:C_T_exonic_20_p.P266S_fusion:n.d", None, "missing"],
+            "ALK": [None, "cnv:DEL_snv:n.d_fusion:EML4|ALK", "garbage"],
+        }
+    ).to_csv(genomics_path, index=False)
+
+    genomics_df = genomics_loader.load_genomics_table(str(genomics_path), CohortLogger())
+
+    assert list(genomics_loader.get_genomics_samples(genomics_df)) == ["S1", "S2", "S3"]
+    assert genomics_df.index.tolist() == ["ALK", "ALK", "EGFR"]
+    egfr = genomics_df.loc["EGFR":"EGFR"].iloc[0]
+    assert (egfr["cnv"], egfr["snv"], egfr["fusion"]) == ("AMP", "CTexonic20p.P266S", "n.d")
+    alk = genomics_df.loc["ALK":"ALK"].set_index("Sample name")
+    assert alk.loc["S2", "fusion"] == "EML4|ALK"
+    assert alk.loc["S3", ["cnv", "snv", "fusion"]].tolist() == ["missing"] * 3
+
+
+def test_load_genomics_table_logs_duplicate_samples(tmp_path):
+    genomics_path = tmp_path / "genomics.csv"
+    pd.DataFrame(
+        {
+            "Sample name": ["S1", "S2", "S1"],
+            "EGFR": ["cnv:AMP_snv:n.d_fusion:n.d", None, "cnv:DEL_snv:n.d_fusion:n.d"],
+        }
+    ).to_csv(genomics_path, index=False)
+    logger = CohortLogger()
+
+    genomics_df = genomics_loader.load_genomics_table(str(genomics_path), logger)
+
+    assert list(genomics_loader.get_genomics_samples(genomics_df)) == ["S1", "S2"]
+    assert genomics_df.loc["EGFR":"EGFR", "cnv"].tolist() == ["AMP"]
+    assert any(
+        "dropped 1 duplicate rows of samples ['S1']" in message
+        for message in logger.get_log_messages()
+    )
+
+
+def test_annotate_alterations_with_onkokb(tmp_path):
+    genomics_path = tmp_path / "genomics.csv"
+    pd.DataFrame(
+        {
+            "Sample name": ["S1", "S2", "S3"],
+            "EGFR": [
+                "cnv:AMP_snv:C_T_exonic_20_p.P266S_fusion:n.d",
+                "cnv:CNN_snv:n.d_fusion:EGFR|ALK,ROS1",
+                None,
+            ],
+        }
+    ).to_csv(genomics_path, index=False)
+    genomics_df = genomics_loader.load_genomics_table(str(genomics_path), CohortLogger())
+    onkokb_table = pd.Series(
+        {"EGFR_AMPLIFICATION": "Oncogenic", "EGFR|ALK": "Likely Oncogenic"}
+    )
+
+    onkokb_df = genomics_process.annotate_alterations_with_onkokb(genomics_df, "EGFR", onkokb_table)
+
+    assert onkokb_df.loc["S1"].tolist() == ["", "Oncogenic", "EGFR_p.P266S"]
+    assert onkokb_df.loc["S2"].tolist() == ["Likely Oncogenic;EGFR|ROS1", "", ""]
+    assert onkokb_df.loc["S3"].tolist() == ["", "", ""]
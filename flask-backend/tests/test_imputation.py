@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from topas_portal import imputation
+
+
+def _matrix_with_missing_values():
+    matrix = np.random.default_rng(0).normal(loc=5, size=(50, 4))
+    matrix[::3, 0] = np.nan
+    matrix[1, 2] = np.inf
+    matrix[:, 3] = np.nan
+    return pd.DataFrame(matrix, columns=["A", "B", "C", "D"])
+
+
+def test_impute_normal_down_shift_column_wise():
+    df = _matrix_with_missing_values()
+    imputed_df = imputation.impute_normal_down_shift(df, column_wise=True, seed=2)
+
+    observed = np.isfinite(df.to_numpy())
+    np.testing.assert_array_equal(imputed_df.to_numpy()[observed], df.to_numpy()[observed])
+    assert imputed_df[["A", "B", "C"]].notna().all().all()
+    # columns without observations cannot be imputed
+    assert imputed_df["D"].isna().all()
+    # imputed values are drawn well below the observed mean of their column
+    imputed_values = imputed_df.loc[df["A"].isna(), "A"]
+    assert imputed_values.mean() < df["A"].mean() - df["A"].std()
+
+    pd.testing.assert_frame_equal(
+        imputed_df, imputation.impute_normal_down_shift(df, column_wise=True, seed=2)
+    )
+
+
+def test_impute_min():
+    df = pd.DataFrame({"A": [1.0, np.nan], "B": [-2.0, 3.0]})
+    imputed_df = imputation.impute_min(df)
+    assert imputed_df.loc[1, "A"] == -2.0
+
+
+def test_get_imputed_df_is_cached_per_cohort():
+    df = _matrix_with_missing_values()
+    first = imputation.get_imputed_df(df, 0, "protein", imputation.ImputationMethod.MIN)
+    assert imputation.get_imputed_df(df, 0, "protein", imputation.ImputationMethod.MIN) is first
+
+    imputation.imputed_matrices_cache.invalidate(0)
+    assert imputation.get_imputed_df(df, 0, "protein", imputation.ImputationMethod.MIN) is not first
+
+
+def test_model_imputed_df_is_computed_only_if_not_stored():
+    df = _matrix_with_missing_values()
+    model_imputed_df = df.fillna(0)
+    imputation.put_model_imputed_df(df, 0, "protein", "softimpute", model_imputed_df)
+
+    def refit():
+        raise AssertionError("the stored matrix should be used")
+
+    assert (
+        imputation.get_model_imputed_df(df, 0, "protein", "softimpute", refit)
+        is model_imputed_df
+    )
+    assert imputation.get_model_imputed_df(
+        df, 0, "protein", "ppca", lambda: df.fillna(1)
+    ).equals(df.fillna(1))
+    assert imputation.imputed_matrices_cache.num_bytes >= 2 * imputation.get_memory_usage(df)
+    imputation.imputed_matrices_cache.invalidate(0)
@@ -0,0 +1,122 @@
+import os
+import time
+
+import pandas as pd
+
+from topas_portal import jobs
+from topas_portal import result_cache
+
+
+def _run_table_job(cohorts_db, report_progress, cohort_index, num_rows):
+    report_progress(0.5, "halfway")
+    return pd.DataFrame({"row": range(int(num_rows))})
+
+
+def _run_slow_job(cohorts_db, report_progress, cohort_index):
+    time.sleep(60)
+
+
+def _wait_for_job(job_id, jobs_dir, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        state = jobs.get_job_state(job_id, jobs_dir=jobs_dir)
+        if state["status"] in jobs.FINISHED_STATUSES:
+            return state
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+
+def test_job_runs_in_background_and_is_deduplicated(tmp_path):
+    jobs.register_job_type("test_table", _run_table_job)
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(5, "data_1")
+    params = {"cohort_index": "5", "num_rows": "3"}
+
+    state = jobs.submit_job(None, "test_table", params, jobs_dir=str(tmp_path))
+    state = _wait_for_job(state["id"], str(tmp_path))
+    assert state["status"] == jobs.JobStatus.DONE
+    pd.testing.assert_frame_equal(
+        jobs.get_job_result(state["id"], jobs_dir=str(tmp_path)),
+        pd.DataFrame({"row": range(3)}),
+    )
+
+    # identical jobs are not run again, unless the data changed
+    assert jobs.submit_job(None, "test_table", params, jobs_dir=str(tmp_path)) == state
+    result_cache.set_data_fingerprint(5, "data_2")
+    new_state = jobs.submit_job(None, "test_table", params, jobs_dir=str(tmp_path))
+    assert new_state["id"] != state["id"]
+    _wait_for_job(new_state["id"], str(tmp_path))
+
+
+def test_job_can_be_cancelled(tmp_path):
+    jobs.register_job_type("test_slow", _run_slow_job)
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(6, "data_1")
+
+    state = jobs.submit_job(None, "test_slow", {"cohort_index": "6"}, jobs_dir=str(tmp_path))
+    deadline = time.time() + 30
+    while jobs.get_job_state(state["id"], jobs_dir=str(tmp_path)).get("pid") is None:
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+    state = jobs.cancel_job(state["id"], jobs_dir=str(tmp_path))
+    assert state["status"] == jobs.JobStatus.CANCELLED
+    pid = state["pid"]
+    deadline = time.time() + 30
+    while jobs._is_process_alive(pid):
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert jobs.get_job_state(state["id"], jobs_dir=str(tmp_path))["status"] == jobs.JobStatus.CANCELLED
+
+
+def test_jobs_of_stopped_workers_fail_and_can_be_resubmitted(tmp_path):
+    jobs.register_job_type("test_table", _run_table_job)
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(7, "data_1")
+    params = {"cohort_index": "7", "num_rows": "2"}
+    job_id = jobs.get_job_id("test_table", params, result_cache.get_data_fingerprint("7"))
+    job_dir = tmp_path / job_id
+    job_dir.mkdir()
+
+    # queued by a worker whose pid now belongs to another process (this one)
+    state = {
+        "id": job_id,
+        "type": "test_table",
+        "params": params,
+        "status": jobs.JobStatus.QUEUED,
+        "progress": 0.0,
+        "message": "",
+        "submitted": time.time(),
+        "supervisor_pid": os.getpid(),
+        "supervisor_start_id": "previous_boot:0",
+    }
+    jobs._write_state(str(job_dir), state)
+    assert jobs.get_job_state(job_id, jobs_dir=str(tmp_path))["status"] == jobs.JobStatus.FAILED
+
+    # running in a process whose pid was reused
+    jobs._write_state(
+        str(job_dir),
+        {
+            **state,
+            "status": jobs.JobStatus.RUNNING,
+            "pid": os.getpid(),
+            "start_id": "previous_boot:0",
+        },
+    )
+    assert jobs.get_job_state(job_id, jobs_dir=str(tmp_path))["status"] == jobs.JobStatus.FAILED
+
+    state = jobs.submit_job(None, "test_table", params, jobs_dir=str(tmp_path))
+    assert _wait_for_job(state["id"], str(tmp_path))["status"] == jobs.JobStatus.DONE
+
+
+def test_job_result_route_rejects_bad_table_queries(monkeypatch):
+    from app import app
+
+    jobs.register_job_type("test_table", _run_table_job)
+    monkeypatch.setattr(jobs, "get_job_result", lambda job_id: pd.DataFrame({"row": range(3)}))
+    monkeypatch.setattr(jobs, "get_job_state", lambda job_id: {"type": "test_table"})
+    client = app.test_client()
+
+    assert client.get("/jobs/0123456789abcdef/result?sort=row&limit=2").status_code == 200
+    assert client.get("/jobs/0123456789abcdef/result?sort=nonexistent").status_code == 400
+    assert client.get("/jobs/0123456789abcdef/result?limit=-1").status_code == 400
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from logger import CohortLogger
+from topas_portal import result_cache
+from topas_portal import utils
+from topas_portal import prexp_preprocess as pp
+import topas_portal.patient_report_store as report_store
+
+
+class FakeCohortDataAPI:
+    def __init__(self):
+        self.logger = CohortLogger()
+        self.kinase_df = pd.DataFrame(
+            {"pat_1": [1.0, np.nan, -2.0], "pat_2": [0.5, 1.5, np.nan]},
+            index=pd.Index(["EGFR", "SRC", "MET"], name="Gene names"),
+        )
+
+    def get_kinase_scores_df(self, cohort_index, intensity_unit=None):
+        return self.kinase_df.copy()
+
+    def get_patient_metadata_df(self, cohort_index):
+        return pd.DataFrame({"Sample name": ["pat_1", "pat_2", "pat_3"]})
+
+
+def test_patient_report_store_matches_on_the_fly():
+    cohorts_db = FakeCohortDataAPI()
+    report_table = report_store.build_patient_report_table(
+        cohorts_db,
+        0,
+        utils.DataType.KINASE_SCORE,
+        ["pat_1", "pat_2", "pat_3"],
+    )
+
+    assert report_table.patients == ["pat_1", "pat_2"]
+    assert len(report_table.rows_df) == 3
+    for patient in ["pat_1", "pat_2"]:
+        expected_df = pp.get_reports_per_patient(
+            cohorts_db, 0, patient, utils.DataType.KINASE_SCORE
+        ).reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            report_table.get_patient_report(patient), expected_df
+        )
+
+
+def test_patient_report_table_stores_shared_rows_once():
+    reports = {
+        "pat_1": pd.DataFrame(
+            {"Gene names": ["EGFR", "SRC", "EGFR"], "pat_1": [1.0, 2.0, 3.0]}
+        ),
+        "pat_2": pd.DataFrame(
+            {"Gene names": ["MET", "SRC", "ALK", "MET"], "pat_2": [4.0, 5.0, 6.0, 7.0]}
+        ),
+        "pat_3": pd.DataFrame({"pat_3": [8.0], "Gene names": ["ALK"]}),
+    }
+    report_table = report_store.PatientReportTable()
+    for patient, report_df in reports.items():
+        report_table.add_patient(patient, report_df, patient)
+    report_table.finalize()
+
+    assert report_table.rows_df["Gene names"].tolist() == ["EGFR", "SRC", "MET", "ALK"]
+    for patient, report_df in reports.items():
+        pd.testing.assert_frame_equal(report_table.get_patient_report(patient), report_df)
+
+
+def test_patient_report_store_drops_outdated_results():
+    cohorts_db = FakeCohortDataAPI()
+    data_version = result_cache.get_data_version(0)
+    result_cache.invalidate_cohort(0)
+
+    assert not report_store.patient_report_tables_cache.put(
+        0, utils.DataType.KINASE_SCORE, "outdated", data_version=data_version
+    )
+
+    report_store.build_patient_reports(
+        cohorts_db, 0, levels=[utils.DataType.KINASE_SCORE]
+    )
+    tsv = "".join(
+        report_store.iter_patient_reports_csv(
+            cohorts_db, 0, ["pat_1", "pat_2"], utils.DataType.KINASE_SCORE
+        )
+    )
+    assert tsv.splitlines() == [
+        "Sample name\tKinase_names\tvalue",
+        "pat_1\tEGFR\t1.0",
+        "pat_1\tMET\t-2.0",
+        "pat_2\tEGFR\t0.5",
+        "pat_2\tSRC\t1.5",
+    ]
+
+
+def test_patient_reports_csv_skips_patients_without_data():
+    cohorts_db = FakeCohortDataAPI()
+    patients = ["pat_2", "pat_3", "pat_4"]
+
+    assert report_store.get_unknown_patients(cohorts_db, 0, patients) == ["pat_4"]
+
+    tsv = "".join(
+        report_store.iter_patient_reports_csv(
+            cohorts_db, 0, ["pat_3", "pat_2"], utils.DataType.KINASE_SCORE
+        )
+    )
+    assert tsv.splitlines() == [
+        "Sample name\tKinase_names\tvalue",
+        "pat_2\tEGFR\t0.5",
+        "pat_2\tSRC\t1.5",
+    ]
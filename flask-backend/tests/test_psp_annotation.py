@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from logger import CohortLogger
+import topas_portal.file_loaders.psp_annotation as psp_annotation
+
+
+def _fake_annotate_psites(df, pspFastaFile, pspAnnotationFile, pspRegulatoryFile):
+    df = df.reset_index(level="Modified sequence")
+    df = df.drop(columns="Site positions identified (MQ)", errors="ignore")
+    df["Site positions identified (MQ)"] = df["Proteins"] + "_S1"
+    df["PSP_LT_LIT"] = df["Modified sequence"].str.len().astype(str)
+    return df
+
+
+@pytest.fixture
+def psp_config(tmp_path):
+    config = {}
+    for key in psp_annotation.PSP_FILE_KEYS:
+        psp_file = tmp_path / key
+        psp_file.write_text(key)
+        config[key] = str(psp_file)
+    return config
+
+
+@pytest.fixture
+def pp_df():
+    return pd.DataFrame(
+        {
+            "pat_1 Z-score": [1.0, np.nan, 3.0],
+            "pat_2 Z-score": [0.5, 2.0, np.nan],
+            "Gene names": ["EGFR", "ERBB2", "MET"],
+            "Proteins": ["P00533", "P04626", "P08581"],
+            "PSP Kinases": ["", "SRC", ""],
+            "Site positions identified (MQ)": ["S1", "S2", "S3"],
+        },
+        index=pd.Index(["_AS(ph)K_", "_BS(ph)K_", "_CT(ph)PK_"], name="Modified sequence"),
+    )
+
+
+def test_psp_annotation_index_is_persisted(monkeypatch, tmp_path, pp_df, psp_config):
+    calls = []
+
+    def annotate(*args):
+        calls.append(args)
+        return _fake_annotate_psites(*args)
+
+    monkeypatch.setattr(psp_annotation, "annotate_psites", annotate)
+
+    index_df = psp_annotation.load_psp_annotation_index(
+        pp_df, psp_config, "cohort_1", CohortLogger(), cache_dir=tmp_path / "cache"
+    )
+    reloaded_df = psp_annotation.load_psp_annotation_index(
+        pp_df, psp_config, "cohort_1", CohortLogger(), cache_dir=tmp_path / "cache"
+    )
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(index_df, reloaded_df)
+
+    # changed peptides invalidate the persisted index
+    psp_annotation.load_psp_annotation_index(
+        pp_df.iloc[:2], psp_config, "cohort_1", CohortLogger(), cache_dir=tmp_path / "cache"
+    )
+    assert len(calls) == 2
+    index_dir = tmp_path / "cache" / "cohort_1" / psp_annotation.PSP_INDEX_DIR
+    assert len(list(index_dir.iterdir())) == 1
+
+
+def test_patient_psp_annotations_match_on_the_fly(monkeypatch, tmp_path, pp_df, psp_config):
+    monkeypatch.setattr(psp_annotation, "annotate_psites", _fake_annotate_psites)
+    index_df = psp_annotation.load_psp_annotation_index(
+        pp_df, psp_config, "cohort_1", CohortLogger(), cache_dir=tmp_path
+    )
+
+    patient_df = pp_df[["pat_1 Z-score", "Gene names", "Proteins", "PSP Kinases"]].dropna()
+    expected_df = _fake_annotate_psites(patient_df, None, None, None)
+    result_df = psp_annotation.get_patient_psp_annotations(
+        patient_df, "pat_1 Z-score", index_df
+    )
+    pd.testing.assert_frame_equal(result_df, expected_df)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from topas_portal import qc_summary
+
+
+def _intensity_df():
+    return pd.DataFrame(
+        {
+            "pat_1": [1.0, 2.0, np.nan, 4.0],
+            "pat_2": [1.0, np.nan, np.nan, 4.0],
+            "pat_3": [np.nan, 2.0, 3.0, 4.0],
+            "ref_1": [1.0, 2.0, 3.0, 4.0],
+        },
+        index=["EGFR", "ALK", "BRAF", "EGFR"],
+    )
+
+
+def _sample_annotation_df():
+    return pd.DataFrame(
+        {
+            "Sample name": ["pat_1", "pat_2", "pat_3", "pat_4"],
+            "Batch_No": [1, 1, 2, 3],
+        }
+    )
+
+
+def test_modification_type_counts_match_str_contains():
+    psite_df = pd.DataFrame(
+        {"pat_1": [1.0, np.nan, 2.0, 3.0, np.nan], "pat_2": [1.0, np.nan, 2.0, np.nan, 5.0]},
+        index=["AS(ph)pT", "pSK", "ApS", "pYpTK", "ApSpY"],
+    )
+
+    expected_df = psite_df.dropna(how="all").copy()
+    expected_df["mod_type"] = None
+    expected_df.loc[expected_df.index.str.contains("pT"), "mod_type"] = "Phospho Threonine"
+    expected_df.loc[expected_df.index.str.contains("pS"), "mod_type"] = "Phospho Serine"
+    expected_df.loc[expected_df.index.str.contains("pY"), "mod_type"] = "Phospho Tyrosine"
+
+    pd.testing.assert_series_equal(
+        qc_summary.count_modification_types(psite_df),
+        expected_df["mod_type"].value_counts(),
+        check_names=False,
+    )
+
+
+def test_batch_counts_match_batch_protein_lists():
+    intensity_df = _intensity_df()
+    sample_annotation_df = _sample_annotation_df()
+
+    batch_counts = qc_summary.count_per_batch(
+        sample_annotation_df, {"fp": intensity_df.notna()}
+    )
+
+    assert batch_counts["Batch_No"].tolist() == [1, 2, 3]
+    assert batch_counts["fp_samples"].tolist() == [2, 1, 0]
+    # EGFR is counted once, although it has two rows
+    assert batch_counts["fp_identified"].tolist() == [1, 3, 0]
+
+
+def test_identifications_and_intensities_per_sample():
+    intensity_df = _intensity_df()
+
+    identifications = qc_summary.count_identifications(intensity_df, intensity_df.notna())
+    assert identifications["identified"].tolist() == [3, 2, 3, 4]
+    assert identifications["patients"].tolist() == list(intensity_df.columns)
+
+    intensities = qc_summary.sum_intensities(intensity_df)
+    assert intensities["sumIntensities"].tolist() == [7.0, 5.0, 9.0, 10.0]
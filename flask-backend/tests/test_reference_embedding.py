@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from logger import CohortLogger
+from topas_portal import result_cache
+from topas_portal import reference_embedding
+
+
+def _expression_df(n_samples=30, n_features=20, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n_samples, 3)) @ rng.standard_normal((3, n_features))
+    return pd.DataFrame(
+        x + 0.1 * rng.standard_normal((n_samples, n_features)),
+        index=[f"pat_{i}" for i in range(n_samples)],
+        columns=[f"gene_{i}" for i in range(n_features)],
+    )
+
+
+@pytest.mark.parametrize("method_name", ["pca", "ppca", "rsvd"])
+def test_projection_of_reference_samples_matches_fit(method_name):
+    expression_df = _expression_df()
+    reference_model = reference_embedding.ReferenceModel.fit(expression_df, method_name)
+    fitted_df = reference_model.model.fit_transform(expression_df)
+
+    # a subset of the samples, with the features in a different order and an unknown feature
+    subset_df = expression_df.iloc[[3, 7, 11], ::-1].assign(gene_unknown=1.0)
+    projected_df = reference_model.project(subset_df)
+
+    assert list(projected_df.index) == ["pat_3", "pat_7", "pat_11"]
+    np.testing.assert_allclose(
+        projected_df.to_numpy(), fitted_df.iloc[[3, 7, 11]].to_numpy(), atol=1e-4
+    )
+
+
+def test_projection_imputes_missing_features():
+    expression_df = _expression_df()
+    reference_model = reference_embedding.ReferenceModel.fit(expression_df, "ppca")
+
+    projected_df = reference_model.project(expression_df.iloc[:5].drop(columns=["gene_0"]))
+    assert projected_df.shape == (5, 2)
+    assert not projected_df.isna().any().any()
+
+
+def test_reference_model_is_persisted_until_refit(tmp_path):
+    expression_df = _expression_df()
+    fit_calls = []
+
+    def get_expression_df():
+        fit_calls.append(1)
+        return expression_df
+
+    def get_reference_model(refit=False):
+        return reference_embedding.get_reference_model(
+            12,
+            "cohort_12",
+            ("protein", 0.5),
+            "pca",
+            get_expression_df,
+            CohortLogger(),
+            refit=refit,
+            cache_dir=tmp_path,
+        )
+
+    reference_model = get_reference_model()
+    assert get_reference_model() is reference_model
+    assert len(fit_calls) == 1
+
+    # survives reloading the cohort, in contrast to the embedding cache
+    result_cache.invalidate_cohort(12)
+    reloaded_model = get_reference_model()
+    assert len(fit_calls) == 1
+    assert reloaded_model.fitted == reference_model.fitted
+    pd.testing.assert_frame_equal(
+        reloaded_model.project(expression_df), reference_model.project(expression_df)
+    )
+
+    refitted_model = get_reference_model(refit=True)
+    assert len(fit_calls) == 2
+    assert get_reference_model() is refitted_model
@@ -0,0 +1,130 @@
+from flask import Flask, jsonify
+
+from topas_portal import result_cache
+from topas_portal import response_cache
+
+
+def _create_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        CACHE_TYPE="FileSystemCache",
+        CACHE_DIR=str(tmp_path / "responses"),
+        CACHE_THRESHOLD=100,
+        CACHE_DEFAULT_TIMEOUT=0,
+    )
+    response_cache.cache.init_app(app)
+
+    calls = []
+
+    @app.route("/<int:cohort_index>/values")
+    @response_cache.cached_response
+    def values(cohort_index: int):
+        calls.append(cohort_index)
+        return jsonify({"cohort": cohort_index, "calls": len(calls)})
+
+    return app, calls
+
+
+def test_response_cache_depends_on_data_fingerprint(tmp_path):
+    app, calls = _create_app(tmp_path)
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(7, "data_1")
+
+    assert client.get("/7/values").json == {"cohort": 7, "calls": 1}
+    assert client.get("/7/values").json == {"cohort": 7, "calls": 1}
+    assert client.get("/7/values?sort=asc").json == {"cohort": 7, "calls": 2}
+    assert len(calls) == 2
+
+    result_cache.set_data_fingerprint(7, "data_2")
+    assert client.get("/7/values").json == {"cohort": 7, "calls": 3}
+
+
+def test_response_cache_skips_cohorts_that_are_not_loaded(tmp_path):
+    app, calls = _create_app(tmp_path)
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+
+    client.get("/8/values")
+    client.get("/8/values")
+    assert len(calls) == 2
+
+
+def test_conditional_response_answers_matching_etag_with_304(tmp_path):
+    app, calls = _create_app(tmp_path)
+
+    @app.route("/<int:cohort_index>/fields")
+    @response_cache.conditional_response
+    def fields(cohort_index: int):
+        calls.append(cohort_index)
+        return jsonify(["code_oncotree"])
+
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(9, "data_1")
+
+    etags = {}
+    for route in ["/9/fields", "/9/values"]:
+        response = client.get(route)
+        etag = etags[route] = response.headers["ETag"]
+        assert response.status_code == 200
+
+        not_modified = client.get(route, headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.data == b""
+
+        # compressed responses carry the encoding in the ETag
+        compressed_etag = etag[:-1] + ':gzip"'
+        assert client.get(route, headers={"If-None-Match": compressed_etag}).status_code == 304
+    assert len(calls) == 2
+
+    result_cache.set_data_fingerprint(9, "data_2")
+    response = client.get("/9/fields", headers={"If-None-Match": etags["/9/fields"]})
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_response_cache_skips_error_messages(tmp_path):
+    app, calls = _create_app(tmp_path)
+
+    @app.route("/<int:cohort_index>/failing")
+    @response_cache.cached_response
+    def failing(cohort_index: int):
+        calls.append(cohort_index)
+        return "ValueError: something went wrong"
+
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(10, "data_1")
+
+    client.get("/10/failing")
+    client.get("/10/failing")
+    assert len(calls) == 2
+
+
+def test_response_cache_depends_on_code_version(tmp_path, monkeypatch):
+    app, calls = _create_app(tmp_path)
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(11, "data_1")
+
+    etag = client.get("/11/values").headers["ETag"]
+    monkeypatch.setattr(response_cache, "get_code_version", lambda: "next_release")
+    response = client.get("/11/values", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(calls) == 2
+
+
+def test_stats_count_files_of_cached_responses(tmp_path):
+    app, calls = _create_app(tmp_path)
+    client = app.test_client()
+    result_cache.set_data_fingerprint(None, "global")
+    result_cache.set_data_fingerprint(12, "data_1")
+
+    client.get("/12/values")
+    with app.app_context():
+        num_files = response_cache.get_stats()["files"]
+    client.get("/12/values?sort=asc")
+    with app.app_context():
+        assert response_cache.get_stats()["files"] == num_files + 1
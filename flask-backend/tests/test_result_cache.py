@@ -0,0 +1,62 @@
+import os
+
+from logger import CohortLogger
+from topas_portal import result_cache
+
+
+def test_results_of_reloaded_data_are_not_stored():
+    cache = result_cache.CohortResultCache("test_reload", max_entries=4)
+
+    def compute_during_reload():
+        result_cache.invalidate_cohort(3)
+        return "outdated"
+
+    assert cache.get_or_compute(3, "key", compute_during_reload) == "outdated"
+    assert cache.get(3, "key") is None
+    assert cache.get_or_compute(3, "key", lambda: "current") == "current"
+    assert cache.get(3, "key") == "current"
+
+
+def test_entries_are_evicted_by_size():
+    cache = result_cache.CohortResultCache(
+        "test_size", max_entries=10, max_bytes=10, size_func=len
+    )
+    cache.put(1, "a", "aaaa")
+    cache.put(1, "b", "bbbb")
+    assert cache.get(1, "a") == "aaaa"  # b is now the least recently used entry
+
+    cache.put(2, "c", "cccc")
+    assert cache.get(1, "b") is None
+    assert cache.num_bytes == 8
+
+    # the most recent entry is kept even if it exceeds the limit on its own
+    cache.put(2, "d", "d" * 20)
+    assert len(cache) == 1 and cache.get(2, "d") is not None
+    cache.invalidate(2)
+    assert cache.num_bytes == 0
+
+
+def test_persisted_results_of_other_data_are_removed(tmp_path):
+    logger = CohortLogger()
+
+    def persist(data_fingerprint, key, max_files=None):
+        result_file = result_cache.get_persisted_file(
+            tmp_path, "cohort_1", "results", f"{data_fingerprint}_{key}"
+        )
+        result_cache.persist_result(
+            {"key": key}, result_file, logger, data_fingerprint, max_files
+        )
+        return result_file
+
+    outdated_file = persist("data_1", "a")
+    current_file = persist("data_12", "a")
+    assert result_cache.load_persisted_result(current_file, logger) == {"key": "a"}
+    assert result_cache.load_persisted_result(outdated_file, logger) is None
+
+    os.utime(current_file, (0, 0))  # the oldest result is removed first
+    persist("data_12", "b", max_files=2)
+    persist("data_12", "c", max_files=2)
+    assert sorted(f.name for f in (tmp_path / "cohort_1" / "results").iterdir()) == [
+        "data_12_b.pkl",
+        "data_12_c.pkl",
+    ]
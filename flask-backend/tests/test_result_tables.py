@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+from topas_portal import result_tables
+from topas_portal.correlations_preprocess import CORRELATION_COLUMNS
+
+
+@pytest.fixture
+def correlation_df():
+    return pd.DataFrame(
+        {
+            "index": ["EGFR", "SRC", "MET", "ALK", "KIT"],
+            "correlation": [0.9, -0.8, 0.1, 0.5, -0.2],
+            "p-value": [0.001, 0.002, 0.5, 0.01, 0.3],
+            "FDR": [0.005, 0.005, 0.5, 0.02, 0.4],
+        }
+    )
+
+
+def test_result_table_query_filters_sorts_and_pages(correlation_df):
+    query = result_tables.ResultTableQuery.from_request_args(
+        MultiDict({"max_fdr": "0.1", "min_abs_r": "0.3", "sort": "correlation", "order": "desc", "limit": "2"})
+    )
+    page_df = query.apply(correlation_df, CORRELATION_COLUMNS)
+    assert page_df["index"].tolist() == ["EGFR", "ALK"]
+
+    query.offset = 2
+    assert query.apply(correlation_df, CORRELATION_COLUMNS)["index"].tolist() == ["SRC"]
+
+    # the cached full table is not modified
+    assert correlation_df["index"].tolist() == ["EGFR", "SRC", "MET", "ALK", "KIT"]
+
+
+def test_result_table_query_partial_sort_matches_full_sort():
+    df = pd.DataFrame({"p-value": np.random.default_rng(1).random(1000)})
+    query = result_tables.ResultTableQuery(limit=20, offset=10, sort_by="p-value")
+    expected_df = df.sort_values("p-value", kind="mergesort").iloc[10:30]
+    pd.testing.assert_frame_equal(query.apply(df, {}), expected_df)
+
+
+def test_result_table_to_json_reports_total_count(correlation_df):
+    app = Flask(__name__)
+    query = result_tables.ResultTableQuery(max_p_value=0.05, limit=1)
+    with app.test_request_context("/"):
+        response = result_tables.result_table_to_json(correlation_df, query, CORRELATION_COLUMNS)
+    assert response.headers[result_tables.TOTAL_COUNT_HEADER] == "3"
+    assert [row["index"] for row in json.loads(response.get_data())] == ["EGFR"]
+
+    with pytest.raises(ValueError):
+        result_tables.ResultTableQuery(min_abs_fold_change=1).apply(correlation_df, CORRELATION_COLUMNS)
+
+
+@pytest.mark.parametrize(
+    "query_string, status_code",
+    [("sort=FDR", 200), ("sort=nonexistent", 400), ("limit=-1", 400), ("offset=-5", 400)],
+)
+def test_result_table_routes_reject_bad_queries(
+    monkeypatch, correlation_df, query_string, status_code
+):
+    from app import app
+    from topas_portal import correlations_preprocess
+    from topas_portal import differential_expression
+
+    monkeypatch.setattr(
+        correlations_preprocess,
+        "get_correlation_table",
+        lambda *args, **kwargs: (correlation_df, 200),
+    )
+    monkeypatch.setattr(
+        differential_expression, "get_data_for_t_test", lambda *args: correlation_df
+    )
+    client = app.test_client()
+
+    response = client.get(f"/0/protein/correlation/fpkm/EGFR/z_scored/all?{query_string}")
+    assert response.status_code == status_code
+    response = client.get(f"/differential/0/protein/pat_1/index/intensity?{query_string}")
+    assert response.status_code == status_code
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from topas_portal import utils
+from topas_portal import sample_metadata
+
+
+def _sample_annotation_df():
+    return pd.DataFrame(
+        {
+            "Sample name": ["pat_1", "pat_1-R2", "pat_2", "ref_1"],
+            "Batch_No": [1, 2, 1, 1],
+            "TMT_channel": [1, 1, 2, 11],
+            "Entity": ["A", "A", "B", "ref"],
+        }
+    )
+
+
+def _patients_df():
+    return pd.DataFrame(
+        {
+            "Sample name": ["pat_1", "pat_2", "pat_2", "pat_3"],
+            "code_oncotree": ["LUAD", "BRCA", "BRCA", "COAD"],
+            "Batch_No": [1, 1, 1, 2],
+            "value": [1.0, 2.0, 2.0, 3.0],
+        }
+    )
+
+
+def test_merges_match_utils():
+    metadata = sample_metadata.SampleMetadata(_sample_annotation_df(), _patients_df())
+    scores_df = pd.DataFrame(
+        {
+            # includes an unknown replicate and a sample without name
+            "Sample name": ["pat_2", "pat_1-R2", "pat_3-R1", "ref_1", np.nan],
+            "value": [0.5, 1.5, 2.5, 3.5, 4.5],
+        }
+    )
+
+    expected_df = utils.merge_with_sample_annotation_df(scores_df, _sample_annotation_df())
+    pd.testing.assert_frame_equal(
+        metadata.merge_with_sample_annotation(scores_df), expected_df
+    )
+
+    expected_df = utils.merge_with_patients_meta_df(expected_df, _patients_df())
+    pd.testing.assert_frame_equal(metadata.merge(scores_df), expected_df)
+
+
+def test_annotated_samples_match_utils():
+    metadata = sample_metadata.SampleMetadata(_sample_annotation_df(), _patients_df())
+
+    expected_df = utils.merge_with_patients_meta_df(
+        _sample_annotation_df().drop(["Entity"], axis=1), _patients_df()
+    )
+    pd.testing.assert_frame_equal(metadata.get_annotated_samples_df(), expected_df)
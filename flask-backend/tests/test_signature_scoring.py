@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from topas_portal.utils import calculate_z_scores
+import topas_portal.IFN_topas_scoring as signature_scoring
+
+
+def _loo_z_scores_reference(df, col_name):
+    z_scores = []
+    for i in df.index:
+        loo_df = df.drop(i, axis=0)
+        z_scores.append((df.loc[i, col_name] - float(loo_df.median())) / float(loo_df.std()))
+    return z_scores
+
+
+@pytest.mark.parametrize("num_samples", [3, 4, 9, 10])
+def test_calculate_z_scores_matches_leave_one_out(num_samples):
+    values = np.random.default_rng(1).normal(size=num_samples)
+    values[1] = np.nan
+    values[2] = values[0]
+    df = pd.DataFrame({"sum": values})
+
+    np.testing.assert_allclose(
+        calculate_z_scores(df, col_name="sum"),
+        _loo_z_scores_reference(df, "sum"),
+    )
+
+
+def test_signature_id_is_order_independent():
+    assert signature_scoring.get_signature_id(
+        ["MX1", "ISG15", "MX1"]
+    ) == signature_scoring.get_signature_id(["ISG15", "MX1"])
+    assert signature_scoring.parse_signature_genes("ISG15, MX1;IFI27") == [
+        "ISG15",
+        "MX1",
+        "IFI27",
+    ]
+
+
+def test_calculate_TOPAS_scores_mean():
+    z_scores_df = pd.DataFrame(
+        {"pat_1": [1.0, 3.0, 10.0], "pat_2": [2.0, np.nan, 10.0]},
+        index=["ISG15", "MX1", "EGFR"],
+    )
+    patients_df = pd.DataFrame({"Sample name": ["pat_1", "pat_2"]})
+
+    result_df = signature_scoring.calculate_TOPAS_scores(
+        z_scores_df, patients_df, signatures_proteins=["ISG15", "MX1"], aggregation="mean"
+    )
+
+    assert list(result_df["Sample name"]) == ["pat_1", "pat_2"]
+    assert list(result_df["Z-score"]) == [2.0, 2.0]
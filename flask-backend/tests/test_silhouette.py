@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from sklearn.metrics import silhouette_samples
+
+from topas_portal import silhouette
+
+
+def _features_df(n_samples=90, n_features=15, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = np.repeat(["a", "b", "c"], n_samples // 3)
+    x = rng.standard_normal((n_samples, n_features)) + 2 * (labels[:, None] == "b")
+    return (
+        pd.DataFrame(x, index=[f"pat_{i}" for i in range(n_samples)]),
+        labels,
+    )
+
+
+def test_chunked_silhouette_matches_sklearn():
+    features_df, labels = _features_df()
+    labels[0] = "single"  # clusters with a single sample have a score of 0
+    expected = silhouette_samples(features_df.to_numpy(), labels)
+
+    distances = silhouette.get_distance_matrix(features_df)
+    np.testing.assert_allclose(
+        silhouette.silhouette_samples_chunked(labels, distances=distances, chunk_size=7),
+        expected,
+        atol=1e-5,
+    )
+    np.testing.assert_allclose(
+        silhouette.silhouette_samples_chunked(labels, x=features_df.to_numpy(), chunk_size=7),
+        expected,
+        atol=1e-10,
+    )
+
+
+def test_approximate_silhouette_is_close():
+    features_df, labels = _features_df(n_samples=600)
+    expected = silhouette_samples(features_df.to_numpy(), labels)
+
+    reference_indices = silhouette.sample_reference_indices(labels, 200)
+    assert len(reference_indices) >= 200
+    approximated = silhouette.silhouette_samples_chunked(
+        labels, x=features_df.to_numpy(), reference_indices=reference_indices
+    )
+    assert np.abs(approximated - expected).mean() < 0.02
+
+
+def test_distance_matrix_is_reused_for_other_labels():
+    features_df, labels = _features_df()
+    samples = list(features_df.index[5:])
+
+    scores = silhouette.get_silhouette_samples(features_df, samples, labels[5:], cohort_index=13)
+    distances = silhouette.get_distance_matrix(features_df, cohort_index=13)
+    other_labels = np.tile(["x", "y"], len(samples))[: len(samples)]
+    other_scores = silhouette.get_silhouette_samples(
+        features_df, samples, other_labels, cohort_index=13
+    )
+
+    assert silhouette.get_distance_matrix(features_df, cohort_index=13) is distances
+    x = features_df.loc[samples].to_numpy()
+    np.testing.assert_allclose(scores, silhouette_samples(x, labels[5:]), atol=1e-5)
+    np.testing.assert_allclose(other_scores, silhouette_samples(x, other_labels), atol=1e-5)
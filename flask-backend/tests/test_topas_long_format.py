@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+import topas_portal.topas_preprocess as topas_preprocess
+
+
+def test_topas_scores_long_format_patient_slices():
+    topas_scores_df = pd.DataFrame(
+        {"pat_1": [1.0, np.nan, 3.0], "pat_2": [4.0, 5.0, 6.0], "pat_3": [np.nan] * 3},
+        index=["EGFR", "ALK", "RET"],
+    )
+    topas_scores_df.columns.name = "Sample name"
+
+    topas_scores_long = topas_preprocess.TopasScoresLongFormat(topas_scores_df)
+    long_df = topas_preprocess.get_topas_scores_long_format(topas_scores_df)
+    pd.testing.assert_frame_equal(topas_scores_long.df, long_df)
+
+    for patient in ["pat_1", "pat_2", "pat_3"]:
+        pd.testing.assert_frame_equal(
+            topas_scores_long.get_sample(patient),
+            long_df[long_df["Sample name"] == patient],
+        )
+    assert list(topas_scores_long.get_sample("pat_2")["Topas_id"]) == ["EGFR", "ALK", "RET"]
@@ -0,0 +1,76 @@
+import os
+
+import pandas as pd
+
+from logger import CohortLogger
+from topas_portal import settings
+import topas_portal.file_loaders.topas as topas_loader
+
+
+def _write_subscore_file(report_dir, topas_name, scores):
+    subscores_df = pd.DataFrame(
+        {
+            "Sample name": ["pat_A", "pat_B", "targets_A"],
+            "index": ["pat_A", "pat_B", "targets_A"],
+            f"{topas_name} important phosphorylation": scores,
+            "total_topas_score": [1.0, 1.0, 1.0],
+        }
+    )
+    file_path = os.path.join(
+        report_dir, f"{settings.TOPAS_SUBSCORE_FILES_PREFIX}{topas_name}.tsv"
+    )
+    subscores_df.to_csv(file_path, sep="\t", index=False)
+    return file_path
+
+
+def test_topas_subscore_tables_match_file_loader(tmp_path, monkeypatch):
+    report_dir = str(tmp_path)
+    file_path = _write_subscore_file(report_dir, "EGFR", [1.5, None, 3.0])
+
+    logger = CohortLogger()
+    subscore_tables = topas_loader.TopasSubscoreTables()
+    subscore_tables.load_report_dir(report_dir, logger)
+    for return_wide in [True, False]:
+        pd.testing.assert_frame_equal(
+            subscore_tables.get_table(report_dir, "EGFR", return_wide=return_wide),
+            topas_loader.load_topas_subscore_table(report_dir, "EGFR", return_wide=return_wide),
+        )
+    assert subscore_tables.get_table(report_dir, "ALK").empty
+
+    # unchanged files are not parsed again, changed files are
+    read_files = []
+    read_subscore_file = topas_loader._read_topas_subscore_file
+    monkeypatch.setattr(
+        topas_loader,
+        "_read_topas_subscore_file",
+        lambda f: read_files.append(f) or read_subscore_file(f),
+    )
+    subscore_tables.load_report_dir(report_dir, logger)
+    assert read_files == []
+
+    _write_subscore_file(report_dir, "EGFR", [2.5, 1.0, 3.0])
+    os.utime(file_path, (0, 1))
+    subscore_tables.load_report_dir(report_dir, logger)
+    assert len(read_files) == 1
+    assert list(subscore_tables.get_table(report_dir, "EGFR")["score"]) == [2.5, 1.0]
+
+
+def test_topas_subscore_files_that_fail_to_parse_are_logged(tmp_path):
+    report_dir = str(tmp_path)
+    _write_subscore_file(report_dir, "EGFR", [1.5, None, 3.0])
+    broken_file = os.path.join(
+        report_dir, f"{settings.TOPAS_SUBSCORE_FILES_PREFIX}ALK.tsv"
+    )
+    with open(broken_file, "w") as f:
+        f.write("no subscores\n")
+
+    logger = CohortLogger()
+    subscore_tables = topas_loader.TopasSubscoreTables()
+    subscore_tables.load_report_dir(report_dir, logger)
+
+    assert not subscore_tables.get_table(report_dir, "EGFR").empty
+    assert subscore_tables.get_table(report_dir, "ALK").empty
+    assert any(
+        f"Could not load the topas subscores {broken_file}" in message
+        for message in logger.get_log_messages()
+    )
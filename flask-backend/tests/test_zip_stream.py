@@ -0,0 +1,20 @@
+import io
+import zipfile
+
+from topas_portal import utils
+
+
+def test_iter_zip_stored(tmp_path):
+    report_1 = tmp_path / "pat_1_proteomics_results.xlsx"
+    report_1.write_bytes(bytes(range(256)) * 1000)
+    report_2 = tmp_path / "pat_2_proteomics_results.xlsx"
+    report_2.write_bytes(b"report")
+
+    chunks = list(utils.iter_zip_stored([str(report_1), str(report_2)], chunk_size=4096))
+    assert len(chunks) > 2
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == [report_1.name, report_2.name]
+        assert all(i.compress_type == zipfile.ZIP_STORED for i in zip_file.infolist())
+        assert zip_file.read(report_1.name) == report_1.read_bytes()
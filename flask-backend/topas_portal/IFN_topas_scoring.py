@@ -1,30 +1,45 @@
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import List, TYPE_CHECKING
+
 import pandas as pd
 import topas_portal.utils as utility
 
 import topas_portal.topas_scores_meta as topas
+from topas_portal.result_cache import CohortResultCache
 from topas_portal.utils import calculate_z_scores
 
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+SIGNATURE_AGGREGATIONS = ["sum", "mean"]
+SIGNATURE_ID_PREFIX = "sig_"
+SIGNATURE_UPLOAD_SUBFOLDER = "signatures"
+
+signature_scores_cache = CohortResultCache("signature_scores")
+
 
 def calculate_TOPAS_scores(
     z_scores_df: pd.DataFrame,
     patients_df: pd.DataFrame,
     signatures_proteins: list = topas.IFN_proteins,
     score_type="topas_score",
+    aggregation="sum",
 ) -> pd.DataFrame:
 
     alpha_signatures_df = z_scores_df[z_scores_df.index.isin(signatures_proteins)]
-    # alpha_signatures_df = alpha_signatures_df.filter(regex="Z-score")
-    sum_z_scores = pd.DataFrame(alpha_signatures_df.sum(axis=0, skipna=True)).T
-    sum_z_scores.index = ["sum"]
-    final = pd.concat([alpha_signatures_df, sum_z_scores], axis=0)
-    z_scores_df = final.T
+    if aggregation == "mean":
+        signature_scores = alpha_signatures_df.mean(axis=0, skipna=True)
+    else:
+        signature_scores = alpha_signatures_df.sum(axis=0, skipna=True)
+    z_scores_df = pd.DataFrame({"sum": signature_scores})
 
     # adding LOO z_scores
     if score_type != "topas_score":
-        df = pd.DataFrame(z_scores_df["sum"].copy())
-        df.columns = ["sum"]
-        new_z_scors = calculate_z_scores(df, col_name="sum")
-        z_scores_df["z_scores_sum_LOO"] = new_z_scors
+        z_scores_df["z_scores_sum_LOO"] = calculate_z_scores(z_scores_df, col_name="sum")
 
     z_scores_df = _post_process_z_scores_df(z_scores_df, score_type)
     z_scores_df = utility.merge_with_patients_meta_df(z_scores_df, patients_df)
@@ -43,3 +58,84 @@ def _post_process_z_scores_df(z_scores_df, score_type):
         final_df = z_scores_df[["Sample name", "sum"]]
     final_df.columns = ["Sample name", "Z-score"]
     return final_df
+
+
+def get_signature_scores(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: str,
+    signature_genes: List[str],
+    score_type: str = "topas_score",
+    aggregation: str = "sum",
+) -> pd.DataFrame:
+    """
+    Scores all patients of a cohort for a gene signature, results are cached per signature.
+
+    Args:
+        cohorts_db (data_api.CohortDataAPI): The CohortDataAPI instance for accessing cohort data.
+        cohort_index (str): The index of the cohort to score.
+        signature_genes (List[str]): Gene names making up the signature.
+        score_type (str): "topas_score" for the aggregated protein z-scores, any other value
+            additionally applies leave-one-out z-scoring across patients.
+        aggregation (str): "sum" or "mean" of the protein z-scores of the signature genes.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the 'Sample name', 'Z-score' and patient metadata columns.
+
+    Example:
+        scores_df = get_signature_scores(cohorts_db, "0", ["IFI27", "ISG15"], "z_score", "mean")
+    """
+    if aggregation not in SIGNATURE_AGGREGATIONS:
+        raise ValueError(
+            f"Unknown aggregation {aggregation}, expected one of {SIGNATURE_AGGREGATIONS}"
+        )
+
+    def compute_scores():
+        return calculate_TOPAS_scores(
+            cohorts_db.get_protein_abundance_df(
+                cohort_index, intensity_unit=utility.IntensityUnit.Z_SCORE
+            ),
+            cohorts_db.get_patient_metadata_df(cohort_index),
+            signatures_proteins=list(signature_genes),
+            score_type=score_type,
+            aggregation=aggregation,
+        )
+
+    return signature_scores_cache.get_or_compute(
+        cohort_index,
+        (get_signature_id(signature_genes), score_type, aggregation),
+        compute_scores,
+    )
+
+
+def get_signature_id(signature_genes: List[str]) -> str:
+    """Order independent hash of a gene list, used as cache key and handle for uploaded signatures."""
+    genes = sorted(set(signature_genes))
+    return SIGNATURE_ID_PREFIX + hashlib.sha1(",".join(genes).encode("utf-8")).hexdigest()[:16]
+
+
+def parse_signature_genes(genes: str) -> List[str]:
+    return [gene.strip() for gene in genes.replace(";", ",").split(",") if gene.strip()]
+
+
+def register_signature(signature_genes: List[str], upload_folder: str) -> str:
+    """Stores an uploaded gene list such that it can be referred to by its signature id."""
+    signature_id = get_signature_id(signature_genes)
+    signature_folder = os.path.join(upload_folder, SIGNATURE_UPLOAD_SUBFOLDER)
+    os.makedirs(signature_folder, exist_ok=True)
+    with open(os.path.join(signature_folder, f"{signature_id}.txt"), "w") as f:
+        f.write("\n".join(sorted(set(signature_genes))))
+    return signature_id
+
+
+def resolve_signature_genes(signature: str, upload_folder: str) -> List[str]:
+    """Returns the genes of an uploaded signature id, or parses a comma separated gene list."""
+    if not signature.startswith(SIGNATURE_ID_PREFIX):
+        return parse_signature_genes(signature)
+
+    signature_file = os.path.join(
+        upload_folder, SIGNATURE_UPLOAD_SUBFOLDER, f"{os.path.basename(signature)}.txt"
+    )
+    if not os.path.exists(signature_file):
+        raise FileNotFoundError(f"Signature {signature} was not uploaded")
+    with open(signature_file) as f:
+        return list(filter(None, f.read().splitlines()))
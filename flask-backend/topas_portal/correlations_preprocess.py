@@ -7,10 +7,17 @@ from scipy.stats import t
 
 from topas_portal import utils
 from topas_portal import settings
+from topas_portal import result_tables
+from topas_portal.result_cache import CohortResultCache
 from topas_portal import topas_preprocess as topas_utils
 from topas_portal import fetch_data_matrix as data
 from topas_portal.data_api import data_api
 
+# columns of the correlation table that the result table filters refer to
+CORRELATION_COLUMNS = {"p_value": "p-value", "fdr": "FDR", "correlation": "correlation"}
+
+correlation_results_cache = CohortResultCache("correlation_results", max_entries=32)
+
 
 def compute_correlation_df(
     cohorts_db: data_api.CohortDataAPI,
@@ -21,6 +28,7 @@ def compute_correlation_df(
     intensity_unit: utils.IntensityUnit,
     topas_subscore_type: str = "important phosphorylation",
     patients_list=None,
+    query: result_tables.ResultTableQuery = None,
 ):
     """
     Wrapper function to calculate correlations between different modalities such as protein vs FPKM 
@@ -40,6 +48,8 @@ def compute_correlation_df(
         topas_subscore_type (str, optional): The type of topas subscore data to use if level is `TOPAS_IMPORTANT_PHOSPHO`. 
                                         Defaults to "important phosphorylation".
         patients_list (list, optional): List of patients to consider for correlation computation. Defaults to None.
+        query (result_tables.ResultTableQuery, optional): Page, sort order and filters of the returned rows.
+                                        The full correlation table is cached per cohort. Defaults to None (all rows).
 
     Returns:
         str: A JSON string representing the correlation DataFrame.
@@ -63,10 +73,74 @@ def compute_correlation_df(
     if not cohorts_db.provider:
         return "", "500 Cohort data not loaded"
 
+    correlation_df, error_code = get_correlation_table(
+        cohorts_db,
+        cohort_index,
+        identifier,
+        level,
+        level_2,
+        intensity_unit,
+        topas_subscore_type=topas_subscore_type,
+        patients_list=patients_list,
+    )
+    if correlation_df is None:
+        return "", error_code
+    return (
+        result_tables.result_table_to_json(correlation_df, query, CORRELATION_COLUMNS),
+        error_code,
+    )
+
+
+def get_correlation_table(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: int,
+    identifier: str,
+    level: utils.DataType,
+    level_2: utils.DataType,
+    intensity_unit: utils.IntensityUnit,
+    topas_subscore_type: str = "important phosphorylation",
+    patients_list=None,
+):
+    """
+    Full correlation table of `compute_correlation_df` and the status code, cached per cohort.
+    The table is None and the status code an error message if it cannot be computed.
+    """
+    return correlation_results_cache.get_or_compute(
+        cohort_index,
+        (
+            identifier,
+            utils.DataType(level),
+            utils.DataType(level_2),
+            intensity_unit,
+            topas_subscore_type,
+            None if patients_list is None else tuple(patients_list),
+        ),
+        lambda: _compute_correlation_df(
+            cohorts_db,
+            cohort_index,
+            identifier,
+            level,
+            level_2,
+            intensity_unit,
+            topas_subscore_type,
+            patients_list,
+        ),
+    )
+
+
+def _compute_correlation_df(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: int,
+    identifier: str,
+    level: utils.DataType,
+    level_2: utils.DataType,
+    intensity_unit: utils.IntensityUnit,
+    topas_subscore_type: str,
+    patients_list,
+):
     if level == utils.DataType.TOPAS_IMPORTANT_PHOSPHO:
-        report_dir = cohorts_db.get_report_dir(cohort_index)
         abundances = topas_utils.get_topas_subscore_data_per_type(
-            report_dir, identifier, sub_type=topas_subscore_type
+            cohorts_db, cohort_index, identifier, sub_type=topas_subscore_type
         )
     else:
         abundances = data.fetch_data_matrix(
@@ -78,7 +152,7 @@ def compute_correlation_df(
         )
 
     if len(abundances.index) != 1:
-        return "", f'400 {level} "{identifier}" not found in dataset'
+        return None, f'400 {level} "{identifier}" not found in dataset'
 
     all_abundances = data.fetch_data_matrix(
         cohorts_db,
@@ -115,7 +189,7 @@ def compute_correlation_df(
         correlation_df = correlation_df.drop(columns=["Modified sequence"])
         correlation_df = correlation_df.fillna("")
 
-    return utils.df_to_json(correlation_df), error_code
+    return correlation_df, error_code
 
 
 def _subset_to_overlapping_patients(
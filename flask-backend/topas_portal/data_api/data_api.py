@@ -91,9 +91,17 @@ class CohortDataAPI(Protocol):
     def get_genomics(self) -> pd.DataFrame:
         """"""
 
-    def get_oncoKB_annotations(self) -> dict:
+    def get_oncoKB_annotations(self) -> pd.Series:
         """"""
 
+    def get_topas_subscore_df(
+        self, cohort_index: str, topas_name: str, return_wide: bool = False
+    ) -> pd.DataFrame:
+        """Subscores of a topas in long format or wide format (one column per subscore)."""
+
+    def get_psp_annotation_index(self, cohort_index: str) -> Union[pd.DataFrame, None]:
+        """PSP annotations of all p-peptides of a cohort, None if they are not available."""
+
     def get_report_dir(self, cohort_index: str) -> str:
         """"""
 
@@ -60,11 +60,15 @@ class InMemoryCohortDataAPI:
         identifier: str = None,
         patient_name: str = None,
     ):
+        if identifier:
+            # select the row first, such that only its columns are filtered by intensity unit
+            df = df.loc[df.index == identifier]
+
         if intensity_unit is not None:
             df = extract_columns_and_remove_suffix(df, intensity_unit=intensity_unit)
 
         if identifier:
-            return df.loc[df.index == identifier]
+            return df
         elif patient_name:
             extra_columns = [c for c in settings.PP_EXTRA_COLUMNS if c in df.columns]
             return df[[patient_name] + extra_columns]
@@ -86,6 +90,8 @@ class InMemoryCohortDataAPI:
         include_ref: utils.IncludeRef = utils.IncludeRef.EXCLUDE_REF,
     ) -> pd.DataFrame:
         df = self.provider.get_dataframe(cohort_index, utils.DataType.FULL_PROTEOME)
+        if identifier:
+            df = df.loc[df.index == identifier]
         df = _filter_for_ref(df, include_ref)
 
         return self._filter_expression_df(df, intensity_unit, identifier, patient_name)
@@ -99,6 +105,8 @@ class InMemoryCohortDataAPI:
         include_ref: utils.IncludeRef = utils.IncludeRef.EXCLUDE_REF,
     ) -> pd.DataFrame:
         df = self.provider.get_dataframe(cohort_index, utils.DataType.PHOSPHO_PROTEOME)
+        if identifier:
+            df = df.loc[df.index == identifier]
         df = _filter_for_ref(df, include_ref)
 
         return self._filter_expression_df(df, intensity_unit, identifier, patient_name)
@@ -155,12 +163,22 @@ class InMemoryCohortDataAPI:
     def get_genomics(self) -> pd.DataFrame:
         return self.provider.genomics_data
 
-    def get_oncoKB_annotations(self) -> dict:
+    def get_oncoKB_annotations(self) -> pd.Series:
         return self.provider.oncoKB_data
 
     def get_digestes_peptides_maps(self) -> pd.DataFrame:
         return self.provider.digest_data
 
+    def get_topas_subscore_df(
+        self, cohort_index: str, topas_name: str, return_wide: bool = False
+    ) -> pd.DataFrame:
+        return self.provider.topas_subscore_tables.get_table(
+            self.get_report_dir(cohort_index), topas_name, return_wide=return_wide
+        )
+
+    def get_psp_annotation_index(self, cohort_index: str) -> Union[pd.DataFrame, None]:
+        return self.provider.psp_annotation_indices.get(int(cohort_index))
+
 
 def _filter_for_ref(df: pd.DataFrame, include_ref: utils.IncludeRef) -> pd.DataFrame:
     if include_ref == utils.IncludeRef.EXCLUDE_REF:
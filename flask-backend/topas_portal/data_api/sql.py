@@ -6,6 +6,7 @@ import pandas as pd
 
 import topas_portal.data_api.in_memory as in_memory
 import topas_portal.file_loaders.expression as expression_loader
+import topas_portal.file_loaders.psp_annotation as psp_annotation
 from topas_portal import settings
 from topas_portal import utils
 from topas_portal.databases.sql import SQLProvider
@@ -273,5 +274,36 @@ class SQLCohortDataAPI:
     def get_genomics(self) -> pd.DataFrame:
         return self.provider.genomics_data
 
-    def get_oncoKB_annotations(self) -> dict:
+    def get_oncoKB_annotations(self) -> pd.Series:
         return self.provider.oncoKB_data
+
+    def get_topas_subscore_df(
+        self, cohort_index: str, topas_name: str, return_wide: bool = False
+    ) -> pd.DataFrame:
+        return self.provider.topas_subscore_tables.get_table(
+            self.get_report_dir(cohort_index), topas_name, return_wide=return_wide
+        )
+
+    def get_psp_annotation_index(self, cohort_index: str) -> Union[pd.DataFrame, None]:
+        """the p-peptide annotations are not stored in the DB, the index is built from the annotated intensity file on first use"""
+        cohort_index = int(cohort_index)
+        if cohort_index not in self.provider.psp_annotation_indices:
+            cohort_name = self.config.get_cohort_names()[cohort_index]
+            cohort_report_dir = self.config.get_report_directory(cohort_index)
+            pp_df = pd.read_csv(
+                Path(os.path.join(cohort_report_dir, settings.PREPROCESSED_PP_INTENSITY)),
+                index_col=settings.PP_KEY,
+                usecols=lambda c: c == settings.PP_KEY or c in settings.PP_EXTRA_COLUMNS,
+            )
+            try:
+                self.provider.psp_annotation_indices[cohort_index] = (
+                    psp_annotation.load_psp_annotation_index(
+                        pp_df, self.config.get_config(), cohort_name, self.logger
+                    )
+                )
+            except Exception as err:
+                self.logger.log_message(
+                    f"PSP annotation index of {cohort_name} was not loaded: {err}"
+                )
+                return None
+        return self.provider.psp_annotation_indices[cohort_index]
@@ -18,6 +18,7 @@ from topas_portal.data_api.exceptions import (
 )
 from topas_portal import settings
 from topas_portal import utils
+from topas_portal import result_cache
 import topas_portal.file_loaders.topas as topas_loader
 import topas_portal.file_loaders.transcriptomics as tp
 import topas_portal.file_loaders.genomics as genomics_preprocess
@@ -27,6 +28,7 @@ import topas_portal.file_loaders.expression as expression_loader
 import topas_portal.file_loaders.sample_annotation as sample_annotation_loader
 import topas_portal.file_loaders.patient_metadata as patient_metadata_loader
 import topas_portal.file_loaders.digest_load as digest_load
+import topas_portal.file_loaders.psp_annotation as psp_annotation
 
 if TYPE_CHECKING:
     from logger import CohortLogger
@@ -53,6 +55,8 @@ class InMemoryProvider:
         self.FPKM = None
         self.genomics_data = None
         self.oncoKB_data = None
+        self.psp_annotation_indices = {}
+        self.topas_subscore_tables = topas_loader.TopasSubscoreTables()
 
     def initialize_cohorts(self, cohort_names: List[str]):
         self.dict_all_data = DICT_ALL_DATA
@@ -71,6 +75,7 @@ class InMemoryProvider:
         if cohort_names is None:
             cohort_names = config.get_cohort_names()
 
+        global_data_fingerprint = config.get_global_data_fingerprint()
         for cohort_name in cohort_names:
             cohort_index = config.get_cohort_index(cohort_name)
             self.load_single_cohort(cohort_name, cohort_index, config)
@@ -79,6 +84,7 @@ class InMemoryProvider:
         self._load_genomics(config.get_config())
         self._load_onkoKB_annotations(config.get_config())
         self._load_topas_annotation_tables(config.get_config())
+        result_cache.set_data_fingerprint(None, global_data_fingerprint)
 
     def load_single_cohort(
         self, cohort_name: str, cohort_index: int, config: CohortConfig
@@ -88,6 +94,7 @@ class InMemoryProvider:
         We pass both the cohort_name and cohort_index to check for consistency.
         """
         self.logger.log_message(f"loading ############ {cohort_name}")
+        data_fingerprint = config.get_cohort_data_fingerprint(cohort_name)
         cohort_data = _load_all_tables(cohort_name, config.get_config())
         for data_layer in cohort_data.keys():
             data_layer_cohort_name = self.dict_all_data[data_layer][cohort_index][
@@ -110,6 +117,45 @@ class InMemoryProvider:
             ]
             self.logger.log_message(f"{data_layer} of {cohort_name} was Updated ##")
 
+        self._load_topas_subscore_tables(cohort_name, config.get_config())
+        self._load_psp_annotation_index(
+            cohort_name,
+            cohort_index,
+            cohort_data[utils.DataType.PHOSPHO_PROTEOME],
+            config.get_config(),
+        )
+        result_cache.set_data_fingerprint(cohort_index, data_fingerprint)
+        result_cache.invalidate_cohort(cohort_index)
+
+    def _load_topas_subscore_tables(self, cohort_name: str, config: Dict):
+        self.logger.log_message(f"Loading topas subscores of {cohort_name}")
+        self.topas_subscore_tables.load_report_dir(
+            config["report_directory"][cohort_name], self.logger
+        )
+        self.logger.log_message(f"Topas subscores of {cohort_name} loaded")
+
+    def _load_psp_annotation_index(
+        self, cohort_name: str, cohort_index: int, pp_df: pd.DataFrame, config: Dict
+    ):
+        """PSP annotations of all p-peptides of the cohort, used for the patient reports"""
+        self.psp_annotation_indices.pop(cohort_index, None)
+        if not isinstance(pp_df, pd.DataFrame):
+            return
+
+        self.logger.log_message(f"Loading PSP annotation index of {cohort_name}")
+        try:
+            self.psp_annotation_indices[cohort_index] = (
+                psp_annotation.load_psp_annotation_index(
+                    pp_df, config, cohort_name, self.logger
+                )
+            )
+        except Exception as err:
+            self.logger.log_message(
+                f"PSP annotation index of {cohort_name} was not loaded, patient reports are annotated on the fly: {err}"
+            )
+            return
+        self.logger.log_message(f"PSP annotation index of {cohort_name} loaded")
+
     def _load_topas_annotation_tables(self, config: Dict):
         """Topas table is independent of cohorts and will be treated as a single global variable separately"""
         self.logger.log_message("Loading topas tables")
@@ -117,6 +163,7 @@ class InMemoryProvider:
         self.topas_complete_df = topas_loader.load_topas_annotation_df(
             basket_annotation_path
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("Topas tables loaded")
 
     def _load_FPKM(self, config: Dict):
@@ -132,14 +179,16 @@ class InMemoryProvider:
             rsuffix=utils.INTENSITY_UNIT_SUFFIXES[utils.IntensityUnit.INTENSITY],
         )
 
+        result_cache.invalidate_cohort()
         self.logger.log_message("FPKM data loaded")
 
     def _load_genomics(self, config: Dict):
         """Genomics table is independent of cohorts and will be treated as a single global variable separately"""
         self.logger.log_message("Loading Genomics data")
         self.genomics_data = genomics_preprocess.load_genomics_table(
-            config["genomics_path"]
+            config["genomics_path"], self.logger
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("Genomics data loaded")
 
     def _load_insilicodigest(self, config: Dict):
@@ -154,6 +203,7 @@ class InMemoryProvider:
         self.oncoKB_data = genomics_preprocess.load_onkoKB_dictionary(
             config["oncokb_path"]
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("oncoKB annotations data loaded")
 
     def get_dataframe(
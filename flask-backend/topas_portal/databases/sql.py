@@ -10,6 +10,7 @@ import topas_portal.topas_preprocess
 import db_settings as database
 from topas_portal import settings
 from topas_portal import utils
+from topas_portal import result_cache
 import topas_portal.file_loaders.topas as topas_loader
 import topas_portal.file_loaders.transcriptomics as tp
 import topas_portal.file_loaders.genomics as genomics_preprocess
@@ -35,6 +36,8 @@ class SQLProvider:
         self.FPKM = None
         self.genomics_data = None
         self.oncoKB_data = None
+        self.psp_annotation_indices = {}
+        self.topas_subscore_tables = topas_loader.TopasSubscoreTables()
 
     def initialize_cohorts(self, cohort_names: List[str]):
         pass
@@ -46,6 +49,7 @@ class SQLProvider:
         if cohort_names is None:
             cohort_names = config.get_cohort_names()
 
+        global_data_fingerprint = config.get_global_data_fingerprint()
         for cohort_name in cohort_names:
             cohort_index = config.get_cohort_index(cohort_name)
             self.load_single_cohort(cohort_name, cohort_index, config)
@@ -55,10 +59,12 @@ class SQLProvider:
         self._load_genomics(config.get_config())
         self._load_onkoKB_annotations(config.get_config())
         self._load_topas_annotation_tables(config.get_config())
+        result_cache.set_data_fingerprint(None, global_data_fingerprint)
 
     def load_single_cohort(
         self, cohort_name: str, cohort_index: int, config: CohortConfig
     ):
+        data_fingerprint = config.get_cohort_data_fingerprint(cohort_name)
         self.load_cohort_to_db_fp_expression_intensity(config, cohort_name)
         self.load_cohort_to_db_fp_expression_z(config, cohort_name)
         self.load_cohort_to_db_pp_expression_intensity(config, cohort_name)
@@ -69,6 +75,12 @@ class SQLProvider:
         self.load_cohort_to_db_fp_meta_expression(config, cohort_name)
         self.load_cohort_to_db_topas_scores(config, cohort_name)
         self.load_cohort_to_db_phosphoscores(config, cohort_name)
+        self.psp_annotation_indices.pop(cohort_index, None)
+        self.topas_subscore_tables.load_report_dir(
+            config.get_config()["report_directory"][cohort_name], self.logger
+        )
+        result_cache.set_data_fingerprint(cohort_index, data_fingerprint)
+        result_cache.invalidate_cohort(cohort_index)
 
     def _load_topas_annotation_tables(self, config: Dict):
         """Topas table is independent of cohorts and will be treated as a single global variable separately"""
@@ -77,6 +89,7 @@ class SQLProvider:
         self.topas_complete_df = topas_loader.load_topas_annotation_df(
             basket_annotation_path
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("Topas tables loaded")
 
     def _load_FPKM(self, config: Dict):
@@ -92,14 +105,16 @@ class SQLProvider:
             rsuffix=utils.INTENSITY_UNIT_SUFFIXES[utils.IntensityUnit.INTENSITY],
         )
 
+        result_cache.invalidate_cohort()
         self.logger.log_message("FPKM data loaded")
 
     def _load_genomics(self, config: Dict):
         """Genomics table is independent of cohorts and will be treated as a single global variable separately"""
         self.logger.log_message("Loading Genomics data")
         self.genomics_data = genomics_preprocess.load_genomics_table(
-            config["genomics_path"]
+            config["genomics_path"], self.logger
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("Genomics data loaded")
 
     def _load_onkoKB_annotations(self, config: Dict):
@@ -108,6 +123,7 @@ class SQLProvider:
         self.oncoKB_data = genomics_preprocess.load_onkoKB_dictionary(
             config["oncokb_path"]
         )
+        result_cache.invalidate_cohort()
         self.logger.log_message("oncoKB annotations data loaded")
 
     def get_kinase_scores_dataframe(self, result_dir):
@@ -419,6 +435,7 @@ class SQLProvider:
                 func(config, cohort_name)
             except Exception as err:
                 print(f"Unexpected {err=}, {type(err)=}")
+        result_cache.invalidate_cohort()
 
     def load_all_to_db_phosphoscores(self, config: CohortConfig):
         self._general_all_importer(config, self.load_cohort_to_db_phosphoscores)
@@ -0,0 +1,162 @@
+"""
+Density plots of the abundances of a single gene/protein against the background distribution
+of all abundances of the data layer.
+
+The background histogram only changes when the data is reloaded, so it is computed once per
+(cohort, data layer, intensity unit), right after loading, and only the histogram of the
+requested identifier is computed per request. The results are the same as for
+utils.count_df_to_density_plot_df.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+from typing import Callable, List, TYPE_CHECKING, Union
+
+import pandas as pd
+
+from topas_portal import utils
+from topas_portal.data_api.exceptions import IntensityUnitUnavailableError
+from topas_portal.result_cache import CohortResultCache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+BACKGROUND_UNITS = [utils.IntensityUnit.Z_SCORE, utils.IntensityUnit.INTENSITY]
+
+background_histograms_cache = CohortResultCache("background_histograms", max_entries=64)
+
+
+class BackgroundHistogram:
+    """Histogram of all abundances of the samples of a data layer"""
+
+    def __init__(self, abundance_df: pd.DataFrame, samples_list: List[str] = None):
+        if samples_list is None:
+            self.samples = list(abundance_df.columns)
+        else:
+            samples_set = set(samples_list)
+            self.samples = [x for x in abundance_df.columns if x in samples_set]
+        background = abundance_df[self.samples].to_numpy().flatten()
+        self.count_df = utils.data_to_count_df(background, color="blue", opacity=0.15)
+
+    def get_density_plot_df(self, abundance_df: pd.DataFrame, identifier: str) -> pd.DataFrame:
+        """Histogram of the identifier in abundance_df together with the background histogram"""
+        abundances = abundance_df[abundance_df.index == identifier]
+        abundances = abundances[self.samples].to_numpy()
+        abundances_count_df = utils.data_to_count_df(
+            abundances, color="red", opacity=0.8, density=False
+        )
+        final_count_df = pd.concat([self.count_df, abundances_count_df])
+        return final_count_df.sort_values(by="X")
+
+
+def get_protein_density_plot_df(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    identifier: str,
+    intensity_unit: utils.IntensityUnit,
+) -> pd.DataFrame:
+    background_histogram = get_protein_background_histogram(
+        cohorts_db, cohort_index, intensity_unit
+    )
+    abundance_df = cohorts_db.get_protein_abundance_df(
+        cohort_index, intensity_unit=intensity_unit, identifier=identifier
+    )
+    return background_histogram.get_density_plot_df(abundance_df, identifier)
+
+
+def get_fpkm_density_plot_df(
+    cohorts_db: data_api.CohortDataAPI,
+    identifier: str,
+    intensity_unit: utils.IntensityUnit,
+) -> pd.DataFrame:
+    background_histogram = get_fpkm_background_histogram(cohorts_db, intensity_unit)
+    fpkm_df = cohorts_db.get_fpkm_df(intensity_unit=intensity_unit, identifier=identifier)
+    return background_histogram.get_density_plot_df(fpkm_df, identifier)
+
+
+def get_protein_background_histogram(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    intensity_unit: utils.IntensityUnit,
+) -> BackgroundHistogram:
+    def compute_background_histogram():
+        samples_annotation_df = cohorts_db.get_sample_annotation_df(cohort_index)
+        samples_list = samples_annotation_df["Sample name"].unique().tolist()
+        protein_df = cohorts_db.get_protein_abundance_df(
+            cohort_index, intensity_unit=intensity_unit
+        )
+        return BackgroundHistogram(protein_df, samples_list)
+
+    return _get_background_histogram(
+        cohort_index,
+        utils.DataType.FULL_PROTEOME,
+        intensity_unit,
+        compute_background_histogram,
+    )
+
+
+def get_fpkm_background_histogram(
+    cohorts_db: data_api.CohortDataAPI, intensity_unit: utils.IntensityUnit
+) -> BackgroundHistogram:
+    # the transcriptomics data is shared by all cohorts
+    return _get_background_histogram(
+        None,
+        utils.DataType.TRANSCRIPTOMICS,
+        intensity_unit,
+        lambda: BackgroundHistogram(cohorts_db.get_fpkm_df(intensity_unit=intensity_unit)),
+    )
+
+
+def _get_background_histogram(
+    cohort_index: Union[int, str, None],
+    level: utils.DataType,
+    intensity_unit: utils.IntensityUnit,
+    compute_func: Callable[[], BackgroundHistogram],
+) -> BackgroundHistogram:
+    key = (level.value, utils.IntensityUnit(intensity_unit).value)
+    return background_histograms_cache.get_or_compute(cohort_index, key, compute_func)
+
+
+def build_background_histograms(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[Union[int, str]] = None
+):
+    """
+    Builds the background histograms of the cohorts right after loading instead of on first
+    use. The histograms of the transcriptomics data are only built if all cohorts are loaded.
+    """
+    build_fpkm_histograms = cohort_indices is None
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    for cohort_index in cohort_indices:
+        for intensity_unit in BACKGROUND_UNITS:
+            _build_background_histogram(
+                cohorts_db,
+                f"{intensity_unit.value} protein background histogram of cohort {cohort_index}",
+                lambda: get_protein_background_histogram(
+                    cohorts_db, cohort_index, intensity_unit
+                ),
+            )
+
+    if build_fpkm_histograms:
+        for intensity_unit in BACKGROUND_UNITS:
+            _build_background_histogram(
+                cohorts_db,
+                f"{intensity_unit.value} FPKM background histogram",
+                lambda: get_fpkm_background_histogram(cohorts_db, intensity_unit),
+            )
+
+
+def _build_background_histogram(
+    cohorts_db: data_api.CohortDataAPI,
+    description: str,
+    build_func: Callable[[], BackgroundHistogram],
+):
+    try:
+        build_func()
+    except IntensityUnitUnavailableError:
+        # not every data layer comes with every intensity unit
+        pass
+    except Exception as err:
+        cohorts_db.logger.log_message(f"The {description} was not built: {err}")
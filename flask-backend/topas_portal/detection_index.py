@@ -0,0 +1,193 @@
+"""
+Detection bitmaps for the Venn comparisons of patients and batches.
+
+For each cohort and data layer (fp/pp), a features x samples bitmap records which proteins or
+p-sites have an intensity in which sample. It is built once after loading, with the features
+packed into bits per sample, such that set sizes, intersections, unions and unique counts of
+any list of patients or batches are computed with bitwise operations instead of slicing the
+intensity matrix and sending the identifier lists of all groups to the frontend.
+
+A patient detects the features with an intensity in its sample, a batch detects the features
+with an intensity in all of its samples, as in the batch comparison of the patient-centric tab.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+import itertools
+from typing import Dict, List, Optional, TYPE_CHECKING, Union
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from topas_portal import settings
+from topas_portal import utils
+from topas_portal.result_cache import CohortResultCache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+# number of regions grows with 2^groups, larger comparisons only return the summary counts
+MAX_REGION_GROUPS = 6
+
+_POPCOUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+detection_bitmaps_cache = CohortResultCache("detection_bitmaps", max_entries=32)
+
+
+class DetectionBitmap:
+    """Features detected per sample, packed into one row of bits per sample"""
+
+    def __init__(self, intensity_df: pd.DataFrame, sample_annotation_df: pd.DataFrame):
+        samples_list = sample_annotation_df["Sample name"].unique().tolist()
+        self.samples = utils.intersection(samples_list, intensity_df.columns)
+        detected_df = intensity_df[self.samples].notna()
+        if detected_df.index.has_duplicates:
+            detected_df = detected_df.groupby(level=0, sort=False).any()
+        self.features = detected_df.index
+
+        self._sample_positions = {sample: i for i, sample in enumerate(self.samples)}
+        self._bits = np.packbits(detected_df.to_numpy().T, axis=1)
+        self._batch_samples = {
+            str(batch): [
+                sample for sample in samples.astype(str) if sample in self._sample_positions
+            ]
+            for batch, samples in sample_annotation_df.groupby(
+                sample_annotation_df["Batch_No"].astype(str)
+            )["Sample name"]
+        }
+
+    def get_patient_bits(self, patient: str) -> npt.NDArray[np.uint8]:
+        """Packed features detected in the sample of the patient, none for unknown patients"""
+        position = self._sample_positions.get(patient)
+        if position is None:
+            return np.zeros(self._bits.shape[1], dtype=np.uint8)
+        return self._bits[position]
+
+    def get_batch_bits(self, batch: str) -> npt.NDArray[np.uint8]:
+        """Packed features detected in all samples of the batch, none for empty batches"""
+        samples = self._batch_samples.get(str(batch), [])
+        if len(samples) == 0:
+            return np.zeros(self._bits.shape[1], dtype=np.uint8)
+        positions = [self._sample_positions[sample] for sample in samples]
+        return np.bitwise_and.reduce(self._bits[positions], axis=0)
+
+    def get_group_bits(self, modality: str, groups: List[str]) -> npt.NDArray[np.uint8]:
+        """Packed detected features, groups x bytes, of patients or batches"""
+        if modality == "patients":
+            get_bits = self.get_patient_bits
+        elif modality == "batches":
+            get_bits = self.get_batch_bits
+        else:
+            raise ValueError(f"Unknown modality for the detection bitmap: {modality}")
+        return np.vstack([get_bits(group) for group in groups])
+
+    def get_members(self, bits: npt.NDArray[np.uint8]) -> List[str]:
+        detected = np.unpackbits(bits, count=len(self.features)).astype(bool)
+        return self.features[detected].tolist()
+
+
+def count_bits(bits: npt.NDArray[np.uint8]) -> int:
+    return int(_POPCOUNTS[bits].sum())
+
+
+def compare_groups(
+    bitmap: DetectionBitmap,
+    modality: str,
+    groups: List[str],
+    region: Optional[List[str]] = None,
+) -> Dict:
+    """
+    Set sizes, the intersection and union size and the number of features unique to each group.
+    For up to MAX_REGION_GROUPS groups, also the size of every region of the Venn diagram, the
+    features of exactly the groups in the region are returned if it is given.
+    """
+    group_bits = bitmap.get_group_bits(modality, groups)
+    union_bits = np.bitwise_or.reduce(group_bits, axis=0)
+    result = {
+        "groups": groups,
+        "sizes": {group: count_bits(bits) for group, bits in zip(groups, group_bits)},
+        "intersection": count_bits(np.bitwise_and.reduce(group_bits, axis=0)),
+        "union": count_bits(union_bits),
+        "unique": {
+            group: count_bits(_get_region_bits(group_bits, [i]))
+            for i, group in enumerate(groups)
+        },
+    }
+
+    if len(groups) <= MAX_REGION_GROUPS:
+        result["regions"] = [
+            {
+                "groups": [groups[i] for i in included],
+                "count": count_bits(_get_region_bits(group_bits, included)),
+            }
+            for num_included in range(1, len(groups) + 1)
+            for included in itertools.combinations(range(len(groups)), num_included)
+        ]
+
+    if region:
+        unknown_groups = [group for group in region if group not in groups]
+        if unknown_groups:
+            raise ValueError(f"Region contains groups that are not compared: {unknown_groups}")
+        included = [i for i, group in enumerate(groups) if group in region]
+        result["region"] = {
+            "groups": [groups[i] for i in included],
+            "members": bitmap.get_members(_get_region_bits(group_bits, included)),
+        }
+    return result
+
+
+def _get_region_bits(
+    group_bits: npt.NDArray[np.uint8], included: List[int]
+) -> npt.NDArray[np.uint8]:
+    """Features detected in all included groups and in none of the other groups"""
+    excluded = [i for i in range(len(group_bits)) if i not in included]
+    bits = np.bitwise_and.reduce(group_bits[list(included)], axis=0)
+    if excluded:
+        bits = bits & ~np.bitwise_or.reduce(group_bits[excluded], axis=0)
+    return bits
+
+
+def get_detection_bitmap(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str], pp_fp: str
+) -> DetectionBitmap:
+    """Raises a ValueError for data layers other than fp and pp"""
+    pp_fp = utils.DataType(pp_fp)
+    if pp_fp not in [utils.DataType.FP, utils.DataType.PP]:
+        raise ValueError(f"Detection bitmaps are only available for fp and pp, not {pp_fp.value}")
+
+    def compute_detection_bitmap() -> DetectionBitmap:
+        if pp_fp == utils.DataType.FP:
+            intensity_df = cohorts_db.get_protein_abundance_df(
+                cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
+            )
+        else:
+            intensity_df = cohorts_db.get_psite_abundance_df(
+                cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
+            )
+        return DetectionBitmap(intensity_df, cohorts_db.get_sample_annotation_df(cohort_index))
+
+    return detection_bitmaps_cache.get_or_compute(
+        cohort_index, pp_fp.value, compute_detection_bitmap
+    )
+
+
+def build_detection_bitmaps(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[Union[int, str]] = None
+):
+    """Builds the detection bitmaps of the cohorts right after loading instead of on first use."""
+    if settings.DATABASE_MODE:
+        return  # scanning the full matrices is too slow in the database, built on first use
+
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    for cohort_index in cohort_indices:
+        for pp_fp in [utils.DataType.FP, utils.DataType.PP]:
+            try:
+                get_detection_bitmap(cohorts_db, cohort_index, pp_fp)
+            except Exception as err:
+                cohorts_db.logger.log_message(
+                    f"Detection bitmap {pp_fp.value} of cohort {cohort_index} was not built: {err}"
+                )
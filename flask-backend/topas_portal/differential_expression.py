@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING
 
 from topas_portal import utils
 from topas_portal import settings
+from topas_portal.result_cache import CohortResultCache
 from topas_portal.signature_function import one_vs_all_t_test
 import topas_portal.fetch_data_matrix as data
 import topas_portal.topas_scores_meta as topas
@@ -13,6 +14,11 @@ import topas_portal.topas_scores_meta as topas
 if TYPE_CHECKING:
     import topas_portal.data_api.data_api as data_api
 
+# columns of the t-test table that the result table filters refer to
+DIFFERENTIAL_COLUMNS = {"p_value": "p_values", "fdr": "fdr", "fold_change": "expression1"}
+
+differential_results_cache = CohortResultCache("differential_results", max_entries=32)
+
 
 def get_data_for_t_test(
     cohorts_db: data_api.CohortDataAPI,
@@ -54,7 +60,25 @@ def get_data_for_t_test(
         - If `grp2_indexes` is "index", the first group is tested against all other patients.
         - If the analysis is on phospho-proteome data, PSP annotations are added.
         - Adjustments are made to filter out infinite values before returning results.
+        - Results are cached per cohort, the returned dataframe must not be modified.
     """
+    return differential_results_cache.get_or_compute(
+        cohort_index,
+        (grp1_indexes, grp2_indexes, utils.DataType(level), y_axis_type),
+        lambda: _compute_t_test_df(
+            cohorts_db, cohort_index, grp1_indexes, grp2_indexes, level, y_axis_type
+        ),
+    )
+
+
+def _compute_t_test_df(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: str,
+    grp1_indexes: str,
+    grp2_indexes: str,
+    level: utils.DataType,
+    y_axis_type: str,
+):
     # patients_df['Sample_name_rep_truncated'] = patients_df['Sample name'].str.replace(r'-R[0-9]$', '', regex=True)
     patients_df = cohorts_db.get_patient_metadata_df(cohort_index)
     grp1 = grp1_indexes.split(",")
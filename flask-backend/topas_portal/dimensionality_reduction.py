@@ -1,27 +1,52 @@
-from typing import Any, Dict, Optional, Protocol, Type
+import importlib
+import os
+from typing import Any, Dict, Iterator, Optional, Protocol, Type, TYPE_CHECKING
+import warnings
 
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
-from numba.core.errors import NumbaDeprecationWarning
-import warnings
+from scipy import sparse
 
-warnings.simplefilter("ignore", category=NumbaDeprecationWarning)
-
-from phate import PHATE
-from ppca import PPCA
 from sklearn.preprocessing import StandardScaler
-from umap import UMAP
 
 from sklearn.decomposition import PCA
+from sklearn.utils.extmath import randomized_svd
 from typing import Tuple, List
 
+from topas_portal import imputation
+
+# umap, phate (and numba) take several seconds to import, they are only imported on first use
+if TYPE_CHECKING:
+    from ppca import PPCA
 
 
 FloatArray = npt.NDArray[np.float64]
 
+# default min_obs of PPCA.fit
+PPCA_MIN_OBSERVATIONS = 10
+
+# values per block of rows in which the soft-impute PCA scans and fills the dense matrix
+CHUNK_SIZE = 2**18
+
+
+def _import_numba_based_module(module_name: str):
+    """
+    Imports umap or phate. Numba caches the functions compiled for them (cache=True) in
+    NUMBA_CACHE_DIR, which defaults to PORTAL_CACHE_DIR/numba if it is not set.
+    """
+    from topas_portal import settings
+
+    os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(settings.PORTAL_CACHE_DIR, "numba"))
+    from numba.core.errors import NumbaDeprecationWarning
+
+    warnings.simplefilter("ignore", category=NumbaDeprecationWarning)
+    return importlib.import_module(module_name)
+
 
 class CohortDimensionalityReduction(Protocol):
+    # imputation applied before fitting, None if the method handles missing values itself
+    imputation_method: Optional[imputation.ImputationMethod]
     _fit_performed: bool
     _imputed_data: pd.DataFrame
     _dim_object: Any
@@ -33,6 +58,10 @@ class CohortDimensionalityReduction(Protocol):
         ...
 
     def transform(self, x: pd.DataFrame) -> pd.DataFrame:
+        """
+        Embeds new samples x features data, with the features in the order used for
+        fitting, using the scaling and imputation fitted on the reference data.
+        """
         ...
 
     def get_explained_variances(self) -> Optional[FloatArray]:
@@ -50,39 +79,50 @@ def impute_missing_values_with_min(
             "Warning: NaN values detected, imputing with minimum value. "
             "To impute missing values during PCA calculation, use fit_transform instead."
         )
-    return df.fillna(df.min().min())
+    return imputation.impute_min(df)
+
+
 
+def _impute_with_fitted_min(df: pd.DataFrame, min_value: float) -> pd.DataFrame:
+    """Imputes new samples with the minimum of the data used for fitting, not of the new samples"""
+    return df.astype(float).fillna(min_value)
 
 
-def _impute_and_scale(df: pd.DataFrame) -> pd.DataFrame:
-    df = impute_missing_values_with_min(df)
-    df = StandardScaler().fit_transform(df)
-    return pd.DataFrame(df)
+def _get_min_value(df: pd.DataFrame) -> float:
+    min_value = np.nanmin(df.to_numpy(dtype=float))
+    return 0.0 if np.isnan(min_value) else float(min_value)
 
 
 class CohortPCA:
+    imputation_method = imputation.ImputationMethod.MIN
+
     def __init__(self, n_components: int = 2):
         self._n_components = n_components
 
         self._dim_object = PCA(n_components=self._n_components)
+        self._scaler = StandardScaler()
+        self._min_value = 0.0
 
         self._fit_performed = False
         self._imputed_data = pd.DataFrame()
 
     def fit(self, df: pd.DataFrame) -> None:
-        df = _impute_and_scale(df)
-        self._dim_object.fit(df)
+        self._imputed_data = impute_missing_values_with_min(df, print_warning=False)
+        self._min_value = _get_min_value(self._imputed_data)
+        x = self._scaler.fit_transform(self._imputed_data.to_numpy())
+        self._dim_object.fit(x)
         self._fit_performed = True
 
     def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = _impute_and_scale(df)
         self.fit(df)
-        self._fit_performed = True
-        return self.transform(df)
+        return self.transform(self._imputed_data)
 
-    def transform(self, x: pd.DataFrame) -> pd.DataFrame:
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         assert self._fit_performed, "Fitting must be done before PCA transform"
-        return pd.DataFrame(self._dim_object.transform(x))
+        df = _impute_with_fitted_min(df, self._min_value)
+        return pd.DataFrame(
+            self._dim_object.transform(self._scaler.transform(df.to_numpy()))
+        )
 
     def get_explained_variances(self) -> FloatArray:
         assert self._fit_performed, "Fitting must be done before getting loadings"
@@ -91,15 +131,20 @@ class CohortPCA:
 
 
 class CohortPPCA:
+    imputation_method = None  # missing values are imputed by the PPCA fit
+
     def __init__(self, n_components: int = 2):
         self._n_components = n_components
 
+        from ppca import PPCA
+
         self._dim_object = PPCA()
 
         self._fit_performed = False
         self._imputed_data = pd.DataFrame()
 
     def fit(self, df: pd.DataFrame) -> None:
+        self._fitted_features = _get_ppca_features(df)
         df = np.array(df)
         self._dim_object.fit(data=df, d=self._n_components, verbose=False)
         self._imputed_data = pd.DataFrame(self._dim_object.data)
@@ -111,8 +156,8 @@ class CohortPPCA:
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         assert self._fit_performed, "Fitting must be done before PCA transform"
-        df = impute_missing_values_with_min(df)
-        return pd.DataFrame(self._dim_object.transform(df.values))
+        x = _complete_with_ppca(self._dim_object, self._fitted_features, df)
+        return pd.DataFrame(self._dim_object.transform(x))
 
     def get_explained_variances(self) -> FloatArray:
         assert self._fit_performed, "Fitting must be done before PCA transform"
@@ -121,7 +166,29 @@ class CohortPPCA:
         return explained_variance
 
 
+def _get_ppca_features(df: pd.DataFrame) -> npt.NDArray[np.bool_]:
+    """Features kept by PPCA.fit, which drops features with fewer than PPCA_MIN_OBSERVATIONS values"""
+    return (df.notna().sum(axis=0) >= PPCA_MIN_OBSERVATIONS).to_numpy()
+
+
+def _complete_with_ppca(
+    ppca: "PPCA", fitted_features: npt.NDArray[np.bool_], df: pd.DataFrame
+) -> FloatArray:
+    """
+    Standardizes new samples like the data PPCA was fitted on and fills their missing values
+    with the reconstruction from the fitted loadings (a single E-step for the new samples).
+    """
+    x = ppca._standardize(df.to_numpy(dtype=float)[:, fitted_features])
+    observed = np.isfinite(x)
+    x[~observed] = 0
+    scores = x @ ppca.C @ np.linalg.pinv(ppca.C.T @ ppca.C)
+    return np.where(observed, x, scores @ ppca.C.T)
+
+
 class CohortUMAP:
+    # the neighbour graph of UMAP needs complete samples, it is built on the PPCA reconstruction
+    imputation_method = None
+
     def __init__(
         self,
         n_components: int = 2,
@@ -140,9 +207,13 @@ class CohortUMAP:
         self._fit_performed = False
         self._imputed_data = pd.DataFrame()
 
+        from ppca import PPCA
+
+        umap = _import_numba_based_module("umap")
+
         np.random.seed(random_state)
         self._ppca = PPCA()
-        self._dim_object = UMAP(
+        self._dim_object = umap.UMAP(
             n_components=self._n_components_umap,
             n_epochs=self._n_epochs,
             n_neighbors=self._n_neigh,
@@ -152,6 +223,7 @@ class CohortUMAP:
         )
 
     def fit(self, df: pd.DataFrame) -> None:
+        self._fitted_features = _get_ppca_features(df)
         self._ppca.fit(data=df.values, d=self._n_components_ppca, verbose=False)
         self._imputed_data = pd.DataFrame(self._ppca.data)
 
@@ -160,28 +232,36 @@ class CohortUMAP:
 
     def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
         self.fit(df)
-        return self.transform(self._imputed_data)
+        return pd.DataFrame(self._dim_object.transform(self._imputed_data))
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         assert self._fit_performed, "Fitting must be done before UMAP transform"
-        df = impute_missing_values_with_min(df)
-        return pd.DataFrame(self._dim_object.transform(df))
+        x = _complete_with_ppca(self._ppca, self._fitted_features, df)
+        return pd.DataFrame(self._dim_object.transform(x))
 
     def get_explained_variances(self) -> None:
         return None
 
 
 class CohortPHATE:
+    # the diffusion operator of PHATE is computed on the matrix completed by the PPCA fit
+    imputation_method = None
+
     def __init__(self, n_components_ppca: int = 2):
         self._n_components_ppca = n_components_ppca
 
         self._imputed_data = pd.DataFrame()
         self._fit_performed: bool = False
 
+        from ppca import PPCA
+
+        phate = _import_numba_based_module("phate")
+
         self._ppca = PPCA()
-        self._dim_object = PHATE()
+        self._dim_object = phate.PHATE()
 
     def fit(self, df: pd.DataFrame) -> None:
+        self._fitted_features = _get_ppca_features(df)
         self._ppca.fit(data=df.values, d=self._n_components_ppca, verbose=False)
         self._imputed_data = pd.DataFrame(self._ppca.data)
 
@@ -190,17 +270,267 @@ class CohortPHATE:
 
     def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
         self.fit(df)
-        return self.transform(self._imputed_data)
+        return pd.DataFrame(self._dim_object.transform(self._imputed_data))
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         assert self._fit_performed, "Fitting must be done before PHATE transform"
-        df = impute_missing_values_with_min(df)
-        return pd.DataFrame(self._dim_object.transform(df))
+        x = _complete_with_ppca(self._ppca, self._fitted_features, df)
+        return pd.DataFrame(self._dim_object.transform(x))
 
     def get_explained_variances(self) -> None:
         return None
 
 
+def _standardize(x: FloatArray) -> Tuple[FloatArray, FloatArray, FloatArray]:
+    """Centers and scales the columns of x in place, returns x with the column means and stds."""
+    means = x.mean(axis=0)
+    stds = x.std(axis=0)
+    stds[stds == 0] = 1
+    x -= means
+    x /= stds
+    return x, means, stds
+
+
+def _standardize_observed(x: FloatArray) -> Tuple[sparse.csr_matrix, FloatArray, FloatArray]:
+    """
+    Centers and scales the observed (finite) values of x per column. Returns the standardized
+    observed values as a sparse rows x columns matrix, with the column means and standard
+    deviations.
+    """
+    rows, columns = [], []
+    for start, chunk in _iter_row_chunks(x):
+        chunk_rows, chunk_columns = np.nonzero(np.isfinite(chunk))
+        rows.append(chunk_rows + start)
+        columns.append(chunk_columns)
+    rows, columns = np.concatenate(rows), np.concatenate(columns)
+
+    values = x[rows, columns]
+    counts = np.maximum(np.bincount(columns, minlength=x.shape[1]), 1)
+    means = np.bincount(columns, weights=values, minlength=x.shape[1]) / counts
+    stds = np.sqrt(
+        np.bincount(columns, weights=(values - means[columns]) ** 2, minlength=x.shape[1])
+        / counts
+    )
+    stds[stds == 0] = 1
+    values = (values - means[columns]) / stds[columns]
+    # the structure of the matrix marks the observed values, standardized zeros are kept
+    x_observed = sparse.csr_matrix((values, (rows, columns)), shape=x.shape)
+    return x_observed, means, stds
+
+
+def _iter_row_chunks(x: FloatArray) -> Iterator[Tuple[int, FloatArray]]:
+    """Views of consecutive rows of x with about CHUNK_SIZE values each"""
+    chunk_rows = max(1, CHUNK_SIZE // max(x.shape[1], 1))
+    for start in range(0, x.shape[0], chunk_rows):
+        yield start, x[start : start + chunk_rows]
+
+
+class CohortRandomizedPCA:
+    """
+    PCA by randomized truncated SVD for complete (or min-imputed) data. Only the top
+    components are computed, time and memory grow linearly with the size of the matrix.
+    """
+
+    imputation_method = imputation.ImputationMethod.MIN
+
+    def __init__(self, n_components: int = 2, n_iter: int = 4, random_state: int = 42):
+        self._n_components = n_components
+        self._n_iter = n_iter
+        self._random_state = random_state
+
+        self._dim_object = None  # (singular values, components, means, stds)
+        self._min_value = 0.0
+        self._fit_performed = False
+        self._imputed_data = pd.DataFrame()
+        self._explained_variance = None
+
+    def fit(self, df: pd.DataFrame) -> None:
+        self.fit_transform(df)
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        self._imputed_data = impute_missing_values_with_min(df, print_warning=False)
+        self._min_value = _get_min_value(self._imputed_data)
+        x, means, stds = _standardize(
+            self._imputed_data.to_numpy(dtype=np.float32, copy=True)
+        )
+
+        u, singular_values, components = randomized_svd(
+            x,
+            n_components=self._n_components,
+            n_iter=self._n_iter,
+            random_state=self._random_state,
+        )
+        total_variance = np.square(x, dtype=np.float64).sum()
+        self._explained_variance = np.square(singular_values) / total_variance
+        self._dim_object = (singular_values, components, means, stds)
+        self._fit_performed = True
+        return pd.DataFrame(u * singular_values)
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        assert self._fit_performed, "Fitting must be done before PCA transform"
+        _, components, means, stds = self._dim_object
+        x = _impute_with_fitted_min(df, self._min_value).to_numpy(dtype=np.float32)
+        return pd.DataFrame(((x - means) / stds) @ components.T)
+
+    def get_explained_variances(self) -> FloatArray:
+        assert self._fit_performed, "Fitting must be done before getting loadings"
+        return self._explained_variance
+
+
+class CohortSoftImputePCA:
+    """
+    PCA of data with missing values by a masked low-rank fit: the standardized matrix is
+    approximated by A @ B.T with ridge-regularized alternating least squares on the observed
+    values only (soft-impute ALS), no dense imputation or covariance matrix is needed. The
+    observed values are kept in a sparse matrix, such that an iteration takes time and memory
+    linear in the number of observed values. Missing values are imputed with the low-rank
+    reconstruction, block by block into a single copy of the data.
+    """
+
+    imputation_method = None  # missing values are imputed by the low-rank fit
+
+    def __init__(
+        self,
+        n_components: int = 2,
+        rank: int = 10,
+        shrinkage: float = 1.0,
+        max_iter: int = 100,
+        tol: float = 1e-4,
+        random_state: int = 42,
+    ):
+        self._n_components = n_components
+        self._rank = rank
+        self._shrinkage = shrinkage
+        self._max_iter = max_iter
+        self._tol = tol
+        self._random_state = random_state
+
+        self._dim_object = None  # (components, means, stds)
+        self._fit_performed = False
+        self._imputed_data = pd.DataFrame()
+        self._explained_variance = None
+
+    def fit(self, df: pd.DataFrame) -> None:
+        self.fit_transform(df)
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        x = df.to_numpy(dtype=np.float64, copy=True)
+        x_observed, means, stds = _standardize_observed(x)
+
+        rank = max(self._n_components, min(self._rank, *x.shape))
+        a, b = self._fit_low_rank(x_observed, rank)
+
+        # rotate the factors to orthogonal principal components
+        q_a, r_a = np.linalg.qr(a)
+        q_b, r_b = np.linalg.qr(b)
+        u, singular_values, vt = np.linalg.svd(r_a @ r_b.T)
+        scores = q_a @ u[:, : self._n_components] * singular_values[: self._n_components]
+        components = (q_b @ vt.T[:, : self._n_components]).T
+
+        # x becomes the imputed matrix, the only dense copy of the data
+        imputed_sum_of_squares = _impute_with_low_rank(x, a, b, means, stds)
+        self._imputed_data = pd.DataFrame(x, index=df.index, columns=df.columns)
+        total_variance = max(
+            np.square(x_observed.data).sum() + imputed_sum_of_squares, np.finfo(float).eps
+        )
+        self._explained_variance = (
+            np.square(singular_values[: self._n_components]) / total_variance
+        )
+        self._dim_object = (components, means, stds)
+        self._fit_performed = True
+        return pd.DataFrame(scores)
+
+    def _fit_low_rank(
+        self, x_observed: sparse.csr_matrix, rank: int
+    ) -> Tuple[FloatArray, FloatArray]:
+        """Alternating ridge regressions of the rows and columns on the observed values."""
+        rng = np.random.default_rng(self._random_state)
+        a = rng.standard_normal((x_observed.shape[0], rank)) * 0.01
+        b = np.zeros((x_observed.shape[1], rank))
+        regularization = self._shrinkage * np.eye(rank)
+        x_observed_by_column = x_observed.T.tocsr()
+        rows, columns = _get_observed_positions(x_observed)
+        previous_loss = np.inf
+        for _ in range(self._max_iter):
+            b = _solve_masked_ridge(x_observed_by_column, a, regularization)
+            a = _solve_masked_ridge(x_observed, b, regularization)
+            residuals = x_observed.data - np.einsum("ij,ij->i", a[rows], b[columns])
+            loss = np.square(residuals).sum() + self._shrinkage * (
+                np.square(a).sum() + np.square(b).sum()
+            )
+            if previous_loss - loss <= self._tol * max(loss, np.finfo(float).eps):
+                break
+            previous_loss = loss
+        return a, b
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        assert self._fit_performed, "Fitting must be done before PCA transform"
+        components, means, stds = self._dim_object
+        x = (df.to_numpy(dtype=np.float64) - means) / stds
+        x[~np.isfinite(x)] = 0  # missing values at the mean
+        return pd.DataFrame(x @ components.T)
+
+    def get_explained_variances(self) -> FloatArray:
+        assert self._fit_performed, "Fitting must be done before getting loadings"
+        return self._explained_variance
+
+
+def _solve_masked_ridge(
+    x_observed: sparse.csr_matrix, factors: FloatArray, regularization: FloatArray
+) -> FloatArray:
+    """
+    Solves min_w ||x_i - factors @ w_i||^2 + w_i^T regularization w_i over the observed values
+    of each row i of x at once, rows without observed values get w_i = 0.
+    """
+    rank = factors.shape[1]
+    solutions = np.zeros((x_observed.shape[0], rank))
+    observed_rows = np.flatnonzero(np.diff(x_observed.indptr))
+    if len(observed_rows) == 0:
+        return solutions
+
+    x_observed = x_observed[observed_rows]
+    observed = sparse.csr_matrix(
+        (np.ones_like(x_observed.data), x_observed.indices, x_observed.indptr),
+        shape=x_observed.shape,
+    )
+    # gram matrices of the factors of the observed columns per row, rows x rank x rank
+    factor_products = (factors[:, :, None] * factors[:, None, :]).reshape(-1, rank * rank)
+    grams = (observed @ factor_products).reshape(-1, rank, rank) + regularization
+    solutions[observed_rows] = np.linalg.solve(grams, (x_observed @ factors)[:, :, None])[
+        :, :, 0
+    ]
+    return solutions
+
+
+def _impute_with_low_rank(
+    x: FloatArray, a: FloatArray, b: FloatArray, means: FloatArray, stds: FloatArray
+) -> float:
+    """
+    Replaces the missing values of x in place with the low-rank reconstruction a @ b.T, which
+    is only computed for CHUNK_SIZE values at a time. Returns the sum of squares of the
+    reconstructed values on the standardized scale.
+    """
+    sum_of_squares = 0.0
+    for start, chunk in _iter_row_chunks(x):
+        missing = ~np.isfinite(chunk)
+        if not missing.any():
+            continue
+        reconstruction = a[start : start + len(chunk)] @ b.T
+        sum_of_squares += np.square(reconstruction[missing]).sum()
+        reconstruction *= stds
+        reconstruction += means
+        np.copyto(chunk, reconstruction, where=missing)
+    return sum_of_squares
+
+
+def _get_observed_positions(
+    x_observed: sparse.csr_matrix,
+) -> Tuple[npt.NDArray[np.intp], npt.NDArray[np.intp]]:
+    """Row and column of each stored value, in the order of x_observed.data"""
+    rows = np.repeat(np.arange(x_observed.shape[0]), np.diff(x_observed.indptr))
+    return rows, x_observed.indices
+
+
 def get_dimensionality_reduction_method(
     plot_type: str,
 ) -> CohortDimensionalityReduction:
@@ -211,6 +541,8 @@ def get_dimensionality_reduction_method(
         "PPCA": CohortPPCA,
         "UMAP": CohortUMAP,
         "PHATE": CohortPHATE,
+        "RSVD": CohortRandomizedPCA,  # large cohorts, complete data
+        "SOFTIMPUTE": CohortSoftImputePCA,  # large cohorts, data with missing values
     }
     if plot_type not in factories.keys():
         raise NotImplementedError
@@ -220,6 +552,16 @@ def get_dimensionality_reduction_method(
 
 
 
+def warm_up() -> None:
+    """
+    Fits UMAP on a small random matrix, such that numba compiles (and caches on disk) the
+    UMAP functions before the first QC request instead of during it.
+    """
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame(rng.standard_normal((40, 20)))
+    CohortUMAP(n_epochs=10).fit_transform(df)
+
+
 def get_pca_objects(
     dfs: List[pd.DataFrame], pct_threshold: List[float]
 ) -> Tuple[List, List]:
@@ -247,6 +589,8 @@ def calculate_pcas(
         x = StandardScaler().fit_transform(x)
         all_x.append(x)
 
+        from ppca import PPCA
+
         ppca = PPCA()
         ppca.fit(data=x, d=2, verbose=False)
         # change cumulated explained variance to just variance per PC
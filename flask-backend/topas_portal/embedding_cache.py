@@ -0,0 +1,90 @@
+"""
+Cache for PCA/PPCA/UMAP/PHATE embeddings. The QC views (colouring, silhouette scores
+before and after clustering) request the same embedding many times, so the embedding
+and the explained variances are kept in memory and persisted to
+PORTAL_CACHE_DIR/<cohort name>/embeddings. The imputed matrix is not kept here, it is
+shared with the other views in topas_portal/imputation.py.
+
+Persisted embeddings are only reused for the same fingerprint of the loaded data.
+"""
+
+import hashlib
+import os
+from typing import Callable, Hashable, List, Optional, Union
+
+import pandas as pd
+
+from logger import CohortLogger
+from topas_portal import settings
+from topas_portal import result_cache
+from topas_portal import imputation
+from topas_portal.result_cache import CohortResultCache
+
+EMBEDDING_DIR = "embeddings"
+
+embeddings_cache = CohortResultCache("embeddings", max_entries=16)
+
+
+class Embedding:
+    """Result of a dimensionality reduction of a samples x features matrix"""
+
+    def __init__(
+        self,
+        transformed_df: pd.DataFrame,
+        explained_variances: Optional[List[float]],
+    ):
+        self.transformed_df = transformed_df
+        self.explained_variances = explained_variances
+
+
+def get_embedding(
+    expression_df: pd.DataFrame,
+    cohort_index: Union[int, str, None],
+    cohort_name: Optional[str],
+    key: Hashable,
+    compute_func: Callable[[], Embedding],
+    logger: CohortLogger,
+    cache_dir: Union[str, os.PathLike] = settings.PORTAL_CACHE_DIR,
+) -> Embedding:
+    """
+    Returns the embedding of expression_df from the memory or disk cache, or computes it.
+
+    The cache key combines `key` (layer, method and parameters) with the samples and
+    features of expression_df, which reflect the patient subset, selected genes, reference
+    and replicate channels and the occurrence filter.
+    """
+    embedding_key = _get_embedding_key(expression_df, key)
+    if cohort_index is None:
+        return compute_func()
+
+    def load_or_compute() -> Embedding:
+        data_fingerprint = result_cache.get_data_fingerprint(cohort_index)
+        if not data_fingerprint or cohort_name is None:
+            return compute_func()
+
+        embedding_file = result_cache.get_persisted_file(
+            cache_dir, cohort_name, EMBEDDING_DIR, f"{data_fingerprint}_{embedding_key}"
+        )
+        embedding = result_cache.load_persisted_result(embedding_file, logger)
+        if embedding is not None:
+            return embedding
+
+        embedding = compute_func()
+        result_cache.persist_result(
+            embedding,
+            embedding_file,
+            logger,
+            data_fingerprint=data_fingerprint,
+            max_files=settings.EMBEDDING_CACHE_MAX_FILES,
+        )
+        return embedding
+
+    return embeddings_cache.get_or_compute(cohort_index, embedding_key, load_or_compute)
+
+
+def _get_embedding_key(expression_df: pd.DataFrame, key: Hashable) -> str:
+    embedding_key = hashlib.sha1(repr(key).encode("utf-8"))
+    embedding_key.update(imputation.index_fingerprint(expression_df.index).encode("utf-8"))
+    embedding_key.update(imputation.index_fingerprint(expression_df.columns).encode("utf-8"))
+    return embedding_key.hexdigest()[:16]
+
@@ -1,21 +1,85 @@
 from pathlib import Path
 import pandas as pd
 
+from logger import CohortLogger
 import topas_portal.utils as utils
 
+GENOMICS_GENE_COLUMN = "gene"
+GENOMICS_ANNOTATION_COLUMN = "genomics_annotations"
+GENOMICS_SPLIT_COLUMNS = ["cnv", "snv", "fusion"]
+GENOMICS_MISSING = "missing"
+
 
 @utils.check_path_exist
-def load_genomics_table(genomics_path: str) -> pd.DataFrame:
-    # TODO: convert this to long data format to save memory(?)
+def load_genomics_table(genomics_path: str, logger: CohortLogger) -> pd.DataFrame:
+    """
+    Loads the wide genomics table (samples x genes) into a long table indexed by gene,
+    with the raw annotation and its cnv/snv/fusion parts. Missing entries are not stored,
+    the full list of samples is kept as the categories of the 'Sample name' column.
+    Only the first row of a sample is kept, the other rows are logged.
+    """
     genomics_df = pd.read_csv(Path(genomics_path), dtype=pd.StringDtype())
     genomics_df = genomics_df.loc[:, ~genomics_df.columns.str.contains("^Unnamed")]
-    genomics_df = genomics_df.fillna("missing")
-    return genomics_df
+    is_duplicate = genomics_df["Sample name"].duplicated(keep="first")
+    if is_duplicate.any():
+        duplicate_samples = genomics_df.loc[is_duplicate, "Sample name"].unique().tolist()
+        logger.log_message(
+            f"Genomics: dropped {is_duplicate.sum()} duplicate rows of samples "
+            f"{duplicate_samples}, only their first row is used"
+        )
+        genomics_df = genomics_df[~is_duplicate]
+    samples = genomics_df["Sample name"].astype(str).tolist()
 
+    genomics_df = genomics_df.melt(
+        id_vars="Sample name",
+        var_name=GENOMICS_GENE_COLUMN,
+        value_name=GENOMICS_ANNOTATION_COLUMN,
+    ).dropna(subset=[GENOMICS_ANNOTATION_COLUMN])
+    genomics_df = genomics_df[genomics_df[GENOMICS_ANNOTATION_COLUMN] != GENOMICS_MISSING]
+    genomics_df[GENOMICS_ANNOTATION_COLUMN] = genomics_df[GENOMICS_ANNOTATION_COLUMN].astype(object)
+    genomics_df["Sample name"] = pd.Categorical(genomics_df["Sample name"].astype(str), categories=samples)
 
+    genomics_df = pd.concat(
+        [genomics_df, split_genomics_annotations(genomics_df[GENOMICS_ANNOTATION_COLUMN])], axis=1
+    )
+    return genomics_df.set_index(GENOMICS_GENE_COLUMN).sort_index(kind="stable")
+
+
+def split_genomics_annotations(annotations: pd.Series) -> pd.DataFrame:
+    """
+    Splits annotations like cnv:AMP_snv:C_T_exonic_20_P266S_fusion:n.d into their cnv, snv and
+    fusion parts. Unparsable annotations are 'missing' in all three parts.
+    """
+    annotations = annotations.astype(str)
+    after_snv = annotations.str.split("snv").str[1]
+    parsable = after_snv.notna() & after_snv.fillna("").str.contains("fusion:", regex=False)
+    snv_and_fusion = after_snv.fillna("").astype(str).str.split("fusion:")
+    split_df = pd.DataFrame(
+        {
+            "cnv": annotations.str.split("snv:", n=1).str[0],
+            "snv": snv_and_fusion.str[0],
+            "fusion": snv_and_fusion.str[1].fillna(""),
+        },
+        index=annotations.index,
+    )
+    for column in GENOMICS_SPLIT_COLUMNS:
+        split_df[column] = (
+            split_df[column]
+            .str.replace("cnv", "", regex=False)
+            .str.replace(":", "", regex=False)
+            .str.replace("_", "", regex=False)
+        )
+    split_df.loc[~parsable | (annotations == GENOMICS_MISSING), GENOMICS_SPLIT_COLUMNS] = GENOMICS_MISSING
+    return split_df
 
-@utils.check_path_exist
-def load_onkoKB_dictionary(onkoKB_path: str) -> dict:
-    df = pd.read_csv(onkoKB_path)
-    return df[['gene_pair','annotation']].set_index('gene_pair').to_dict()['annotation']
 
+def get_genomics_samples(genomics_df: pd.DataFrame) -> pd.Index:
+    return genomics_df["Sample name"].cat.categories
+
+
+@utils.check_path_exist
+def load_onkoKB_dictionary(onkoKB_path: str) -> pd.Series:
+    """oncoKB annotations keyed by gene_pair (e.g. EGFR_AMPLIFICATION), supports dict-like .get"""
+    df = pd.read_csv(onkoKB_path, usecols=['gene_pair', 'annotation'])
+    df = df.drop_duplicates(subset='gene_pair', keep='last')
+    return df.set_index('gene_pair')['annotation']
@@ -0,0 +1,114 @@
+"""
+PhosphoSitePlus annotation of the p-peptides of a cohort. The annotation only depends
+on the peptide sequence and proteins, so it is computed once per cohort at load time
+and persisted to the cache folder instead of being redone for every patient report.
+"""
+
+import hashlib
+import os
+from typing import Dict, Union
+
+import pandas as pd
+import psite_annotation as pa
+
+from logger import CohortLogger
+from topas_portal import settings
+from topas_portal import result_cache
+
+PSP_FILE_KEYS = ["pspFastaFile", "pspAnnotationFile", "pspRegulatoryFile"]
+PSP_INDEX_DIR = "psp_annotation_index"
+
+# increase when the annotation steps change, such that persisted indices are rebuilt
+PSP_INDEX_VERSION = 1
+
+
+def annotate_psites(
+    df: pd.DataFrame,
+    pspFastaFile: str,
+    pspAnnotationFile: str,
+    pspRegulatoryFile: str,
+) -> pd.DataFrame:
+    """
+    Adds peptide and p-site positions, PhosphoSitePlus and regulatory annotations.
+
+    :param df: dataframe indexed by "Modified sequence" with a "Proteins" column
+    :return: annotated dataframe with "Modified sequence" as a column
+    """
+    df = df.reset_index(level="Modified sequence")
+    # replaced by the PSP site positions below, dropping it avoids a duplicated column
+    df = df.drop(columns="Site positions identified (MQ)", errors="ignore")
+    df = pa.addPeptideAndPsitePositions(
+        df, pspFastaFile, pspInput=True, returnAllPotentialSites=False
+    )
+    df = pa.addPSPAnnotations(df, pspAnnotationFile)
+    df = pa.addPSPRegulatoryAnnotations(df, pspRegulatoryFile)
+
+    df["PSP_LT_LIT"] = df["PSP_LT_LIT"].apply(lambda x: max(x.split(";")))
+    df["PSP_MS_LIT"] = df["PSP_MS_LIT"].apply(lambda x: max(x.split(";")))
+    df["PSP_MS_CST"] = df["PSP_MS_CST"].apply(lambda x: max(x.split(";")))
+    df.rename(
+        columns={"Site positions": "Site positions identified (MQ)"}, inplace=True
+    )
+    df = pa.addPeptideAndPsitePositions(
+        df, pspFastaFile, pspInput=True, returnAllPotentialSites=True
+    )
+    return df
+
+
+def load_psp_annotation_index(
+    pp_df: pd.DataFrame,
+    config: Dict,
+    cohort_name: str,
+    logger: CohortLogger,
+    cache_dir: Union[str, os.PathLike] = settings.PORTAL_CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    Returns the PSP annotations of all p-peptides of a cohort indexed by "Modified sequence".
+
+    The index is read from the cache folder if it was built for the same peptides and PSP
+    files before, otherwise it is built and written to
+    <cache_dir>/<cohort_name>/psp_annotation_index.
+    """
+    peptides_df = pp_df[
+        [c for c in settings.PP_EXTRA_COLUMNS if c in pp_df.columns]
+    ]
+    peptides_df = peptides_df[~peptides_df.index.duplicated(keep="first")]
+    psp_files = [config[key] for key in PSP_FILE_KEYS]
+
+    fingerprint = _get_fingerprint(peptides_df, psp_files)
+    index_file = result_cache.get_persisted_file(
+        cache_dir, cohort_name, PSP_INDEX_DIR, fingerprint
+    )
+    annotation_df = result_cache.load_persisted_result(index_file, logger)
+    if annotation_df is not None:
+        return annotation_df
+
+    annotation_df = annotate_psites(peptides_df, *psp_files)
+    annotation_df = annotation_df.set_index(settings.PP_KEY)
+    result_cache.persist_result(
+        annotation_df, index_file, logger, data_fingerprint=fingerprint
+    )
+    return annotation_df
+
+
+def get_patient_psp_annotations(
+    patient_df: pd.DataFrame, patient_column: str, annotation_df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Joins the z-scores of a patient with the PSP annotation index, gives the same
+    table as annotating the p-peptides of the patient with `annotate_psites`.
+    """
+    final_df = annotation_df.reindex(patient_df.index)
+    final_df.insert(0, patient_column, patient_df[patient_column].to_numpy())
+    return final_df.reset_index()
+
+
+def _get_fingerprint(peptides_df: pd.DataFrame, psp_files: list) -> str:
+    hashes = pd.util.hash_pandas_object(peptides_df.fillna(""), index=True)
+    fingerprint = hashlib.sha1(hashes.to_numpy().tobytes())
+    fingerprint.update(str(PSP_INDEX_VERSION).encode("utf-8"))
+    for psp_file in psp_files:
+        stat = os.stat(psp_file)
+        fingerprint.update(f"{psp_file}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8"))
+    return fingerprint.hexdigest()[:16]
+
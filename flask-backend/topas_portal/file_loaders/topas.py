@@ -1,9 +1,13 @@
 # needed to prevent circular import of db.CohortDataAPI
 from __future__ import annotations
 
-import pandas as pd
+import glob
 import os
+import threading
+
+import pandas as pd
 
+from logger import CohortLogger
 from topas_portal import settings
 from topas_portal import utils
 import topas_portal.topas_scores_meta as topas
@@ -47,45 +51,107 @@ def load_topas_scores_df(topas_scores_path: str):
 def load_topas_subscore_table(
     report_dir: str, main_topas: str, return_wide=False
 ) -> pd.DataFrame:
-    for key in topas.TOPAS_RENAMING.keys():
-        if main_topas == key:
-            main_topas = topas.TOPAS_RENAMING[key]
-    file_name = f"{report_dir}/{settings.TOPAS_SUBSCORE_FILES_PREFIX}{main_topas}.tsv"
+    file_name = get_topas_subscore_file(report_dir, main_topas)
     topas_subscores_long = pd.DataFrame()
     if os.path.exists(file_name):
-        topas_subscores = pd.read_csv(os.path.join(report_dir, file_name), sep="\t")
-
-        # TODO: check if mean and stdev columns are still in here
-        topas_subscores = topas_subscores[
-            ~topas_subscores["Sample name"].str.contains("targets_")
-        ]
-        topas_subscores["Sample name"] = topas_subscores["index"]
-        list_del = topas_subscores.filter(regex=r"topas_name").columns.to_list()
-        list_del = [*list_del, *["index", "Sarcoma Subtype", "Histologic subtype"]]
-        columns_to_del = [s for s in list_del if s in topas_subscores.columns]
-        topas_subscores = topas_subscores.drop(columns_to_del, axis=1)
-        topas_subscores = topas_subscores.drop(
-            topas_subscores.filter(regex="total_topas_score").columns, axis=1
-        )
-        topas_subscores = utils.remove_patient_prefix(topas_subscores, from_col=False)
+        topas_subscores = _read_topas_subscore_file(file_name)
         if return_wide:
-
             return topas_subscores
         else:
-            topas_names = topas_subscores.columns[
-                topas_subscores.columns != "Sample name"
-            ].values.tolist()
-            topas_subscores_long = pd.melt(
-                topas_subscores.reset_index(),
-                id_vars="Sample name",
-                value_vars=topas_names,
-                value_name="Z-score",
-            )
-            topas_subscores_long = topas_subscores_long.dropna()
-            topas_subscores_long.columns = ["sample", "topas", "score"]
-
-            topas_subscores_long["color"] = "grey"
-            topas_subscores_long["sizeR"] = 0.5
-            topas_subscores = utils.remove_patient_prefix(topas_subscores, from_col=False)
-
-            return topas_subscores_long
+            return _get_topas_subscores_long_format(topas_subscores)
+    return topas_subscores_long
+
+
+def get_topas_subscore_file(report_dir: str, main_topas: str) -> str:
+    for key in topas.TOPAS_RENAMING.keys():
+        if main_topas == key:
+            main_topas = topas.TOPAS_RENAMING[key]
+    return f"{report_dir}/{settings.TOPAS_SUBSCORE_FILES_PREFIX}{main_topas}.tsv"
+
+
+def _read_topas_subscore_file(file_name: str) -> pd.DataFrame:
+    topas_subscores = pd.read_csv(file_name, sep="\t")
+
+    # TODO: check if mean and stdev columns are still in here
+    topas_subscores = topas_subscores[
+        ~topas_subscores["Sample name"].str.contains("targets_")
+    ]
+    topas_subscores["Sample name"] = topas_subscores["index"]
+    list_del = topas_subscores.filter(regex=r"topas_name").columns.to_list()
+    list_del = [*list_del, *["index", "Sarcoma Subtype", "Histologic subtype"]]
+    columns_to_del = [s for s in list_del if s in topas_subscores.columns]
+    topas_subscores = topas_subscores.drop(columns_to_del, axis=1)
+    topas_subscores = topas_subscores.drop(
+        topas_subscores.filter(regex="total_topas_score").columns, axis=1
+    )
+    return utils.remove_patient_prefix(topas_subscores, from_col=False)
+
+
+def _get_topas_subscores_long_format(topas_subscores: pd.DataFrame) -> pd.DataFrame:
+    topas_names = topas_subscores.columns[
+        topas_subscores.columns != "Sample name"
+    ].values.tolist()
+    topas_subscores_long = pd.melt(
+        topas_subscores.reset_index(),
+        id_vars="Sample name",
+        value_vars=topas_names,
+        value_name="Z-score",
+    )
+    topas_subscores_long = topas_subscores_long.dropna()
+    topas_subscores_long.columns = ["sample", "topas", "score"]
+
+    topas_subscores_long["color"] = "grey"
+    topas_subscores_long["sizeR"] = 0.5
+    return topas_subscores_long
+
+
+class TopasSubscoreTables:
+    """
+    Subscore tables of all topas of the loaded cohorts in wide and long format. The tables
+    are read when a cohort is loaded, files that did not change since the last load
+    (same modification time) are not parsed again.
+    """
+
+    def __init__(self):
+        # file name -> (modification time, wide table, long table)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def load_report_dir(self, report_dir: str, logger: CohortLogger):
+        """Reads new or changed subscore files, files that fail to parse are logged and skipped"""
+        subscore_files = glob.glob(
+            os.path.join(report_dir, f"{settings.TOPAS_SUBSCORE_FILES_PREFIX}*.tsv")
+        )
+        for file_path in subscore_files:
+            file_name = f"{report_dir}/{os.path.basename(file_path)}"
+            mtime = os.path.getmtime(file_path)
+            with self._lock:
+                if file_name in self._tables and self._tables[file_name][0] == mtime:
+                    continue
+            try:
+                topas_subscores = _read_topas_subscore_file(file_path)
+                topas_subscores_long = _get_topas_subscores_long_format(topas_subscores)
+            except Exception as err:
+                logger.log_message(f"Could not load the topas subscores {file_path}: {err}")
+                continue
+            with self._lock:
+                self._tables[file_name] = (mtime, topas_subscores, topas_subscores_long)
+
+        with self._lock:
+            loaded_files = {f"{report_dir}/{os.path.basename(f)}" for f in subscore_files}
+            for file_name in list(self._tables.keys()):
+                if file_name.startswith(f"{report_dir}/") and file_name not in loaded_files:
+                    del self._tables[file_name]
+
+    def get_table(
+        self, report_dir: str, main_topas: str, return_wide=False
+    ) -> pd.DataFrame:
+        """
+        Same tables as `load_topas_subscore_table` without reading the file, empty if the
+        topas has no subscores. The returned tables are shared and must not be modified.
+        """
+        with self._lock:
+            tables = self._tables.get(get_topas_subscore_file(report_dir, main_topas))
+        if tables is None:
+            return pd.DataFrame()
+        return tables[1] if return_wide else tables[2]
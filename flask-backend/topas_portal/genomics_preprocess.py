@@ -1,10 +1,12 @@
 # needed to prevent circular import of db.CohortDataAPI
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import List, TYPE_CHECKING
 import pandas as pd
 import re
 import topas_portal.utils as utils
+import topas_portal.file_loaders.genomics as genomics_loader
+from topas_portal.result_cache import CohortResultCache
 
 # for type hints only
 if TYPE_CHECKING:
@@ -76,69 +78,97 @@ def get_all_snv_per_NGS(X,protein_name,snv_dic,pattern_alteration = r'p.[A-Z][0-
 
 
     
-def add_onkokb_annotation(df,genomics_df,gene_name, onkokb_dic,column_name='fusion_onkoKB'):
-    try:
-        
-        sub_df = genomics_df[['Sample name',gene_name]]
-        
-        if column_name == 'fusion_onkoKB':
-            sub_df[column_name] = sub_df[gene_name].apply(lambda x:get_all_fusions_per_NGS(x,onkokb_dic))
-            
-        if column_name == 'cnv_onkoKB':
-            sub_df[column_name] = sub_df[gene_name].apply(lambda x:get_all_cnvs_per_NGS(x,gene_name,onkokb_dic))
-            
-            
-        if column_name == 'snv_onkoKB':
-            sub_df[column_name] = sub_df[gene_name].apply(lambda x:get_all_snv_per_NGS(x,gene_name,onkokb_dic))
-            
-        return df.merge(sub_df[['Sample name',column_name]],on='Sample name',how='left')
-    except:
-        return df
-
+ONKOKB_COLUMNS = ['fusion_onkoKB', 'cnv_onkoKB', 'snv_onkoKB']
+ONKOKB_CNV_DEFINITIONS = {'AMP':'AMPLIFICATION','DEL':'DELETION'}
+FUSION_PATTERN = r'[A-Z1-9]+\|[A-Z1-9,]+'
+CNV_PATTERN = r'AMP|DEL|GAIN|LOSS'
+SNV_PATTERN = r'p.[A-Z][0-9]+[A-Z]'
 
+# genomics and oncoKB tables are global, the annotations only depend on the identifier
+onkokb_annotations_cache = CohortResultCache("onkokb_annotations", max_entries=512)
 
 
 
-def _merge_onkokb_annotation(
+def get_onkokb_annotations_per_identifier(
     cohorts_db: data_api.CohortDataAPI,
-    abundance_df:pd.dataFrame, 
     identifier: str
 ):
-        df = abundance_df.copy()
-        genomics_df = cohorts_db.get_genomics()
-        onkokb_dic = cohorts_db.get_oncoKB_annotations()
-        try:
-            df = add_onkokb_annotation(df, genomics_df, identifier, onkokb_dic,column_name='fusion_onkoKB')
-        except:
-            pass
-        
-        try:
-            df = add_onkokb_annotation(df, genomics_df, identifier, onkokb_dic,column_name='cnv_onkoKB')
-        except:
-            pass
+    """
+    oncoKB annotations of the fusions, cnvs and snvs of all samples in the genomics data for a gene
+    :returns dataFrame indexed by Sample name with the ONKOKB_COLUMNS, None if the gene has no genomics data
+    """
+    genomics_df = cohorts_db.get_genomics()
+    if identifier not in genomics_df.index:
+        return None
+    return onkokb_annotations_cache.get_or_compute(
+        None,
+        identifier,
+        lambda: annotate_alterations_with_onkokb(genomics_df, identifier, cohorts_db.get_oncoKB_annotations()),
+    )
+
+
+
+def annotate_alterations_with_onkokb(genomics_df:pd.DataFrame, gene_name:str, onkokb_table:pd.Series) -> pd.DataFrame:
+    """
+    Vectorised version of get_all_fusions_per_NGS, get_all_cnvs_per_NGS and get_all_snv_per_NGS for all samples:
+    the alterations of the gene are extracted for all samples at once and joined with the oncoKB table,
+    alterations without oncoKB annotation are reported as is
+    """
+    samples = genomics_loader.get_genomics_samples(genomics_df)
+    gene_df = genomics_df.loc[gene_name:gene_name]
+    alterations = pd.Series(
+        gene_df[genomics_loader.GENOMICS_ANNOTATION_COLUMN].to_numpy(dtype=str),
+        index=pd.Index(gene_df['Sample name'].astype(str), name='Sample name'),
+    )
 
-        try:
-            df = add_onkokb_annotation(df, genomics_df, identifier, onkokb_dic,column_name='snv_onkoKB')
-        except:
-            pass
+    fusions = alterations.str.split('_fusion:').str[-1].str.findall(FUSION_PATTERN).explode().dropna()
+    fusions = fusions.map(split_fusion).explode()
 
+    cnvs = alterations.str.split('_snv:').str[0].str.findall(CNV_PATTERN).explode().dropna()
+    cnvs = f'{gene_name}_' + cnvs.replace(ONKOKB_CNV_DEFINITIONS).astype(str)
 
-        try:
-            df['fusion_onkoKB'] = df['fusion_onkoKB'].fillna('n.d.')
-        except:
-            pass
+    snvs = alterations.str.split('snv:').str[-1].str.split('fusion:').str[0].str.findall(SNV_PATTERN).explode().dropna()
+    snvs = f'{gene_name}_' + snvs.astype(str)
 
-        try:    
-            df['cnv_onkoKB'] = df['cnv_onkoKB'].fillna('n.d.')
-        except:
-            pass
+    return pd.DataFrame(
+        {
+            column_name: _join_onkokb_annotations(alteration_keys, onkokb_table, samples)
+            for column_name, alteration_keys in zip(ONKOKB_COLUMNS, [fusions, cnvs, snvs])
+        },
+        index=samples,
+    )
+
+
+
+def _join_onkokb_annotations(alteration_keys:pd.Series, onkokb_table:pd.Series, samples:pd.Index) -> pd.Series:
+    keys_df = pd.DataFrame({'Sample name': alteration_keys.index, 'key': alteration_keys.to_numpy()}).dropna()
+    keys_df = keys_df.drop_duplicates().sort_values(['Sample name', 'key'])
+    keys_df['annotation'] = keys_df['key'].map(onkokb_table).fillna(keys_df['key'])
+    joined = keys_df.groupby('Sample name', sort=False)['annotation'].agg(';'.join)
+    return joined.reindex(samples, fill_value='')
+
+
+
+
+
+def _merge_onkokb_annotation(
+    cohorts_db: data_api.CohortDataAPI,
+    abundance_df:pd.dataFrame, 
+    identifier: str
+):
+    """Adds the ONKOKB_COLUMNS to a dataFrame with a Sample name column, n.d. for samples without genomics data"""
+    try:
+        onkokb_df = get_onkokb_annotations_per_identifier(cohorts_db, identifier)
+    except Exception as err:
+        print(f"{type(err).__name__}: {err} in annotating with oncoKB")
+        return abundance_df
 
-        try:
-            df['snv_onkoKB'] = df['snv_onkoKB'].fillna('n.d.')
-        except:
-            pass
+    if onkokb_df is None:
+        return abundance_df
 
-        return df
+    df = abundance_df.merge(onkokb_df, right_index=True, left_on='Sample name', how='left')
+    df[ONKOKB_COLUMNS] = df[ONKOKB_COLUMNS].fillna('n.d.')
+    return df
 
 
 
@@ -184,59 +214,78 @@ def get_genomics_alterations_per_identifier(
     cohorts_db: data_api.CohortDataAPI,
     identifier: str,
     annotation_type="genomics_annotations",
+    include_split_annotations: bool = False,
 ):
-    if annotation_type == "genomics_annotations":
-        genomics_df = cohorts_db.get_genomics()
-    else:
-        genomics_df = cohorts_db.get_oncoKB_annotations()
+    """
+    Genomic alterations of all samples for an identifier; for protein groups (separated by ;)
+    the alterations of the genes in the genomics data are joined by ;
+    :include_split_annotations: also return the cnv, snv and fusion columns
+    :returns dataFrame indexed by Sample name, samples without alterations are 'missing'
+    """
+    genomics_df = cohorts_db.get_genomics()
 
-    identifiers_list = identifier.split(";")
     # this is to cover if only one protein of a protein group matches to the genomics data
-    identifiers_list = utils.intersection(identifiers_list, genomics_df.columns)
+    identifiers_list = [x for x in identifier.split(";") if x in genomics_df.index]
     try:
-        sub_df = genomics_df[[*["Sample name"], *identifiers_list]].set_index(
-            "Sample name"
-        )
-        sub_df = sub_df.dropna()
-        genomics_annotation_list = []
+        samples = genomics_loader.get_genomics_samples(genomics_df)
+        columns = [genomics_loader.GENOMICS_ANNOTATION_COLUMN, *genomics_loader.GENOMICS_SPLIT_COLUMNS]
+        if len(identifiers_list) == 0:
+            return pd.DataFrame("", index=samples, columns=[annotation_type])
 
-        for i in range(len(sub_df)):
-            temp = sub_df.iloc[i, :].tolist()
-            temp = (";").join(temp)
-            genomics_annotation_list.append(temp)
-
-        sub_df[annotation_type] = genomics_annotation_list
+        if annotation_type == "genomics_annotations":
+            per_gene_dfs = [
+                _get_genomics_alterations_per_gene(genomics_df, gene, samples, columns)
+                for gene in identifiers_list
+            ]
+        else:
+            per_gene_dfs = [
+                _get_onkokb_annotations_per_gene(cohorts_db, gene)
+                for gene in identifiers_list
+            ]
+        sub_df = per_gene_dfs[0]
+        for gene_df in per_gene_dfs[1:]:
+            sub_df = sub_df + ";" + gene_df
+
+        sub_df = sub_df.rename(columns={genomics_loader.GENOMICS_ANNOTATION_COLUMN: annotation_type})
+        if include_split_annotations:
+            return sub_df
         return sub_df[[annotation_type]]
     except Exception as err:
         print(f"{type(err).__name__}: {err} in getting Genomics data")
-        return f"Unexpected {err=}, {type(err)=}"
-
-
-def _clean_annotation(x):
-    return str(x).replace('cnv','').replace(':','').replace('_','')
-
-
-
-
-def _split_genomics_annotation(x:str):
-    try:
-        if x == 'missing':
-            return {'cnv':'missing','snv':'missing','fusion':'missing'}
-        else:
-            cnv = x.split('snv:')[0]
-            snv = x.split('snv')[1].split('fusion:')[0]
-            fusion = x.split('snv')[1].split('fusion:')[1]
-            return {'cnv':_clean_annotation(cnv),'snv':_clean_annotation(snv),'fusion':_clean_annotation(fusion)}
-    except:
-        return {'cnv':'missing','snv':'missing','fusion':'missing'}
-
+        raise
+
+
+def _get_genomics_alterations_per_gene(
+    genomics_df: pd.DataFrame, gene: str, samples: pd.Index, columns: List[str]
+) -> pd.DataFrame:
+    # the long genomics table is sorted by gene, the slice is a binary search
+    gene_df = genomics_df.loc[gene:gene]
+    gene_df = gene_df.set_index(gene_df["Sample name"].astype(str))[columns]
+    gene_df = gene_df.reindex(samples, fill_value=genomics_loader.GENOMICS_MISSING)
+    gene_df.index.name = "Sample name"
+    return gene_df
+
+
+def _get_onkokb_annotations_per_gene(
+    cohorts_db: data_api.CohortDataAPI, gene: str
+) -> pd.DataFrame:
+    onkokb_df = get_onkokb_annotations_per_identifier(cohorts_db, gene)
+    annotations = (
+        onkokb_df[ONKOKB_COLUMNS].agg(';'.join, axis=1)
+        .str.replace(';+', ';', regex=True)
+        .str.strip(';')
+    )
+    return pd.DataFrame(
+        {genomics_loader.GENOMICS_ANNOTATION_COLUMN: annotations.replace('', genomics_loader.GENOMICS_MISSING)},
+        index=onkokb_df.index,
+    )
 
 
 def make_final_genomics_annotation(df):
     try:
-        df['snv'] = df.genomics_annotations.apply(lambda x:_split_genomics_annotation(x)['snv'])
-        df['cnv'] = df.genomics_annotations.apply(lambda x:_split_genomics_annotation(x)['cnv'])
-        df['fusion'] = df.genomics_annotations.apply(lambda x:_split_genomics_annotation(x)['fusion'])
+        split_df = genomics_loader.split_genomics_annotations(df.genomics_annotations)
+        for column in ['snv', 'cnv', 'fusion']:
+            df[column] = split_df[column]
     except:
         pass
     return df
@@ -257,22 +306,27 @@ def _merge_data_with_genomics_alterations(
     :returns dataFrame with extra column with the name of annotation_type
     """
     try:
+        include_split_annotations = annotation_type == "genomics_annotations"
         genomics_alterations_df = get_genomics_alterations_per_identifier(
-            cohorts_db, identifier, annotation_type=annotation_type
+            cohorts_db,
+            identifier,
+            annotation_type=annotation_type,
+            include_split_annotations=include_split_annotations,
         )
 
         annotated_abundance_df = abundances_df.merge(
             genomics_alterations_df, right_index=True, left_on="Sample name", how="left"
         )
-        annotated_abundance_df[annotation_type] = annotated_abundance_df[
-            annotation_type
+        added_columns = genomics_alterations_df.columns.tolist()
+        annotated_abundance_df[added_columns] = annotated_abundance_df[
+            added_columns
         ].fillna("missing")
 
-        if annotation_type == "genomics_annotations":
+        if include_split_annotations and "snv" not in added_columns:
             annotated_abundance_df = make_final_genomics_annotation(annotated_abundance_df)
 
 
         return annotated_abundance_df
     except Exception as err:
         print(f"{type(err).__name__}: {err} in merging with Genomics data")
-        return abundances_df
\ No newline at end of file
+        return abundances_df
@@ -0,0 +1,161 @@
+"""
+Imputation of missing values in expression matrices, shared by the entity
+classifiers and the dimensionality reduction methods. Imputed matrices are
+cached per cohort such that the different views do not re-impute the same data,
+up to IMPUTED_MATRICES_CACHE_MAX_GB in total.
+"""
+
+import hashlib
+import warnings
+from enum import Enum
+from typing import Callable, Hashable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from topas_portal import settings
+from topas_portal.result_cache import CohortResultCache
+
+
+class ImputationMethod(str, Enum):
+    NORMAL_DOWN_SHIFT = "normal_down_shift"  # column-wise down-shifted normal distribution
+    NORMAL_DOWN_SHIFT_GLOBAL = "normal_down_shift_global"  # same, with mean and std of the whole matrix
+    MIN = "min"  # minimum of the whole matrix
+
+
+def get_memory_usage(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True).sum())
+
+
+imputed_matrices_cache = CohortResultCache(
+    "imputed_matrices",
+    max_entries=32,
+    max_bytes=int(settings.IMPUTED_MATRICES_CACHE_MAX_GB * 1024**3),
+    size_func=get_memory_usage,
+)
+
+
+def impute_normal_down_shift(
+    df: pd.DataFrame,
+    column_wise: bool = True,
+    width: float = 0.3,
+    downshift: float = 1.8,
+    seed: int = 2,
+) -> pd.DataFrame:
+    """
+    Replaces missing values by draws from a down-shifted and shrunken normal distribution
+    https://rdrr.io/github/jdreyf/jdcbioinfo/man/impute_normal.html
+
+    Args:
+        df (pd.DataFrame): matrix with missing (or non-finite) values.
+        column_wise (bool): use mean and standard deviation per column instead of the whole matrix.
+        width (float): scale factor for the standard deviation of the imputed distribution.
+        downshift (float): shift of the imputed mean from the observed mean, in standard deviations.
+        seed (int): seed of the random generator, results are reproducible for the same matrix.
+
+    Returns:
+        pd.DataFrame: imputed copy of df, columns without any observed value stay NaN.
+    """
+    matrix = df.to_numpy(dtype=float, copy=True)
+    missing = ~np.isfinite(matrix)
+    matrix[missing] = np.nan
+    if not missing.any():
+        return pd.DataFrame(matrix, index=df.index, columns=df.columns)
+
+    with warnings.catch_warnings():
+        # all-NaN columns stay NaN on purpose
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if column_wise:
+            means = np.nanmean(matrix, axis=0)
+            stds = np.nanstd(matrix, axis=0)
+        else:
+            means = np.full(matrix.shape[1], np.nanmean(matrix))
+            stds = np.full(matrix.shape[1], np.nanstd(matrix))
+
+    missing_columns = np.nonzero(missing)[1]
+    draws = np.random.default_rng(seed).standard_normal(len(missing_columns))
+    matrix[missing] = (
+        means[missing_columns]
+        - downshift * stds[missing_columns]
+        + width * stds[missing_columns] * draws
+    )
+    return pd.DataFrame(matrix, index=df.index, columns=df.columns)
+
+
+def impute_min(df: pd.DataFrame) -> pd.DataFrame:
+    """Replaces missing values by the minimum of the whole matrix."""
+    matrix = df.to_numpy(dtype=float, copy=True)
+    missing = np.isnan(matrix)
+    if missing.any() and not missing.all():
+        matrix[missing] = np.nanmin(matrix)
+    return pd.DataFrame(matrix, index=df.index, columns=df.columns)
+
+
+def impute(df: pd.DataFrame, method: ImputationMethod, seed: int = 2) -> pd.DataFrame:
+    method = ImputationMethod(method)
+    if method == ImputationMethod.MIN:
+        return impute_min(df)
+    return impute_normal_down_shift(
+        df, column_wise=method == ImputationMethod.NORMAL_DOWN_SHIFT, seed=seed
+    )
+
+
+def get_imputed_df(
+    df: pd.DataFrame,
+    cohort_index: Union[int, str, None],
+    layer: Hashable,
+    method: ImputationMethod,
+    seed: int = 2,
+) -> pd.DataFrame:
+    """
+    Cached version of `impute`. Entries are kept per (cohort, layer, method, seed) and the
+    rows/columns of the matrix, since views impute different subsets of the same layer.
+    The cache is invalidated when the cohort is reloaded.
+    """
+    method = ImputationMethod(method)
+    return imputed_matrices_cache.get_or_compute(
+        cohort_index,
+        _get_cache_key(df, layer, method.value, seed),
+        lambda: impute(df, method, seed=seed),
+    )
+
+
+def get_model_imputed_df(
+    df: pd.DataFrame,
+    cohort_index: Union[int, str, None],
+    layer: Hashable,
+    model_name: str,
+    compute_func: Callable[[], pd.DataFrame],
+) -> pd.DataFrame:
+    """
+    Cached imputation of df by a model, e.g. the low-rank fit of a dimensionality reduction,
+    computed by compute_func if the matrix was not stored with `put_model_imputed_df`.
+    """
+    return imputed_matrices_cache.get_or_compute(
+        cohort_index, _get_cache_key(df, layer, model_name), compute_func
+    )
+
+
+def put_model_imputed_df(
+    df: pd.DataFrame,
+    cohort_index: Union[int, str, None],
+    layer: Hashable,
+    model_name: str,
+    imputed_df: pd.DataFrame,
+    data_version: Optional[int] = None,
+):
+    """Stores the imputation of df by a model that was fitted anyway, see `get_model_imputed_df`"""
+    imputed_matrices_cache.put(
+        cohort_index, _get_cache_key(df, layer, model_name), imputed_df, data_version
+    )
+
+
+def _get_cache_key(df: pd.DataFrame, layer: Hashable, method: str, seed: Optional[int] = None):
+    return (repr(layer), method, seed, index_fingerprint(df.index), index_fingerprint(df.columns))
+
+
+def index_fingerprint(index: pd.Index) -> str:
+    """Hash of the labels of an index, identifies the rows or columns of a matrix"""
+    hashes = pd.util.hash_pandas_object(index.to_frame(index=False), index=False)
+    return hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+
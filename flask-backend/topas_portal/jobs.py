@@ -0,0 +1,399 @@
+"""
+Background jobs for long-running analyses (PCA/UMAP, silhouette scores, whole-layer
+correlations, differential tests, ...), such that they do not block a request.
+
+A job is submitted with its type and parameters and gets an id, its state can be polled
+and its result fetched once it is done. Each job runs in a forked process, which sees the
+cohort data loaded in the submitting worker, with a memory limit and a wall-clock timeout.
+The state and result of a job are stored in PORTAL_CACHE_DIR/jobs/<job id>, such that all
+gunicorn workers can poll, fetch and cancel it.
+
+The job id is a hash of the job type, its parameters and the fingerprint of the loaded
+data, so identical jobs are only run once and results of outdated data are never served.
+The state records the worker process that supervises a job and the job process, each with
+its start time, such that jobs of workers that stopped are marked as failed and can be
+submitted again, also if their pids were reused after a restart.
+
+The job process is forked from a thread of a (possibly multithreaded) worker, so it only
+inherits the thread that forked it. Locks held by other threads at that moment stay locked
+in the job process: the locks of the logging module and of the result caches are
+reinitialized after forking (see result_cache._reinit_locks_after_fork), jobs must not
+rely on other locks that request threads of the worker might hold.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import threading
+import time
+import traceback
+from enum import Enum
+from typing import Any, Callable, Dict, List, TYPE_CHECKING, Union
+
+from topas_portal import settings
+from topas_portal import result_cache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+JOBS_DIR = os.path.join(settings.PORTAL_CACHE_DIR, "jobs")
+STATE_FILE = "state.json"
+RESULT_FILE = "result.pkl"
+LOCK_FILE = "state.lock"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = [JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED]
+
+
+class JobType:
+    """
+    A kind of job. `run` is called as run(cohorts_db, report_progress, **params) in the job
+    process and returns a dataframe or a JSON serializable object, report_progress(fraction,
+    message) updates the progress shown when polling the job.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable,
+        result_columns: Dict[str, str] = None,
+    ):
+        self.name = name
+        self.run = run
+        # columns that the result table filters refer to, see result_tables.ResultTableQuery
+        self.result_columns = result_columns or {}
+
+
+_job_types: Dict[str, JobType] = {}
+
+# limits the number of jobs running at the same time per worker process
+_job_slots = threading.BoundedSemaphore(settings.JOB_MAX_CONCURRENT)
+_submit_lock = threading.Lock()
+
+
+def register_job_type(
+    name: str, run: Callable, result_columns: Dict[str, str] = None
+) -> JobType:
+    _job_types[name] = JobType(name, run, result_columns)
+    return _job_types[name]
+
+
+def get_job_type(name: str) -> JobType:
+    if name not in _job_types:
+        raise ValueError(
+            f"Unknown job type {name}, available job types: {', '.join(sorted(_job_types))}"
+        )
+    return _job_types[name]
+
+
+def get_job_id(job_type: str, params: Dict[str, str], data_fingerprint: str) -> str:
+    job_key = json.dumps([job_type, params, data_fingerprint], sort_keys=True)
+    return hashlib.sha1(job_key.encode("utf-8")).hexdigest()[:16]
+
+
+def submit_job(
+    cohorts_db: data_api.CohortDataAPI,
+    job_type: str,
+    params: Dict[str, str],
+    jobs_dir: str = JOBS_DIR,
+) -> Dict[str, Any]:
+    """
+    Starts a job in the background and returns its state. If the same job was submitted
+    before and did not fail or get cancelled, the state of the existing job is returned.
+    """
+    get_job_type(job_type)
+    data_fingerprint = result_cache.get_data_fingerprint(params.get("cohort_index"))
+    if not data_fingerprint:
+        from topas_portal.data_api.exceptions import CohortDataNotLoadedError
+
+        raise CohortDataNotLoadedError()
+
+    job_id = get_job_id(job_type, params, data_fingerprint)
+    with _submit_lock:
+        state = get_job_state(job_id, jobs_dir=jobs_dir)
+        if state is not None and state["status"] not in [
+            JobStatus.FAILED,
+            JobStatus.CANCELLED,
+        ]:
+            return state
+
+        _remove_old_jobs(jobs_dir)
+        job_dir = os.path.join(jobs_dir, job_id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        os.makedirs(job_dir)
+        state = {
+            "id": job_id,
+            "type": job_type,
+            "params": params,
+            "status": JobStatus.QUEUED,
+            "progress": 0.0,
+            "message": "",
+            "submitted": time.time(),
+            # the thread supervising the job dies with its worker process
+            "supervisor_pid": os.getpid(),
+            "supervisor_start_id": _get_process_start_id(os.getpid()),
+        }
+        _write_state(job_dir, state)
+
+    thread = threading.Thread(
+        target=_supervise_job, args=(cohorts_db, job_dir, job_type, params)
+    )
+    thread.daemon = True
+    thread.start()
+    return state
+
+
+def get_job_state(job_id: str, jobs_dir: str = JOBS_DIR) -> Union[Dict[str, Any], None]:
+    """
+    State of the job, None if it does not exist. Queued jobs whose supervising worker stopped
+    and running jobs whose process stopped are marked as failed.
+    """
+    job_dir = os.path.join(jobs_dir, os.path.basename(job_id))
+    state = _read_state(job_dir)
+    if state is None:
+        return None
+
+    if state["status"] == JobStatus.QUEUED and not _is_process_alive(
+        state.get("supervisor_pid"), state.get("supervisor_start_id")
+    ):
+        state = _update_state(
+            job_dir,
+            status=JobStatus.FAILED,
+            message="The worker process of the job stopped before the job started",
+            only_if_status=[JobStatus.QUEUED],
+        )
+    elif state["status"] == JobStatus.RUNNING and not _is_process_alive(
+        state.get("pid"), state.get("start_id")
+    ):
+        state = _update_state(
+            job_dir,
+            status=JobStatus.FAILED,
+            message="The job process stopped unexpectedly",
+            only_if_status=[JobStatus.RUNNING],
+        )
+    return state
+
+
+def list_jobs(jobs_dir: str = JOBS_DIR) -> List[Dict[str, Any]]:
+    if not os.path.isdir(jobs_dir):
+        return []
+    states = [get_job_state(job_id, jobs_dir=jobs_dir) for job_id in os.listdir(jobs_dir)]
+    states = [state for state in states if state is not None]
+    return sorted(states, key=lambda state: state["submitted"], reverse=True)
+
+
+def get_job_result(job_id: str, jobs_dir: str = JOBS_DIR) -> Any:
+    """Result of a finished job, raises ValueError if the job is not done."""
+    state = get_job_state(job_id, jobs_dir=jobs_dir)
+    if state is None or state["status"] != JobStatus.DONE:
+        status = "unknown" if state is None else state["status"]
+        raise ValueError(f"Job {job_id} has no result, its status is {status}")
+    with open(os.path.join(jobs_dir, state["id"], RESULT_FILE), "rb") as f:
+        return pickle.load(f)
+
+
+def cancel_job(job_id: str, jobs_dir: str = JOBS_DIR) -> Union[Dict[str, Any], None]:
+    """Cancels a queued or running job, also if it was submitted by another worker process."""
+    state = get_job_state(job_id, jobs_dir=jobs_dir)
+    if state is None or state["status"] in FINISHED_STATUSES:
+        return state
+
+    state = _update_state(
+        os.path.join(jobs_dir, state["id"]),
+        status=JobStatus.CANCELLED,
+        message="Cancelled",
+        only_if_status=[JobStatus.QUEUED, JobStatus.RUNNING],
+    )
+    if _is_process_alive(state.get("pid"), state.get("start_id")):
+        os.kill(state["pid"], signal.SIGTERM)
+    return state
+
+
+def _supervise_job(
+    cohorts_db: data_api.CohortDataAPI, job_dir: str, job_type: str, params: Dict
+):
+    with _job_slots:
+        if _read_state(job_dir)["status"] != JobStatus.QUEUED:
+            return  # cancelled while waiting for a free slot
+
+        # forked, such that the job process sees the loaded cohort data without copying it,
+        # see the module docstring for the locks of other threads
+        process = multiprocessing.get_context("fork").Process(
+            target=_run_job, args=(cohorts_db, job_dir, job_type, params)
+        )
+        process.start()
+        _update_state(
+            job_dir,
+            status=JobStatus.RUNNING,
+            pid=process.pid,
+            start_id=_get_process_start_id(process.pid),
+            started=time.time(),
+            only_if_status=[JobStatus.QUEUED],
+        )
+        if _read_state(job_dir)["status"] == JobStatus.CANCELLED:
+            process.terminate()
+
+        process.join(settings.JOB_TIMEOUT_SECONDS or None)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+            _update_state(
+                job_dir,
+                status=JobStatus.FAILED,
+                message=f"Timeout after {settings.JOB_TIMEOUT_SECONDS} seconds",
+                only_if_status=[JobStatus.RUNNING],
+            )
+        elif process.exitcode != 0:
+            _update_state(
+                job_dir,
+                status=JobStatus.FAILED,
+                message=f"The job process exited with code {process.exitcode}",
+                only_if_status=[JobStatus.RUNNING],
+            )
+
+
+def _run_job(
+    cohorts_db: data_api.CohortDataAPI, job_dir: str, job_type: str, params: Dict
+):
+    if settings.JOB_MAX_MEMORY_GB > 0:
+        import resource
+
+        max_memory = int(settings.JOB_MAX_MEMORY_GB * 1024**3)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    def report_progress(fraction: float, message: str = ""):
+        _update_state(
+            job_dir,
+            progress=float(fraction),
+            message=message,
+            only_if_status=[JobStatus.QUEUED, JobStatus.RUNNING],
+        )
+
+    try:
+        result = get_job_type(job_type).run(cohorts_db, report_progress, **params)
+        result_file = os.path.join(job_dir, RESULT_FILE)
+        with open(f"{result_file}.tmp", "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{result_file}.tmp", result_file)
+        _update_state(
+            job_dir,
+            status=JobStatus.DONE,
+            progress=1.0,
+            message="",
+            finished=time.time(),
+            only_if_status=[JobStatus.QUEUED, JobStatus.RUNNING],
+        )
+    except BaseException as err:
+        _update_state(
+            job_dir,
+            status=JobStatus.FAILED,
+            message=f"{type(err).__name__}: {err}",
+            traceback=traceback.format_exc(),
+            finished=time.time(),
+            only_if_status=[JobStatus.QUEUED, JobStatus.RUNNING],
+        )
+        raise
+
+
+def _read_state(job_dir: str) -> Union[Dict[str, Any], None]:
+    try:
+        with open(os.path.join(job_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_state(job_dir: str, state: Dict[str, Any]):
+    state_file = os.path.join(job_dir, STATE_FILE)
+    tmp_file = f"{state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+@contextlib.contextmanager
+def _locked_state(job_dir: str):
+    """File lock on the job state, since it is updated by several processes"""
+    with open(os.path.join(job_dir, LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_state(
+    job_dir: str, only_if_status: List[JobStatus] = None, **changes
+) -> Union[Dict[str, Any], None]:
+    """Updates fields of the job state, unless its status changed in the meantime (e.g. it was cancelled)."""
+    if not os.path.isdir(job_dir):
+        return None
+    with _locked_state(job_dir):
+        state = _read_state(job_dir)
+        if state is None:
+            return None
+        if only_if_status is not None and state["status"] not in only_if_status:
+            return state
+        state.update(changes)
+        _write_state(job_dir, state)
+        return state
+
+
+def _is_process_alive(pid: Union[int, None], start_id: str = "") -> bool:
+    """
+    Whether the process is alive and, if start_id is given, was not replaced by another process
+    with the same pid, e.g. after a restart of the server
+    """
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if start_id:
+        current_start_id = _get_process_start_id(pid)
+        if current_start_id and current_start_id != start_id:
+            return False
+    return True
+
+
+def _get_process_start_id(pid: int) -> str:
+    """Boot id and start time of a process, empty if /proc is not available (e.g. on macOS)"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return ""
+    # the process name in parentheses may contain spaces, the start time is field 22
+    start_time = stat.rsplit(")", 1)[1].split()[19]
+    return f"{boot_id}:{start_time}"
+
+
+def _remove_old_jobs(jobs_dir: str):
+    """Keeps the JOB_MAX_STORED most recent finished jobs"""
+    finished_jobs = [
+        state for state in list_jobs(jobs_dir) if state["status"] in FINISHED_STATUSES
+    ]
+    for state in finished_jobs[settings.JOB_MAX_STORED :]:
+        shutil.rmtree(os.path.join(jobs_dir, state["id"]), ignore_errors=True)
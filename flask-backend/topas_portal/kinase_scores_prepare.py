@@ -3,7 +3,6 @@ from typing import List
 
 from topas_portal import utils
 from topas_portal import settings
-import topas_portal.plotly_preprocess as plotlyprepare
 
 
 def _is_subsetted_list(customlist: List):
@@ -129,6 +128,8 @@ def get_multi_swarm_json(data, one_vs_all, selected_patient_or_entities):
 
 
 def get_dendro_or_heatmap_json(data: pd.DataFrame, plot_type="heatmap"):
+    import topas_portal.plotly_preprocess as plotlyprepare  # plotly is imported on first use
+
     fig_data = {}
     if plot_type == "heatmap":
         fig_data = plotlyprepare.get_simple_heatmap(data)
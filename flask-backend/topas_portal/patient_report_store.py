@@ -0,0 +1,243 @@
+"""
+Precomputed patient report tables. A background job materialises the report tables of
+all patients of a cohort per level, such that the patient report routes do not have
+to slice the wide matrices (and annotate p-sites) per request.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+import io
+import threading
+from typing import Dict, Iterator, List, TYPE_CHECKING, Union
+
+import numpy as np
+import pandas as pd
+
+from topas_portal import result_cache
+from topas_portal import utils
+from topas_portal import prexp_preprocess as pp
+from topas_portal.result_cache import CohortResultCache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+REPORT_LEVELS = [
+    utils.DataType.PHOSPHO_PROTEOME,
+    utils.DataType.FULL_PROTEOME,
+    utils.DataType.TOPAS_SCORE,
+    utils.DataType.KINASE_SCORE,
+    utils.DataType.PHOSPHO_SCORE,
+    utils.DataType.TRANSCRIPTOMICS,
+]
+
+patient_report_tables_cache = CohortResultCache("patient_report_tables", max_entries=256)
+
+_building_cohorts = set()
+_building_lock = threading.Lock()
+
+
+class PatientReportTable:
+    """
+    Report tables of all patients of a cohort for one level. Rows that are shared between
+    patients (gene names, p-site annotations, ...) are stored once, each patient only keeps
+    the positions of its rows and its values.
+    """
+
+    def __init__(self):
+        self.rows_df = pd.DataFrame()
+        self._row_frames = []
+        # hash of a row -> its position in rows_df
+        self._row_positions = {}
+        self._patients = {}
+
+    def add_patient(self, patient: str, report_df: pd.DataFrame, value_column: str):
+        rows_df = report_df.drop(columns=value_column).reset_index(drop=True)
+        row_keys = pd.util.hash_pandas_object(rows_df, index=False).to_numpy()
+
+        num_rows = len(self._row_positions)
+        row_positions = np.fromiter(
+            (
+                self._row_positions.setdefault(key, len(self._row_positions))
+                for key in row_keys.tolist()
+            ),
+            dtype=np.int32,
+            count=len(row_keys),
+        )
+        # new rows get consecutive positions in the order of their first occurrence
+        is_new_row = (row_positions >= num_rows) & ~pd.Index(row_positions).duplicated()
+        if is_new_row.any():
+            self._row_frames.append(rows_df[is_new_row])
+
+        self._patients[patient] = (
+            value_column,
+            report_df.columns.get_loc(value_column),
+            row_positions,
+            report_df[value_column].to_numpy(),
+        )
+
+    def finalize(self) -> PatientReportTable:
+        """Builds rows_df, no patients can be added afterwards"""
+        if self._row_frames:
+            self.rows_df = pd.concat(self._row_frames, ignore_index=True)
+        self._row_frames = []
+        self._row_positions = {}
+        return self
+
+    @property
+    def patients(self) -> List[str]:
+        return list(self._patients.keys())
+
+    def __contains__(self, patient: str) -> bool:
+        return patient in self._patients
+
+    def get_patient_report(self, patient: str) -> pd.DataFrame:
+        value_column, value_position, row_positions, values = self._patients[patient]
+        report_df = self.rows_df.take(row_positions).reset_index(drop=True)
+        report_df.insert(value_position, value_column, values)
+        return report_df
+
+
+def get_report_value_column(level: utils.DataType, patient: str) -> str:
+    """Name of the column holding the values of the patient in its report table"""
+    if level in [utils.DataType.PHOSPHO_PROTEOME, utils.DataType.FULL_PROTEOME]:
+        return patient + " Z-score"
+    if level == utils.DataType.TOPAS_SCORE:
+        return "Z-score"
+    return patient
+
+
+def build_patient_report_table(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    level: utils.DataType,
+    patients: List[str],
+) -> PatientReportTable:
+    report_table = PatientReportTable()
+    for patient, report_df in pp.iter_reports_per_patient_on_the_fly(
+        cohorts_db, level, cohort_index, patients, skip_missing=True
+    ):
+        report_table.add_patient(
+            patient, report_df, get_report_value_column(level, patient)
+        )
+    return report_table.finalize()
+
+
+def build_patient_reports(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    levels: List[utils.DataType] = REPORT_LEVELS,
+):
+    """Materialises the report tables of all patients of a cohort, levels that fail are skipped."""
+    data_version = result_cache.get_data_version(cohort_index)
+    patients = (
+        cohorts_db.get_patient_metadata_df(cohort_index)["Sample name"].unique().tolist()
+    )
+    for level in levels:
+        try:
+            report_table = build_patient_report_table(
+                cohorts_db, cohort_index, level, patients
+            )
+        except Exception as err:
+            cohorts_db.logger.log_message(
+                f"Patient reports {level.value} of cohort {cohort_index} were not built: {err}"
+            )
+            continue
+        patient_report_tables_cache.put(
+            cohort_index, level, report_table, data_version=data_version
+        )
+    cohorts_db.logger.log_message(f"Patient reports of cohort {cohort_index} built")
+
+
+def start_building_patient_reports(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[int] = None
+) -> threading.Thread:
+    """Builds the patient reports of the cohorts in a background thread, cohorts already being built are skipped."""
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    with _building_lock:
+        cohort_indices = [int(c) for c in cohort_indices if int(c) not in _building_cohorts]
+        _building_cohorts.update(cohort_indices)
+
+    def build():
+        for cohort_index in cohort_indices:
+            try:
+                build_patient_reports(cohorts_db, cohort_index)
+            except Exception as err:
+                cohorts_db.logger.log_message(
+                    f"Patient reports of cohort {cohort_index} were not built: {err}"
+                )
+            finally:
+                with _building_lock:
+                    _building_cohorts.discard(cohort_index)
+
+    thread = threading.Thread(target=build)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def get_build_status(cohort_index: Union[int, str]) -> Dict[str, Union[bool, List[str]]]:
+    with _building_lock:
+        is_building = int(cohort_index) in _building_cohorts
+    return {
+        "building": is_building,
+        "levels": [
+            level.value
+            for level in REPORT_LEVELS
+            if patient_report_tables_cache.get(cohort_index, level) is not None
+        ],
+    }
+
+
+def get_patient_report(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    patient: str,
+    level: utils.DataType,
+) -> pd.DataFrame:
+    """Report table of a patient from the store, computed on the fly if it was not built (yet)."""
+    report_table = patient_report_tables_cache.get(cohort_index, level)
+    if report_table is not None and patient in report_table:
+        return report_table.get_patient_report(patient)
+    return pp.get_reports_per_patient(
+        cohorts_db, cohort_index, patient, level, download_method="onfly"
+    )
+
+
+def get_unknown_patients(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str], patients: List[str]
+) -> List[str]:
+    """Patients that are not in the metadata of the cohort"""
+    known_patients = set(cohorts_db.get_patient_metadata_df(cohort_index)["Sample name"])
+    return [patient for patient in patients if patient not in known_patients]
+
+
+def iter_patient_reports_csv(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    patients: List[str],
+    level: utils.DataType,
+) -> Iterator[str]:
+    """
+    Streams the report tables of several patients as one tab separated table with a
+    leading 'Sample name' column, the patient specific value column is named 'value'.
+
+    The patients should be validated with get_unknown_patients before streaming, patients
+    without data for the level are skipped, as the response status has already been sent.
+    """
+    write_header = True
+    for patient in patients:
+        try:
+            report_df = get_patient_report(cohorts_db, cohort_index, patient, level)
+        except KeyError:
+            continue
+        report_df = report_df.rename(
+            columns={get_report_value_column(level, patient): "value"}
+        )
+        report_df.insert(0, "Sample name", patient)
+        buffer = io.StringIO()
+        report_df.to_csv(buffer, sep="\t", index=False, header=write_header)
+        write_header = False
+        yield buffer.getvalue()
@@ -1,7 +1,7 @@
 # retrieved from the wp3 topas pipeline
 import os
 import re
-from typing import List
+from typing import Hashable, List, Optional
 
 import pandas as pd
 import numpy as np
@@ -10,6 +10,10 @@ import numpy as np
 from . import settings
 from . import utils
 from . import fetch_data_matrix as data
+from . import imputation
+from . import result_cache
+from . import embedding_cache
+from . import reference_embedding
 from .dimensionality_reduction import get_dimensionality_reduction_method
 import db
 
@@ -27,6 +31,8 @@ def do_pca(
     include_reference_channels: bool = False,
     include_replicates: bool = False,
     only_ref_channels=False,
+    reference_model: Optional[reference_embedding.ReferenceModel] = None,
+    return_imputed_data: bool = True,
 ):
     """_summary_
 
@@ -40,6 +46,10 @@ def do_pca(
         dimensionality_reduction_method (str, optional): _description_. Defaults to 'ppca'.
         include_reference_channels (bool, optional): _description_. Defaults to False.
         include_replicates (bool, optional): _description_. Defaults to False.
+        reference_model (ReferenceModel, optional): projects the samples into this reference
+            embedding instead of fitting the dimensionality reduction on them.
+        return_imputed_data (bool, optional): whether to return the imputed matrices, which are
+            only taken from the cache or imputed again on request. Defaults to True.
 
     Returns:
         _type_: _description_
@@ -60,26 +70,14 @@ def do_pca(
     all_principal_variances = []
     imputed_data = []
 
-    if plot_types[0] == utils.DataType.FP_PP:
-        plot_types = ["protein", "psite"]
-
-    list_dfs = []
-    for plot_type in plot_types:
-        df = load_pca_data(
-            results_folder,
-            metadata_df["Sample name"],
-            plot_type,
-            include_reference_channels,
-            only_ref_channels=only_ref_channels,
-        )
-        list_dfs.append(df)
-
-    if len(list_dfs) > 1:
-        fp_df = list_dfs[0]
-        pp_df = list_dfs[1]
-        pp_df = pp_df.set_index(pp_df.index.get_level_values("Modified sequence"))
-        df = pd.concat([fp_df, pp_df])
-        print("Running multi level FP and PP")
+    plot_types = _get_layer_plot_types(plot_types)
+    df = load_layer_data(
+        results_folder,
+        metadata_df["Sample name"],
+        plot_types,
+        include_reference_channels,
+        only_ref_channels=only_ref_channels,
+    )
 
     if len(selected_proteins) > 2:
         final_selected = [
@@ -97,12 +95,22 @@ def do_pca(
             if len(mask) > 2:
                 df = df[mask]
 
-    principal_df, pca, imputed_df = metadata_pca(
-        df,
-        metadata_df,
-        dimensionality_reduction_method,
-        min_sample_occurrence_ratio,
-    )
+    if reference_model is not None:
+        principal_df, explained_variances, imputed_df = metadata_projection(
+            df, metadata_df, reference_model, return_imputed_data=return_imputed_data
+        )
+    else:
+        principal_df, explained_variances, imputed_df = metadata_pca(
+            df,
+            metadata_df,
+            dimensionality_reduction_method,
+            min_sample_occurrence_ratio,
+            cohort_index=cohorts_db.config.get_cohort_index_from_report_directory(
+                results_folder
+            ),
+            layer=tuple(plot_types),
+            return_imputed_data=return_imputed_data,
+        )
     # print(f'df {df}')
     # print(f'imputed data{imputed_data}')
     # print(f'meta data{metadata_df}')
@@ -111,11 +119,104 @@ def do_pca(
     if dimensionality_reduction_method == "umap":
         all_principal_variances.append([])
     else:
-        all_principal_variances.append(pca.get_explained_variances())
+        all_principal_variances.append(explained_variances)
 
     return all_principal_dfs, all_principal_variances, imputed_data, metadata_df
 
 
+def _get_layer_plot_types(plot_types: List[utils.DataType]) -> List[utils.DataType]:
+    if plot_types[0] == utils.DataType.FP_PP:
+        return ["protein", "psite"]
+    return plot_types
+
+
+def load_layer_data(
+    results_folder,
+    samples,
+    plot_types: List[utils.DataType],
+    include_reference_channels: bool = False,
+    only_ref_channels=False,
+) -> pd.DataFrame:
+    """Features x samples matrix of a layer, or of full proteome and phospho together"""
+    list_dfs = []
+    for plot_type in plot_types:
+        df = load_pca_data(
+            results_folder,
+            samples,
+            plot_type,
+            include_reference_channels,
+            only_ref_channels=only_ref_channels,
+        )
+        list_dfs.append(df)
+
+    if len(list_dfs) > 1:
+        fp_df = list_dfs[0]
+        pp_df = list_dfs[1]
+        pp_df = pp_df.set_index(pp_df.index.get_level_values("Modified sequence"))
+        df = pd.concat([fp_df, pp_df])
+        print("Running multi level FP and PP")
+    return df
+
+
+def get_reference_model(
+    cohort_index: int,
+    plot_type: utils.DataType,
+    method_name: str = "ppca",
+    min_sample_occurrence_ratio: float = 0.5,
+    refit: bool = False,
+) -> reference_embedding.ReferenceModel:
+    """
+    Reference embedding of a cohort layer, fitted on all patient samples (without reference
+    channels and replicates) and reused for projecting new batches or selected patients.
+    """
+    plot_types = _get_layer_plot_types([plot_type])
+
+    def get_expression_df() -> pd.DataFrame:
+        results_folder = cohorts_db.config.get_report_directory(cohort_index)
+        patients_df = cohorts_db.get_patient_metadata_df(cohort_index)
+        df = load_layer_data(results_folder, patients_df["Sample name"], plot_types)
+        return filter_by_occurrence(df, min_sample_occurrence_ratio)
+
+    return reference_embedding.get_reference_model(
+        cohort_index,
+        result_cache.get_cohort_name(cohorts_db.config, cohort_index),
+        (tuple(plot_types), min_sample_occurrence_ratio),
+        method_name,
+        get_expression_df,
+        cohorts_db.logger,
+        refit=refit,
+    )
+
+
+def metadata_projection(
+    df: pd.DataFrame,
+    metadata_df: pd.DataFrame,
+    reference_model: reference_embedding.ReferenceModel,
+    return_imputed_data: bool = True,
+):
+    """
+    Projects the samples of df (features x samples) into the reference embedding, returns
+    the same as metadata_pca, with the explained variances of the reference.
+    """
+    expression_df = df.transpose()
+    transformed_data = reference_model.project(expression_df).reset_index(drop=True)
+    transformed_data.columns = ["Principal component 1", "Principal component 2"]
+    transformed_data["Sample"] = expression_df.index
+    principal_df = transformed_data.merge(
+        metadata_df, left_on="Sample", right_on="Sample name"
+    )
+
+    imputed_data = None
+    if return_imputed_data:
+        imputed_data = imputation.impute_min(
+            expression_df.reindex(columns=reference_model.features)
+        )
+    explained_variances = reference_model.explained_variances
+    if explained_variances is not None:
+        explained_variances = explained_variances.copy()
+    return principal_df, explained_variances, imputed_data
+
+
 def load_pca_data(
     results_folder,
     samples,
@@ -175,23 +276,106 @@ def metadata_pca(
     metadata_df: pd.DataFrame,
     method_name: str = "ppca",
     min_sample_occurrence_ratio: float = 0.5,
+    cohort_index: Optional[int] = None,
+    layer: Optional[Hashable] = None,
+    return_imputed_data: bool = True,
 ):
+    """
+    Embeds the samples of df (features x samples) in two dimensions. Embeddings are cached
+    per cohort, layer, method and the samples and features that pass the occurrence filter.
+
+    Returns:
+        the embedding merged with metadata_df, the explained variances (None for UMAP/PHATE)
+        and the imputed samples x features matrix (None unless return_imputed_data)
+    """
     print(method_name)
     expression_df = filter_by_occurrence(df, min_sample_occurrence_ratio)
 
-    # calculate ppca
-    dim_reduction_method = get_dimensionality_reduction_method(method_name)
-    transformed_data = dim_reduction_method.fit_transform(expression_df)
+    embedding = embedding_cache.get_embedding(
+        expression_df,
+        cohort_index,
+        result_cache.get_cohort_name(cohorts_db.config, cohort_index),
+        (layer, method_name.lower()),
+        lambda: _compute_embedding(expression_df, method_name, cohort_index, layer),
+        cohorts_db.logger,
+    )
+    transformed_data = embedding.transformed_df.copy()
     transformed_data.columns = ["Principal component 1", "Principal component 2"]
     transformed_data["Sample"] = expression_df.index
     principal_df = transformed_data.merge(
         metadata_df, left_on="Sample", right_on="Sample name"
     )
 
-    imputed_data = dim_reduction_method._imputed_data
-    imputed_data.index = df.columns
+    imputed_data = None
+    if return_imputed_data:
+        imputed_data = _get_imputed_data(
+            expression_df, method_name, cohort_index, layer
+        ).set_axis(df.columns, axis=0)
+    explained_variances = embedding.explained_variances
+    if explained_variances is not None:
+        explained_variances = explained_variances.copy()
+    return principal_df, explained_variances, imputed_data
+
+
+def _compute_embedding(
+    expression_df: pd.DataFrame,
+    method_name: str,
+    cohort_index: Optional[int],
+    layer: Optional[Hashable],
+) -> embedding_cache.Embedding:
+    dim_reduction_method = get_dimensionality_reduction_method(method_name)
+    if cohort_index is None:
+        transformed_data = dim_reduction_method.fit_transform(expression_df)
+    elif dim_reduction_method.imputation_method is not None:
+        # shares the imputed matrix with other views on the same cohort and layer
+        imputed_df = imputation.get_imputed_df(
+            expression_df, cohort_index, layer, dim_reduction_method.imputation_method
+        )
+        transformed_data = dim_reduction_method.fit_transform(imputed_df)
+    else:
+        # the matrix imputed by the fit is kept in the imputation cache, not in the embedding
+        data_version = result_cache.get_data_version(cohort_index)
+        transformed_data = dim_reduction_method.fit_transform(expression_df)
+        imputation.put_model_imputed_df(
+            expression_df,
+            cohort_index,
+            layer,
+            method_name.lower(),
+            dim_reduction_method._imputed_data,
+            data_version,
+        )
+    return embedding_cache.Embedding(
+        transformed_data, dim_reduction_method.get_explained_variances()
+    )
+
+
+def _get_imputed_data(
+    expression_df: pd.DataFrame,
+    method_name: str,
+    cohort_index: Optional[int],
+    layer: Optional[Hashable],
+) -> pd.DataFrame:
+    """
+    Imputed samples x features matrix the embedding of expression_df was computed from, taken
+    from the imputation cache or imputed again, which refits methods that impute by their fit.
+    """
+    dim_reduction_method = get_dimensionality_reduction_method(method_name)
+    if dim_reduction_method.imputation_method is not None:
+        if cohort_index is None:
+            return imputation.impute(expression_df, dim_reduction_method.imputation_method)
+        return imputation.get_imputed_df(
+            expression_df, cohort_index, layer, dim_reduction_method.imputation_method
+        )
+
+    def refit() -> pd.DataFrame:
+        dim_reduction_method.fit_transform(expression_df)
+        return dim_reduction_method._imputed_data
 
-    return principal_df, dim_reduction_method, imputed_data
+    if cohort_index is None:
+        return refit()
+    return imputation.get_model_imputed_df(
+        expression_df, cohort_index, layer, method_name.lower(), refit
+    )
 
 
 def _remove_prefix_from_index(df):
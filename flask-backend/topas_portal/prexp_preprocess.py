@@ -1,31 +1,31 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import os
+from typing import Iterator, List, Tuple, TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
 
 from topas_portal import utils
 from topas_portal import settings
 from topas_portal import fetch_data_matrix as data
+from topas_portal import sample_metadata
+from topas_portal import density_plots
+from topas_portal import detection_index
 import topas_portal.genomics_preprocess as genomics_prep
 import topas_portal.psite_annotation as ps
+import topas_portal.file_loaders.psp_annotation as psp_annotation
 import topas_portal.topas_preprocess as topas_loader
+from topas_portal.result_cache import CohortResultCache
 
 if TYPE_CHECKING:
     import topas_portal.data_api.data_api as data_api
 
+patient_report_workbooks_cache = CohortResultCache("patient_report_workbooks", max_entries=16)
+abundance_column_maps_cache = CohortResultCache("abundance_column_maps", max_entries=64)
 
-def get_protein_list_per_patient(patient_identifier, intensity_df):
-    """Gets the unique list of the proteins for one patient as a dataFrame"""
-    if isinstance(intensity_df, pd.DataFrame):
-        patient_df = intensity_df[[str(patient_identifier)]]
-        patient_df = patient_df.dropna()
-        patient_proteins = pd.DataFrame(list(set(patient_df.index)))
-        patient_proteins.columns = ["sample"]
-        patient_proteins["group"] = str(patient_identifier)
-        return patient_proteins
-    else:
-        pass
+ABUNDANCE_UNITS = ["FC", "Z-score", "Intensity"]
+ABUNDANCE_UNIT_REGEX = r" (Z-score|FC|Intensity)"
 
 
 def get_pep_number_from_protein_name(
@@ -51,30 +51,6 @@ def get_pep_number_from_protein_name(
         pass
 
 
-def _get_protein_list_per_batch(batchNo, sample_annotation, df_intensity):
-    """Gets the list of the proteins for one batch as a dataFrame"""
-    if isinstance(sample_annotation, pd.DataFrame) & isinstance(
-        df_intensity, pd.DataFrame
-    ):
-        list_patients_batch = list(
-            sample_annotation["Sample name"][
-                sample_annotation["Batch_No"].astype(str) == str(batchNo)
-            ]
-        )
-        list_patients_batch = utils.intersection(list_patients_batch, df_intensity.columns)
-        if len(list_patients_batch) == 0:
-            return pd.DataFrame(columns=["sample", "group"])  # return an empty df
-        else:
-            batch_df = df_intensity[list_patients_batch]
-            batch_df = batch_df.dropna()
-            batch_proteins = pd.DataFrame(list(set(batch_df.index)))
-            batch_proteins.columns = ["sample"]
-            batch_proteins["group"] = batchNo
-            return batch_proteins
-    else:
-        pass
-
-
 def merge_data_with_num_pep(
     abundances_df: pd.DataFrame, num_pep_meta_df: pd.DataFrame, identifier: str, regex
 ):
@@ -98,24 +74,101 @@ def merge_data_with_num_pep(
 
 
 def get_expression_data_per_analyte(
-    abundances, patients_df, sample_annotation_df, imputation_mode: utils.ImputationMode,
+    abundances,
+    cohort_sample_metadata: sample_metadata.SampleMetadata,
+    imputation_mode: utils.ImputationMode,
+    column_map: AbundanceColumnMap = None,
 ):
     """
     abundances: dataframe with abundances for a single gene/p-site across all patients
+    column_map: column positions of the layer of abundances, built from its columns if not given
     """
-    abundances_table = get_expression_data_from_abundance_df(abundances)
-    abundances_table = add_is_replicate_column(abundances_table)
+    if column_map is None or not column_map.matches(abundances.columns):
+        column_map = AbundanceColumnMap(abundances.columns)
+    abundances_table = column_map.get_expression_data(abundances)
     abundances_table = add_occurence_rank(abundances_table)
-    abundances_table = utils.merge_with_sample_annotation_df(
-        abundances_table, sample_annotation_df
-    )
-    abundances_table = utils.merge_with_patients_meta_df(abundances_table, patients_df)
+    abundances_table = cohort_sample_metadata.merge(abundances_table)
     abundances_table = min_impute_handler(abundances_table, imputation_mode)
     abundances_table = utils.fill_nans_patient_columns(abundances_table)
     abundances_table = utils.post_process_for_front_end(abundances_table)
     return abundances_table
 
 
+class AbundanceColumnMap:
+    """
+    Positions of the FC, Z-score and Intensity columns of each sample in the columns of an
+    abundance table, such that the values of a single gene/p-site are gathered in one step
+    instead of melting and pivoting its row. The result is the same as for
+    get_expression_data_from_abundance_df followed by add_is_replicate_column.
+    """
+
+    def __init__(self, columns: pd.Index):
+        self.columns = columns
+
+        units = columns.str.extract(ABUNDANCE_UNIT_REGEX)[0]
+        sample_names = columns.str.replace(ABUNDANCE_UNIT_REGEX, "", regex=True)
+        is_unit_column = units.notna().to_numpy()
+        units = units[is_unit_column].to_numpy()
+        sample_names = sample_names[is_unit_column]
+        column_positions = np.flatnonzero(is_unit_column)
+
+        # pivot_table sorts the samples by name
+        self.sample_names = pd.Index(sample_names.unique()).sort_values()
+        sample_positions = self.sample_names.get_indexer(sample_names)
+
+        # samples x units, -1 for missing values
+        self.positions = np.full((len(self.sample_names), len(ABUNDANCE_UNITS)), -1)
+        self.available_units = []
+        for unit_index, unit in enumerate(ABUNDANCE_UNITS):
+            is_unit = units == unit
+            self.positions[sample_positions[is_unit], unit_index] = column_positions[is_unit]
+            if is_unit.any():
+                self.available_units.append(unit)
+
+        # pivot_table takes the first non-missing value of duplicated columns
+        self.has_duplicates = pd.MultiIndex.from_arrays(
+            [sample_names, units]
+        ).has_duplicates
+
+        replicate_suffixes = self.sample_names.str.split("-").str[-1]
+        self.is_replicate = np.where(
+            replicate_suffixes.str.contains("R"), replicate_suffixes, "not_replicate"
+        )
+
+    def matches(self, columns: pd.Index) -> bool:
+        return columns is self.columns or columns.equals(self.columns)
+
+    def get_expression_data(self, abundances: pd.DataFrame) -> pd.DataFrame:
+        """Table with the FC, Z-score and Intensity of each sample for the single row of abundances"""
+        if self.has_duplicates:
+            return add_is_replicate_column(get_expression_data_from_abundance_df(abundances))
+
+        # the extra missing value at the end is gathered for positions of -1
+        values = np.append(abundances.to_numpy()[0], np.nan)
+        abundances_table = {"Sample name": self.sample_names.to_numpy()}
+        for unit_index, unit in enumerate(ABUNDANCE_UNITS):
+            if unit in self.available_units:
+                abundances_table[unit] = pd.Series(
+                    values[self.positions[:, unit_index]]
+                ).infer_objects()
+            else:
+                abundances_table[unit] = "N/A"
+        abundances_table["is_replicate"] = self.is_replicate
+        return pd.DataFrame(abundances_table)
+
+
+def get_abundance_column_map(
+    cohort_index: int, level: utils.DataType, include_ref: utils.IncludeRef, columns: pd.Index
+) -> AbundanceColumnMap:
+    """Column map of a layer of the cohort, rebuilt if the columns of the layer changed"""
+    key = (level.value, include_ref.value)
+    column_map = abundance_column_maps_cache.get(cohort_index, key)
+    if column_map is None or not column_map.matches(columns):
+        column_map = AbundanceColumnMap(columns)
+        abundance_column_maps_cache.put(cohort_index, key, column_map)
+    return column_map
+
+
 def get_expression_data_from_abundance_df(abundances: pd.DataFrame) -> pd.DataFrame:
     """
     abundances: dataframe with abundances for a single gene/p-site across all patients
@@ -184,8 +237,8 @@ def add_is_replicate_column(abundance_df: pd.DataFrame):
 
 def add_occurence_rank(df: pd.DataFrame):
     try:
-        abundances_table = df.copy()
-        abundances_table = abundances_table.sort_values("Z-score", ascending=False)
+        # sort_values returns a copy already
+        abundances_table = df.sort_values("Z-score", ascending=False)
         occurrence = abundances_table["Z-score"].count()
         abundances_table["Rank"] = list(range(1, occurrence + 1)) + ["n.d."] * (
             len(abundances_table.index) - occurrence
@@ -215,12 +268,9 @@ def get_density_calc_protein(
     identifier,
     intensity_unit: utils.IntensityUnit,
 ):
-    samples_annotation_df = cohorts_db.get_sample_annotation_df(cohort_index)
-    samples_list = samples_annotation_df['Sample name'].unique().tolist()
-    temp_df = cohorts_db.get_protein_abundance_df(
-        cohort_index, intensity_unit=intensity_unit
+    count_df_protein = density_plots.get_protein_density_plot_df(
+        cohorts_db, cohort_index, identifier, intensity_unit
     )
-    count_df_protein = utils.count_df_to_density_plot_df(temp_df, identifier,samples_list)
     return utils.df_to_json(count_df_protein)
 
 
@@ -274,10 +324,11 @@ def get_abundance(
     if len(abundances.index) > 1:
         return "", f'400 {level} "{identifier}" found multiple times in dataset'
 
-    patients_df = cohorts_db.get_patient_metadata_df(cohort_index)
-    sample_annotation_df = cohorts_db.get_sample_annotation_df(cohort_index)
     abundances_table = get_expression_data_per_analyte(
-        abundances, patients_df, sample_annotation_df, imputation_mode,
+        abundances,
+        sample_metadata.get_sample_metadata(cohorts_db, cohort_index),
+        imputation_mode,
+        get_abundance_column_map(cohort_index, level, include_ref, abundances.columns),
     )
 
     # adding confidence score at FP level
@@ -326,53 +377,34 @@ def get_abundance(
 def get_batches_proteins_as_json(
     cohorts_db: data_api.CohortDataAPI, cohort_index, pp_fp, batchlists
 ):
-    sample_annotation = cohorts_db.get_sample_annotation_df(cohort_index)
-    if pp_fp == utils.DataType.FP:
-        df = cohorts_db.get_protein_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-    else:
-        df = cohorts_db.get_psite_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-    samples_list = sample_annotation['Sample name'].unique().tolist()
-    sample_names = utils.intersection(samples_list,df.columns)
-    df = df[sample_names]
-    list_batches = batchlists.split(";")
-    df_list = []
-    for batch in list_batches:
-        df_list.append(_get_protein_list_per_batch(batch, sample_annotation, df))
-
-    venn_df = pd.concat(df_list)
+    bitmap = detection_index.get_detection_bitmap(cohorts_db, cohort_index, pp_fp)
+    venn_df = pd.concat(
+        [
+            _get_members_df(bitmap.get_members(bitmap.get_batch_bits(batch)), batch)
+            for batch in batchlists.split(";")
+        ]
+    )
     return utils.df_to_json(venn_df)
 
 
 def get_patients_proteins_as_json(
     cohorts_db: data_api.CohortDataAPI, cohort_index, pp_fp, patientslists
 ):
-    # TODO: replace with utils.DataType
-    if pp_fp == utils.DataType.FP:
-        df = cohorts_db.get_protein_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-    else:
-        df = cohorts_db.get_psite_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-
-    sample_annotation = cohorts_db.get_sample_annotation_df(cohort_index)
-    samples_list = sample_annotation['Sample name'].unique().tolist()
-    sample_names = utils.intersection(samples_list,df.columns)
-    df = df[sample_names]
-    list_patients = patientslists.split(";")
-    df_list = []
-    for patient in list_patients:
-        df_list.append(get_protein_list_per_patient(patient, df))
-
-    venn_df = pd.concat(df_list)
+    bitmap = detection_index.get_detection_bitmap(cohorts_db, cohort_index, pp_fp)
+    venn_df = pd.concat(
+        [
+            _get_members_df(bitmap.get_members(bitmap.get_patient_bits(patient)), patient)
+            for patient in patientslists.split(";")
+        ]
+    )
     return utils.df_to_json(venn_df)
 
 
+def _get_members_df(members: List[str], group: str) -> pd.DataFrame:
+    """Detected proteins or p-sites of a patient or batch, one row per member with its group"""
+    return pd.DataFrame({"sample": pd.Series(members, dtype=object), "group": str(group)})
+
+
 def get_list_by_selected_modality_per_cohort(
     cohorts_db: data_api.CohortDataAPI, cohort_index: int, modality: str
 ):
@@ -390,51 +422,6 @@ def get_list_by_selected_modality_per_cohort(
     return utils.df_to_json(df)
 
 
-def identifications_across_all_patients(
-    cohorts_db: data_api.CohortDataAPI, fp_pp: str, cohort_index: int
-):
-    # TODO: replace with utils.DataType
-    if fp_pp == "fp":
-        df = cohorts_db.get_protein_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-        nan_count = pd.DataFrame(df.notna().sum())
-    elif fp_pp == "pp":
-        df = cohorts_db.get_psite_abundance_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-        )
-        nan_count = pd.DataFrame(df.notna().sum())
-    else:
-        df = cohorts_db.get_num_pep_fp(cohort_index).copy()
-        df.columns = df.columns.str.replace("Identification metadata ", "", regex=True)
-        nan_count = pd.DataFrame(df.sum())
-    nan_count.columns = ["identified"]
-    nan_count["patients"] = df.columns
-    return nan_count
-
-
-def sum_intensities_across_all_patients(
-    cohorts_db: data_api.CohortDataAPI, cohort_index: int, dtype = 'pp'
-):
-    """
-    Getting the sum of intensities accross all patients for the PP for the Patient centric tab
-    """
-    if dtype == 'pp':
-        df = cohorts_db.get_psite_abundance_df(
-        cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-    )
-    else:
-        df = cohorts_db.get_protein_abundance_df(
-        cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
-    )
-
-    print(df)
-    sum_intensities = pd.DataFrame(df.sum())
-    sum_intensities.columns = ["sumIntensities"]
-    sum_intensities["patients"] = df.columns
-    return sum_intensities
-
-
 def get_reports_per_patient(
     cohorts_db: data_api.CohortDataAPI,
     cohort_index: int,
@@ -466,7 +453,13 @@ def _get_reports_per_patient_from_the_reports_folder(
         reports_dir + "/Reports/" + patient + "_proteomics_results.xlsx"
     )
     sheetname = _get_sheetname_from_level(level)
-    df = pd.read_excel(path_to_patient_results, sheet_name=sheetname)
+    # all sheets are parsed at once, openpyxl parsing dominates over reading a single sheet
+    workbook = patient_report_workbooks_cache.get_or_compute(
+        cohort_index,
+        (path_to_patient_results, os.path.getmtime(path_to_patient_results)),
+        lambda: pd.read_excel(path_to_patient_results, sheet_name=None),
+    )
+    df = workbook[sheetname]
     df = df.fillna("n.d")
     return df
 
@@ -491,51 +484,96 @@ def _get_sheetname_from_level(level: utils.DataType):
 def _get_reports_per_patient_on_the_fly(
     cohorts_db: data_api.CohortDataAPI, level, cohort_index, patient
 ):
-    final_df = pd.DataFrame()
+    for _, final_df in iter_reports_per_patient_on_the_fly(
+        cohorts_db, level, cohort_index, [patient]
+    ):
+        return final_df
+    return pd.DataFrame()
+
+
+def iter_reports_per_patient_on_the_fly(
+    cohorts_db: data_api.CohortDataAPI,
+    level: utils.DataType,
+    cohort_index: int,
+    patients: List[str],
+    skip_missing: bool = False,
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Yields (patient, report table) for several patients, the cohort wide tables of
+    the level are only retrieved once.
+
+    Args:
+        skip_missing (bool): skip patients without data for the level instead of raising a KeyError.
+    """
     if level == utils.DataType.PHOSPHO_PROTEOME:
-        patient_column = patient + " Z-score"
-        sub_df = cohorts_db.get_psite_abundance_df(
-            cohort_index, patient_name=patient_column,
-        )
-        sub_df = sub_df.dropna()
-        final_df = ps.phospho_annot(sub_df)
+        psp_annotation_df = cohorts_db.get_psp_annotation_index(cohort_index)
+
+        def get_report(patient):
+            patient_column = patient + " Z-score"
+            sub_df = cohorts_db.get_psite_abundance_df(
+                cohort_index, patient_name=patient_column,
+            )
+            sub_df = sub_df.dropna()
+            if psp_annotation_df is not None:
+                return psp_annotation.get_patient_psp_annotations(
+                    sub_df, patient_column, psp_annotation_df
+                )
+            return ps.phospho_annot(sub_df)
 
     elif level == utils.DataType.FULL_PROTEOME:
-        patient_column = patient + " Z-score"
-        sub_df = cohorts_db.get_protein_abundance_df(
-            cohort_index, patient_name=patient_column,
-        )
-        sub_df["Gene names"] = sub_df.index
-        final_df = sub_df.dropna()
+
+        def get_report(patient):
+            patient_column = patient + " Z-score"
+            sub_df = cohorts_db.get_protein_abundance_df(
+                cohort_index, patient_name=patient_column,
+            )
+            sub_df["Gene names"] = sub_df.index
+            return sub_df.dropna()
 
     elif level == utils.DataType.TOPAS_SCORE:
-        sub_df = cohorts_db.get_topas_scores_df(
-            cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
-        )
-        sub_df = topas_loader.get_topas_scores_long_format(sub_df)
-        sub_df = sub_df[sub_df["Sample name"] == patient]
-        final_df = sub_df[["Topas_id", "Z-score"]]
-        final_df = final_df.dropna()
+
+        def get_report(patient):
+            sub_df = topas_loader.get_topas_scores_long_df(
+                cohorts_db, cohort_index, utils.IntensityUnit.Z_SCORE, patient_name=patient
+            )
+            final_df = sub_df[["Topas_id", "Z-score"]]
+            return final_df.dropna()
 
     elif level == utils.DataType.KINASE_SCORE:
-        sub_df = cohorts_db.get_kinase_scores_df(
+        kinase_df = cohorts_db.get_kinase_scores_df(
             cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
         )
-        sub_df["Kinase_names"] = sub_df.index
-        final_df = sub_df[["Kinase_names", patient]]
-        final_df = final_df.dropna()
+        kinase_df["Kinase_names"] = kinase_df.index
+
+        def get_report(patient):
+            final_df = kinase_df[["Kinase_names", patient]]
+            return final_df.dropna()
 
     elif level == utils.DataType.PHOSPHO_SCORE:
-        sub_df = cohorts_db.get_phosphorylation_scores_df(
+        phospho_score_df = cohorts_db.get_phosphorylation_scores_df(
             cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
         )
-        sub_df["Gene names"] = sub_df.index
-        final_df = sub_df[["Gene names", patient]]
-        final_df = final_df.dropna()
+        phospho_score_df["Gene names"] = phospho_score_df.index
+
+        def get_report(patient):
+            final_df = phospho_score_df[["Gene names", patient]]
+            return final_df.dropna()
 
     elif level == utils.DataType.TRANSCRIPTOMICS:
-        sub_df = cohorts_db.get_fpkm_df(intensity_unit=utils.IntensityUnit.Z_SCORE)
-        sub_df["Gene names"] = sub_df.index
-        final_df = sub_df[["Gene names", patient]]
+        fpkm_df = cohorts_db.get_fpkm_df(intensity_unit=utils.IntensityUnit.Z_SCORE)
+        fpkm_df["Gene names"] = fpkm_df.index
 
-    return final_df
+        def get_report(patient):
+            return fpkm_df[["Gene names", patient]]
+
+    else:
+        return
+
+    for patient in patients:
+        try:
+            final_df = get_report(patient)
+        except KeyError:
+            if skip_missing:
+                continue
+            raise
+        yield patient, final_df
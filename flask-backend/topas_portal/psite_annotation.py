@@ -1,8 +1,8 @@
 # retrieved from the wp3_pipeline
 import pandas as pd
 from itertools import compress
-import psite_annotation as pa
 import db
+import topas_portal.file_loaders.psp_annotation as psp_annotation
 
 
 cohorts_db = db.cohorts_db
@@ -28,21 +28,8 @@ def phospho_annot(
     :param pspRegulatoryFile: file used for adding regulatory information
     """
     try:
-        df = df.reset_index(level="Modified sequence")
-        df = pa.addPeptideAndPsitePositions(
-            df, pspFastaFile, pspInput=True, returnAllPotentialSites=False
-        )
-        df = pa.addPSPAnnotations(df, pspAnnotationFile)
-        df = pa.addPSPRegulatoryAnnotations(df, pspRegulatoryFile)
-
-        df["PSP_LT_LIT"] = df["PSP_LT_LIT"].apply(lambda x: max(x.split(";")))
-        df["PSP_MS_LIT"] = df["PSP_MS_LIT"].apply(lambda x: max(x.split(";")))
-        df["PSP_MS_CST"] = df["PSP_MS_CST"].apply(lambda x: max(x.split(";")))
-        df.rename(
-            columns={"Site positions": "Site positions identified (MQ)"}, inplace=True
-        )
-        df = pa.addPeptideAndPsitePositions(
-            df, pspFastaFile, pspInput=True, returnAllPotentialSites=True
+        df = psp_annotation.annotate_psites(
+            df, pspFastaFile, pspAnnotationFile, pspRegulatoryFile
         )
     except Exception as e:
         print(e)
@@ -0,0 +1,254 @@
+"""
+QC summary of a cohort for the patient-centric tab and the overview: identifications and summed
+intensities per sample, the counts of phosphorylated residues and per-batch counts.
+
+The summary is computed once after loading the cohort, instead of scanning the full FP/PP
+matrices on every request, and persisted to PORTAL_CACHE_DIR/<cohort name>/qc_summary.
+Persisted summaries are only reused for the same fingerprint of the loaded data.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+import os
+from typing import Callable, List, TYPE_CHECKING, Union
+
+import numpy as np
+import pandas as pd
+
+from topas_portal import settings
+from topas_portal import utils
+from topas_portal import result_cache
+from topas_portal.result_cache import CohortResultCache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+QC_SUMMARY_DIR = "qc_summary"
+
+# later modifications take precedence, as in the former str.contains assignments
+MODIFICATION_TYPES = {
+    "pT": "Phospho Threonine",
+    "pS": "Phospho Serine",
+    "pY": "Phospho Tyrosine",
+}
+
+qc_summaries_cache = CohortResultCache("qc_summaries", max_entries=64)
+
+
+class CohortQCSummary:
+    """
+    QC summary statistics of a cohort. Parts that could not be computed are None and are
+    computed on request instead, such that the original error is raised to the client.
+    """
+
+    def __init__(self, cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str]):
+        self.identifications = {}
+        self.sum_intensities = {}
+        identified_dfs = {}
+        for fp_pp, get_intensity_df in _get_intensity_df_getters(cohorts_db, cohort_index).items():
+            intensity_df = _try_compute(get_intensity_df)
+            if intensity_df is None:
+                self.identifications[fp_pp] = None
+                self.sum_intensities[fp_pp] = None
+                continue
+            identified_dfs[fp_pp] = intensity_df.notna()
+            self.identifications[fp_pp] = count_identifications(
+                intensity_df, identified_dfs[fp_pp]
+            )
+            self.sum_intensities[fp_pp] = sum_intensities(intensity_df)
+
+        self.identifications["num_pep"] = _try_compute(
+            lambda: count_identified_peptides(cohorts_db.get_num_pep_fp(cohort_index))
+        )
+        self.modification_type_counts = _try_compute(
+            lambda: count_modification_types(cohorts_db.get_psite_abundance_df(cohort_index))
+        )
+        self.batch_counts = _try_compute(
+            lambda: count_per_batch(
+                cohorts_db.get_sample_annotation_df(cohort_index), identified_dfs
+            )
+        )
+
+
+def get_qc_summary(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: Union[int, str],
+    cache_dir: Union[str, os.PathLike] = settings.PORTAL_CACHE_DIR,
+) -> CohortQCSummary:
+    def load_or_compute() -> CohortQCSummary:
+        data_fingerprint = result_cache.get_data_fingerprint(cohort_index)
+        cohort_name = result_cache.get_cohort_name(cohorts_db.config, cohort_index)
+        if not data_fingerprint or cohort_name is None:
+            return CohortQCSummary(cohorts_db, cohort_index)
+
+        summary_file = result_cache.get_persisted_file(
+            cache_dir, cohort_name, QC_SUMMARY_DIR, data_fingerprint
+        )
+        qc_summary = result_cache.load_persisted_result(summary_file, cohorts_db.logger)
+        if qc_summary is not None:
+            return qc_summary
+
+        qc_summary = CohortQCSummary(cohorts_db, cohort_index)
+        result_cache.persist_result(
+            qc_summary, summary_file, cohorts_db.logger, data_fingerprint=data_fingerprint
+        )
+        return qc_summary
+
+    return qc_summaries_cache.get_or_compute(cohort_index, "qc_summary", load_or_compute)
+
+
+def build_qc_summaries(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[Union[int, str]] = None
+):
+    """Builds the QC summaries of the cohorts right after loading instead of on first use."""
+    if settings.DATABASE_MODE:
+        return  # scanning the full matrices is too slow in the database
+
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    for cohort_index in cohort_indices:
+        try:
+            get_qc_summary(cohorts_db, cohort_index)
+        except Exception as err:
+            cohorts_db.logger.log_message(
+                f"QC summary of cohort {cohort_index} was not built: {err}"
+            )
+
+
+def get_identifications(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str], fp_pp: str
+) -> pd.DataFrame:
+    """Number of identified proteins (fp), p-sites (pp) or peptides (otherwise) per sample"""
+    if fp_pp not in ["fp", "pp"]:
+        fp_pp = "num_pep"
+    identifications = get_qc_summary(cohorts_db, cohort_index).identifications.get(fp_pp)
+    if identifications is not None:
+        return identifications.copy()
+
+    if fp_pp == "num_pep":
+        return count_identified_peptides(cohorts_db.get_num_pep_fp(cohort_index))
+    intensity_df = _get_intensity_df_getters(cohorts_db, cohort_index)[fp_pp]()
+    return count_identifications(intensity_df, intensity_df.notna())
+
+
+def get_sum_intensities(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str], fp_pp: str
+) -> pd.DataFrame:
+    """Sum of the FP (fp) or PP (otherwise) intensities per sample"""
+    if fp_pp != "fp":
+        fp_pp = "pp"
+    intensities = get_qc_summary(cohorts_db, cohort_index).sum_intensities.get(fp_pp)
+    if intensities is not None:
+        return intensities.copy()
+    return sum_intensities(_get_intensity_df_getters(cohorts_db, cohort_index)[fp_pp]())
+
+
+def get_modification_type_counts(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str]
+) -> pd.Series:
+    counts = get_qc_summary(cohorts_db, cohort_index).modification_type_counts
+    if counts is not None:
+        return counts.copy()
+    return count_modification_types(cohorts_db.get_psite_abundance_df(cohort_index))
+
+
+def get_batch_counts(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str]
+) -> pd.DataFrame:
+    batch_counts = get_qc_summary(cohorts_db, cohort_index).batch_counts
+    if batch_counts is not None:
+        return batch_counts.copy()
+    raise ValueError(f"Batch counts of cohort {cohort_index} are not available")
+
+
+def count_identifications(
+    intensity_df: pd.DataFrame, identified_df: pd.DataFrame
+) -> pd.DataFrame:
+    identifications = pd.DataFrame(identified_df.sum())
+    identifications.columns = ["identified"]
+    identifications["patients"] = intensity_df.columns
+    return identifications
+
+
+def count_identified_peptides(num_pep_df: pd.DataFrame) -> pd.DataFrame:
+    num_pep_df = num_pep_df.copy()
+    num_pep_df.columns = num_pep_df.columns.str.replace(
+        "Identification metadata ", "", regex=True
+    )
+    identifications = pd.DataFrame(num_pep_df.sum())
+    identifications.columns = ["identified"]
+    identifications["patients"] = num_pep_df.columns
+    return identifications
+
+
+def sum_intensities(intensity_df: pd.DataFrame) -> pd.DataFrame:
+    intensities = pd.DataFrame(intensity_df.sum())
+    intensities.columns = ["sumIntensities"]
+    intensities["patients"] = intensity_df.columns
+    return intensities
+
+
+def count_modification_types(psite_df: pd.DataFrame) -> pd.Series:
+    """Number of p-sites with at least one value per type of phosphorylated residue"""
+    psites = psite_df.index[psite_df.notna().any(axis=1).to_numpy()]
+    modification_types = pd.Series(None, index=psites, dtype=object)
+    for modification, modification_type in MODIFICATION_TYPES.items():
+        modification_types[psites.str.contains(modification)] = modification_type
+    return modification_types.value_counts()
+
+
+def count_per_batch(
+    sample_annotation_df: pd.DataFrame, identified_dfs: dict
+) -> pd.DataFrame:
+    """
+    Number of samples per batch and, per data layer, the number of proteins (fp) or p-sites (pp)
+    identified in all samples of the batch, as in the batch comparison of the patient-centric tab.
+    """
+    samples_list = sample_annotation_df["Sample name"].unique().tolist()
+    batches = sample_annotation_df["Batch_No"].dropna().unique()
+    batch_counts = pd.DataFrame({"Batch_No": batches})
+    batch_samples = [
+        sample_annotation_df["Sample name"][
+            sample_annotation_df["Batch_No"].astype(str) == str(batch)
+        ].tolist()
+        for batch in batches
+    ]
+
+    for fp_pp, identified_df in identified_dfs.items():
+        sample_names = utils.intersection(samples_list, identified_df.columns)
+        identified_df = identified_df[sample_names]
+        num_samples, num_identified = [], []
+        for samples in batch_samples:
+            samples = utils.intersection(samples, identified_df.columns)
+            num_samples.append(len(samples))
+            if len(samples) == 0:
+                num_identified.append(0)
+                continue
+            identified_in_batch = identified_df[samples].to_numpy().all(axis=1)
+            num_identified.append(identified_df.index[identified_in_batch].nunique())
+        batch_counts[f"{fp_pp}_samples"] = np.array(num_samples, dtype=int)
+        batch_counts[f"{fp_pp}_identified"] = np.array(num_identified, dtype=int)
+    return batch_counts
+
+
+def _get_intensity_df_getters(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str]
+) -> dict:
+    return {
+        "fp": lambda: cohorts_db.get_protein_abundance_df(
+            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
+        ),
+        "pp": lambda: cohorts_db.get_psite_abundance_df(
+            cohort_index, intensity_unit=utils.IntensityUnit.INTENSITY
+        ),
+    }
+
+
+def _try_compute(compute_func: Callable):
+    try:
+        return compute_func()
+    except Exception:
+        return None
+
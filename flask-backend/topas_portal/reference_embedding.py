@@ -0,0 +1,145 @@
+"""
+Reference embeddings: a dimensionality reduction model (scaling, imputation, loadings or
+the UMAP/PHATE model) fitted once on all patients of a cohort layer. New batches or
+selected patients are projected into the reference with `transform` instead of refitting,
+so their coordinates are comparable between requests and reloads of the cohort.
+
+Reference models are kept in memory and persisted to
+PORTAL_CACHE_DIR/<cohort name>/reference_models. Unlike the embedding cache, they are not
+dropped when the data changes, they are only replaced when they are refitted explicitly.
+"""
+
+import hashlib
+import os
+import time
+from typing import Callable, Hashable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from logger import CohortLogger
+from topas_portal import settings
+from topas_portal import result_cache
+from topas_portal.dimensionality_reduction import (
+    CohortDimensionalityReduction,
+    get_dimensionality_reduction_method,
+)
+from topas_portal.result_cache import CohortResultCache
+
+REFERENCE_MODEL_DIR = "reference_models"
+
+reference_models_cache = CohortResultCache("reference_models", max_entries=16)
+
+
+class ReferenceModel:
+    """Dimensionality reduction model fitted on the samples x features matrix of a cohort layer"""
+
+    def __init__(
+        self,
+        method_name: str,
+        features: pd.Index,
+        samples: pd.Index,
+        model: CohortDimensionalityReduction,
+        explained_variances: Optional[List[float]],
+        component_ranges: List[Tuple[float, float]],
+        data_fingerprint: str = "",
+    ):
+        self.method_name = method_name
+        self.features = features
+        self.samples = samples
+        self.model = model
+        self.explained_variances = explained_variances
+        # (min, max) of each component over the reference samples, to scale projections consistently
+        self.component_ranges = component_ranges
+        self.data_fingerprint = data_fingerprint
+        self.fitted = time.time()
+
+    @classmethod
+    def fit(
+        cls, expression_df: pd.DataFrame, method_name: str, data_fingerprint: str = ""
+    ) -> "ReferenceModel":
+        model = get_dimensionality_reduction_method(method_name)
+        transformed_df = model.fit_transform(expression_df)
+        component_ranges = [
+            (float(transformed_df[column].min()), float(transformed_df[column].max()))
+            for column in transformed_df.columns
+        ]
+        explained_variances = model.get_explained_variances()
+        if explained_variances is not None:
+            explained_variances = list(explained_variances)
+        return cls(
+            method_name.lower(),
+            expression_df.columns,
+            expression_df.index,
+            model,
+            explained_variances,
+            component_ranges,
+            data_fingerprint,
+        )
+
+    def project(self, expression_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Embeds the samples of expression_df (samples x features). Features that are not in
+        the reference are ignored, reference features missing in expression_df are imputed
+        like missing values.
+        """
+        aligned_df = expression_df.reindex(columns=self.features)
+        transformed_df = self.model.transform(aligned_df)
+        transformed_df.index = expression_df.index
+        return transformed_df
+
+    def get_info(self):
+        return {
+            "method": self.method_name,
+            "numSamples": len(self.samples),
+            "numFeatures": len(self.features),
+            "fitted": self.fitted,
+            "dataFingerprint": self.data_fingerprint,
+        }
+
+
+def get_reference_model(
+    cohort_index: Union[int, str],
+    cohort_name: str,
+    key: Hashable,
+    method_name: str,
+    get_expression_df: Callable[[], pd.DataFrame],
+    logger: CohortLogger,
+    refit: bool = False,
+    cache_dir: Union[str, os.PathLike] = settings.PORTAL_CACHE_DIR,
+) -> ReferenceModel:
+    """
+    Returns the reference model for `key` (layer and parameters) and method, loading it from
+    memory or disk. The model is fitted on get_expression_df() if it does not exist yet or
+    if refit is True.
+    """
+    model_key = _get_reference_model_key(key, method_name)
+    model_file = result_cache.get_persisted_file(
+        cache_dir, cohort_name, REFERENCE_MODEL_DIR, model_key
+    )
+
+    def fit_and_store() -> ReferenceModel:
+        reference_model = ReferenceModel.fit(
+            get_expression_df(),
+            method_name,
+            result_cache.get_data_fingerprint(cohort_index),
+        )
+        result_cache.persist_result(reference_model, model_file, logger)
+        return reference_model
+
+    if refit:
+        reference_model = fit_and_store()
+        reference_models_cache.put(cohort_index, model_key, reference_model)
+        return reference_model
+
+    def load_or_fit() -> ReferenceModel:
+        reference_model = result_cache.load_persisted_result(model_file, logger)
+        if reference_model is not None:
+            return reference_model
+        return fit_and_store()
+
+    return reference_models_cache.get_or_compute(cohort_index, model_key, load_or_fit)
+
+
+def _get_reference_model_key(key: Hashable, method_name: str) -> str:
+    return hashlib.sha1(repr((key, method_name.lower())).encode("utf-8")).hexdigest()[:16]
+
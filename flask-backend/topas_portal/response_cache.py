@@ -0,0 +1,192 @@
+"""
+Cache for the responses of expensive routes (correlations, PCA/UMAP, differential
+expression, ...). Responses are stored with Flask-Caching in a FileSystemCache, such
+that they are shared by all gunicorn workers and survive restarts.
+
+The cache key combines the route, the query arguments, the fingerprint of the files
+the cohort was loaded from and the version of the code, so responses computed from
+outdated data or by an older deployment are never served. The same key is sent as ETag,
+such that clients can revalidate without a recomputation.
+"""
+
+import functools
+import glob
+import hashlib
+import os
+import threading
+from typing import Dict, Union
+
+from flask import Response, current_app, make_response, request
+from flask_caching import Cache
+
+from topas_portal import settings
+from topas_portal import result_cache
+
+cache = Cache()
+
+# headers of a response that are stored together with its body
+CACHED_HEADERS = ["Content-Type", "Content-Disposition", "X-Total-Count"]
+
+# views return error messages as plain strings, which Flask sends as text/html
+UNCACHED_MIMETYPES = ["text/html"]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def get_request_fingerprint(view_kwargs: Dict) -> str:
+    """
+    Hash of the route, query arguments and the fingerprint of the loaded cohort data, used
+    as cache key and strong ETag. Empty if the data of the cohort is not loaded (yet).
+    """
+    cohort_index = view_kwargs.get("cohort_index", view_kwargs.get("cohort_ind"))
+    data_fingerprint = result_cache.get_data_fingerprint(cohort_index)
+    if not data_fingerprint:
+        return ""
+
+    fingerprint = hashlib.sha1(request.path.encode("utf-8"))
+    for arg, values in sorted(request.args.lists()):
+        fingerprint.update(f"&{arg}={','.join(values)}".encode("utf-8"))
+    fingerprint.update(
+        f"|{request.headers.get('Accept', '')}|{data_fingerprint}|{get_code_version()}".encode(
+            "utf-8"
+        )
+    )
+    return fingerprint.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_version() -> str:
+    """
+    PORTAL_CODE_VERSION or a hash of the backend source files, such that a deployment with a
+    different response format does not serve the responses and ETags of the previous one.
+    """
+    if settings.PORTAL_CODE_VERSION:
+        return settings.PORTAL_CODE_VERSION
+
+    source_files = glob.glob(os.path.join(BACKEND_DIR, "*.py"))
+    for package in ["topas_portal", "compartments"]:
+        source_files += glob.glob(os.path.join(BACKEND_DIR, package, "**", "*.py"), recursive=True)
+    code_version = hashlib.sha1()
+    for source_file in sorted(source_files):
+        code_version.update(os.path.relpath(source_file, BACKEND_DIR).encode("utf-8"))
+        with open(source_file, "rb") as f:
+            code_version.update(f.read())
+    return code_version.hexdigest()[:16]
+
+
+def make_response_cache_key(view_kwargs: Dict) -> str:
+    """Cache key of the current request, empty if the data of the cohort is not loaded."""
+    fingerprint = get_request_fingerprint(view_kwargs)
+    return f"response/{fingerprint}" if fingerprint else ""
+
+
+def conditional_response(view):
+    """
+    Adds a strong ETag to successful responses of a view and answers requests with a
+    matching If-None-Match header with 304 Not Modified, without calling the view.
+    Must be placed below @app.route.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = get_request_fingerprint(kwargs)
+        if not etag:
+            return view(*args, **kwargs)
+
+        not_modified_response = _get_not_modified_response(etag)
+        if not_modified_response is not None:
+            return not_modified_response
+        return _add_etag(make_response(view(*args, **kwargs)), etag)
+
+    return wrapper
+
+
+def cached_response(view):
+    """
+    Caches successful responses of a view and adds ETags like `conditional_response`.
+    Responses with an error status or an error message as plain string are not cached.
+    Must be placed below @app.route, otherwise the route is registered without the cache.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        fingerprint = get_request_fingerprint(kwargs)
+        if not fingerprint:
+            return view(*args, **kwargs)
+
+        not_modified_response = _get_not_modified_response(fingerprint)
+        if not_modified_response is not None:
+            return not_modified_response
+
+        cache_key = f"response/{fingerprint}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            _count("hits")
+            body, status, headers = cached
+            return _add_etag(Response(body, status=status, headers=headers), fingerprint)
+
+        _count("misses")
+        response = make_response(view(*args, **kwargs))
+        if _is_cacheable(response):
+            headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+            cache.set(cache_key, (response.get_data(), response.status_code, headers))
+        return _add_etag(response, fingerprint)
+
+    return wrapper
+
+
+def _is_cacheable(response: Response) -> bool:
+    return (
+        response.status_code == 200
+        and not response.is_streamed
+        and response.mimetype not in UNCACHED_MIMETYPES
+    )
+
+
+def _get_not_modified_response(etag: str) -> Union[Response, None]:
+    if request.method not in ["GET", "HEAD"]:
+        return None
+    # Flask-Compress appends the encoding to the ETag of compressed responses, e.g. "<etag>:gzip"
+    for client_etag in request.if_none_match.as_set(include_weak=True):
+        if client_etag.split(":")[0] == etag:
+            response = Response(status=304)
+            response.set_etag(client_etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+    return None
+
+
+def _add_etag(response: Response, etag: str) -> Response:
+    if response.status_code == 200:
+        response.set_etag(etag)
+        # browsers have to revalidate, the ETag changes when the data is reloaded
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept")
+    return response
+
+
+def get_stats() -> Dict[str, int]:
+    """
+    Hits and misses of this worker process and the number of files in the response cache
+    directory of all workers, the cached responses and the file count of the cache itself.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["pid"] = os.getpid()
+    stats["files"] = _count_files(current_app.config.get("CACHE_DIR"))
+    return stats
+
+
+def _count_files(cache_dir: Union[str, None]) -> Union[int, None]:
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return None
+    with os.scandir(cache_dir) as entries:
+        return sum(1 for entry in entries if entry.is_file())
+
+
+def _count(event: str):
+    with _stats_lock:
+        _stats[event] += 1
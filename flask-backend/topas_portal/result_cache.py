@@ -0,0 +1,315 @@
+"""
+In-process caches for results derived from the loaded cohort data, e.g. scores
+of user-defined signatures. Every cache registers itself in this module so that
+reloading a cohort drops all entries that were computed from the old data.
+
+Expensive results can also be persisted to PORTAL_CACHE_DIR/<cohort name>/<result dir>,
+such that they survive restarts and are shared by all gunicorn workers. Their file names
+start with the fingerprint of the data they were computed from.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import pickle
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from config import CohortConfig
+    from logger import CohortLogger
+
+# key used for results that do not belong to a single cohort (FPKM, genomics, ...)
+GLOBAL_KEY = "global"
+
+_ALL_CACHES = weakref.WeakSet()
+
+# incremented on every invalidation, results computed from older data must not be stored
+_DATA_VERSIONS = {GLOBAL_KEY: 0}
+_DATA_VERSIONS_LOCK = threading.Lock()
+
+PERSISTED_FILE_SUFFIX = ".pkl"
+
+# fingerprints of the input files of the loaded data, identical for all processes that
+# loaded the same files, unlike the data versions which are counted per process
+_DATA_FINGERPRINTS = {}
+
+
+class CohortResultCache:
+    """
+    Least-recently-used cache of derived results, grouped per cohort. If max_bytes is given,
+    the entries are also evicted once the sum of their sizes (size_func) exceeds it, the most
+    recent entry is always kept.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 128,
+        max_bytes: Optional[int] = None,
+        size_func: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._size_func = size_func
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+        _ALL_CACHES.add(self)
+
+    def get_or_compute(
+        self,
+        cohort_index: Union[int, str, None],
+        key: Hashable,
+        compute_func: Callable[[], Any],
+    ) -> Any:
+        """Returns the cached result for (cohort_index, key) or computes and stores it."""
+        cache_key = (_normalize_cohort_index(cohort_index), key)
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+
+        # computed outside the lock, concurrent misses at worst compute the same result twice
+        data_version = get_data_version(cohort_index)
+        result = compute_func()
+        with self._lock:
+            # results of data that was reloaded during the computation are not stored
+            if data_version != get_data_version(cohort_index):
+                return result
+            self._store(cache_key, result)
+        return result
+
+    def get(self, cohort_index: Union[int, str, None], key: Hashable, default: Any = None) -> Any:
+        cache_key = (_normalize_cohort_index(cohort_index), key)
+        with self._lock:
+            if cache_key not in self._entries:
+                return default
+            self._entries.move_to_end(cache_key)
+            return self._entries[cache_key]
+
+    def put(
+        self,
+        cohort_index: Union[int, str, None],
+        key: Hashable,
+        value: Any,
+        data_version: Union[int, None] = None,
+    ) -> bool:
+        """
+        Stores a result computed outside of `get_or_compute`, e.g. in a background thread.
+        If data_version is given, the result is dropped if the cohort was reloaded in the meantime.
+        """
+        cache_key = (_normalize_cohort_index(cohort_index), key)
+        with self._lock:
+            if data_version is not None and data_version != get_data_version(cohort_index):
+                return False
+            self._store(cache_key, value)
+        return True
+
+    def invalidate(self, cohort_index: Union[int, str, None] = None):
+        """Drops the entries of a single cohort, or all entries if cohort_index is None."""
+        with self._lock:
+            if cohort_index is None:
+                self._entries.clear()
+                self._sizes.clear()
+                self._num_bytes = 0
+                return
+            cohort_key = _normalize_cohort_index(cohort_index)
+            for cache_key in [k for k in self._entries if k[0] == cohort_key]:
+                self._remove(cache_key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def num_bytes(self) -> int:
+        """Sum of the sizes of the entries, 0 without size_func"""
+        return self._num_bytes
+
+    def _store(self, cache_key: Hashable, value: Any):
+        """Adds or replaces an entry and evicts the least recently used ones, under self._lock"""
+        if cache_key in self._entries:
+            self._remove(cache_key)
+        self._entries[cache_key] = value
+        if self._size_func is not None:
+            self._sizes[cache_key] = self._size_func(value)
+            self._num_bytes += self._sizes[cache_key]
+
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None
+            and self._num_bytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, cache_key: Hashable):
+        del self._entries[cache_key]
+        self._num_bytes -= self._sizes.pop(cache_key, 0)
+
+
+def _reinit_locks_after_fork():
+    """
+    A forked process only inherits the thread that forked it, locks held by other threads of
+    the parent (e.g. a request thread computing a result) would never be released in the child.
+    """
+    global _DATA_VERSIONS_LOCK
+    _DATA_VERSIONS_LOCK = threading.Lock()
+    for cache in list(_ALL_CACHES):
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_locks_after_fork)
+
+
+def invalidate_cohort(cohort_index: Union[int, str, None] = None):
+    """Invalidates all registered caches for a cohort, or completely if cohort_index is None."""
+    cohort_key = _normalize_cohort_index(cohort_index)
+    with _DATA_VERSIONS_LOCK:
+        _DATA_VERSIONS[cohort_key] = _DATA_VERSIONS.get(cohort_key, 0) + 1
+    for cache in list(_ALL_CACHES):
+        cache.invalidate(cohort_index)
+
+
+def get_data_version(cohort_index: Union[int, str, None] = None) -> int:
+    """Changes whenever the data of the cohort, or data shared by all cohorts, is reloaded."""
+    with _DATA_VERSIONS_LOCK:
+        version = _DATA_VERSIONS[GLOBAL_KEY]
+        if cohort_index is not None:
+            version += _DATA_VERSIONS.get(_normalize_cohort_index(cohort_index), 0)
+        return version
+
+
+def set_data_fingerprint(cohort_index: Union[int, str, None], fingerprint: str):
+    """Records the fingerprint of the files the cohort (or the shared data if None) was loaded from."""
+    with _DATA_VERSIONS_LOCK:
+        _DATA_FINGERPRINTS[_normalize_cohort_index(cohort_index)] = fingerprint
+
+
+def get_data_fingerprint(cohort_index: Union[int, str, None] = None) -> str:
+    """
+    Fingerprint of the loaded data of the cohort and of the data shared by all cohorts,
+    empty as long as this data was not loaded completely.
+    """
+    keys = [GLOBAL_KEY]
+    if cohort_index is not None:
+        keys.append(_normalize_cohort_index(cohort_index))
+    with _DATA_VERSIONS_LOCK:
+        fingerprints = [_DATA_FINGERPRINTS.get(key, "") for key in keys]
+    if not all(fingerprints):
+        return ""
+    return "-".join(fingerprints)
+
+
+def get_files_fingerprint(paths: List[Union[str, None]], extra: str = "") -> str:
+    """Hash of the modification times and sizes of the files, directories are included recursively."""
+    fingerprint = hashlib.sha1(extra.encode("utf-8"))
+    for path in paths:
+        if not path or not os.path.exists(path):
+            fingerprint.update(f"{path}:missing".encode("utf-8"))
+            continue
+        file_paths = [path]
+        if os.path.isdir(path):
+            file_paths = sorted(
+                os.path.join(root, file_name)
+                for root, _, file_names in os.walk(path)
+                for file_name in file_names
+            )
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            fingerprint.update(
+                f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8")
+            )
+    return fingerprint.hexdigest()[:16]
+
+
+def get_cohort_name(
+    config: CohortConfig, cohort_index: Union[int, str, None]
+) -> Optional[str]:
+    """Name of the cohort of the persisted results, None for unknown cohorts or shared data"""
+    if cohort_index is None or not 0 <= int(cohort_index) < len(config.cohort_names):
+        return None
+    return config.cohort_names[int(cohort_index)]
+
+
+def get_persisted_file(
+    cache_dir: Union[str, os.PathLike], cohort_name: str, result_dir: str, file_name: str
+) -> str:
+    return os.path.join(
+        cache_dir, cohort_name, result_dir, f"{file_name}{PERSISTED_FILE_SUFFIX}"
+    )
+
+
+def load_persisted_result(result_file: str, logger: CohortLogger) -> Any:
+    """Unpickles a persisted result, None if it was not persisted or cannot be read."""
+    if not os.path.exists(result_file):
+        return None
+    try:
+        with open(result_file, "rb") as f:
+            return pickle.load(f)
+    except Exception as err:
+        # e.g. results pickled by an older version of their classes
+        logger.log_message(f"Could not read the persisted result {result_file}: {err}")
+    return None
+
+
+def persist_result(
+    result: Any,
+    result_file: str,
+    logger: CohortLogger,
+    data_fingerprint: Optional[str] = None,
+    max_files: Optional[int] = None,
+):
+    """
+    Pickles the result through a temporary file, such that other workers never read a partial
+    file. If data_fingerprint is given, the results of other data in the same directory are
+    removed, as are the oldest results beyond max_files. The result stays in memory only if
+    writing fails.
+    """
+    result_dir = os.path.dirname(result_file)
+    try:
+        os.makedirs(result_dir, exist_ok=True)
+        if data_fingerprint is not None:
+            _remove_outdated_files(result_dir, data_fingerprint, max_files)
+
+        tmp_file = f"{result_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, result_file)
+    except OSError as err:
+        logger.log_message(f"Could not persist the result {result_file}: {err}")
+
+
+def _remove_outdated_files(result_dir: str, data_fingerprint: str, max_files: Optional[int]):
+    """
+    Results of other data are removed, results of data_fingerprint are named
+    <data_fingerprint>.pkl or <data_fingerprint>_<key>.pkl. Leaves room for one more result.
+    """
+    persisted_files = sorted(
+        glob.glob(os.path.join(result_dir, f"*{PERSISTED_FILE_SUFFIX}")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    current_files = [
+        f
+        for f in persisted_files
+        if os.path.basename(f).startswith(f"{data_fingerprint}_")
+        or os.path.basename(f) == f"{data_fingerprint}{PERSISTED_FILE_SUFFIX}"
+    ]
+    outdated_files = [f for f in persisted_files if f not in current_files]
+    if max_files is not None:
+        outdated_files += current_files[max_files - 1 :]
+    for outdated_file in outdated_files:
+        os.remove(outdated_file)
+
+
+def _normalize_cohort_index(cohort_index: Union[int, str, None]):
+    if cohort_index is None:
+        return GLOBAL_KEY
+    return int(cohort_index)
@@ -0,0 +1,140 @@
+"""
+Paging, sorting and filtering of large result tables (correlations, differential
+expression). The full result is computed once and cached, each request only returns
+the requested page, with the number of rows that passed the filters in X-Total-Count.
+"""
+
+from typing import Dict, Optional
+
+import pandas as pd
+from flask import Response
+
+from topas_portal import utils
+
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+class InvalidResultTableQueryError(ValueError):
+    """Paging, sort or filter arguments that do not apply to the result table"""
+
+
+class ResultTableQuery:
+    """
+    Page, sort order and filter thresholds requested for a result table.
+
+    The thresholds refer to the columns given by `column_names` in `apply`, e.g.
+    {"p_value": "p-value", "fdr": "FDR", "correlation": "correlation"}.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        sort_by: Optional[str] = None,
+        ascending: bool = True,
+        max_p_value: Optional[float] = None,
+        max_fdr: Optional[float] = None,
+        min_abs_correlation: Optional[float] = None,
+        min_abs_fold_change: Optional[float] = None,
+    ):
+        if limit is not None and limit < 0:
+            raise InvalidResultTableQueryError(f"limit must not be negative, got {limit}")
+        if offset < 0:
+            raise InvalidResultTableQueryError(f"offset must not be negative, got {offset}")
+        self.limit = limit
+        self.offset = offset
+        self.sort_by = sort_by
+        self.ascending = ascending
+        self.max_p_value = max_p_value
+        self.max_fdr = max_fdr
+        self.min_abs_correlation = min_abs_correlation
+        self.min_abs_fold_change = min_abs_fold_change
+
+    @classmethod
+    def from_request_args(cls, args) -> "ResultTableQuery":
+        """
+        Reads the query from the query arguments of a request, e.g.
+        ?limit=200&offset=0&sort=FDR&order=asc&max_pvalue=0.05&max_fdr=0.01&min_abs_r=0.3&min_abs_fc=1
+        """
+        return cls(
+            limit=args.get("limit", type=int),
+            offset=args.get("offset", default=0, type=int),
+            sort_by=args.get("sort"),
+            ascending=args.get("order", default="asc") != "desc",
+            max_p_value=args.get("max_pvalue", type=float),
+            max_fdr=args.get("max_fdr", type=float),
+            min_abs_correlation=args.get("min_abs_r", type=float),
+            min_abs_fold_change=args.get("min_abs_fc", type=float),
+        )
+
+    def is_empty(self) -> bool:
+        return (
+            self.limit is None
+            and self.offset == 0
+            and self.sort_by is None
+            and self._get_filters() == []
+        )
+
+    def filter(self, df: pd.DataFrame, column_names: Dict[str, str]) -> pd.DataFrame:
+        keep = pd.Series(True, index=df.index)
+        for column_key, threshold, is_max, use_abs in self._get_filters():
+            if column_key not in column_names:
+                raise InvalidResultTableQueryError(f"Result table cannot be filtered by {column_key}")
+            values = pd.to_numeric(df[column_names[column_key]], errors="coerce")
+            if use_abs:
+                values = values.abs()
+            keep &= values <= threshold if is_max else values >= threshold
+        if keep.all():
+            return df
+        return df[keep]
+
+    def apply(self, df: pd.DataFrame, column_names: Dict[str, str]) -> pd.DataFrame:
+        """Filtered, sorted and paged copy of the result table, df itself is not modified."""
+        return self.sort_and_page(self.filter(df, column_names))
+
+    def sort_and_page(self, df: pd.DataFrame) -> pd.DataFrame:
+        end = None if self.limit is None else self.offset + self.limit
+        if self.sort_by is not None:
+            if self.sort_by not in df.columns:
+                raise InvalidResultTableQueryError(f"Result table has no column {self.sort_by}")
+            values = df[self.sort_by]
+            if (
+                end is not None
+                and end < len(df.index)
+                and pd.api.types.is_numeric_dtype(values)
+                and not values.isna().any()
+            ):
+                # partial sort, only the rows up to the end of the page are needed
+                select_rows = df.nsmallest if self.ascending else df.nlargest
+                df = select_rows(end, self.sort_by, keep="first")
+            else:
+                df = df.sort_values(
+                    self.sort_by, ascending=self.ascending, kind="mergesort"
+                )
+        return df.iloc[self.offset : end]
+
+    def _get_filters(self):
+        filters = [
+            ("p_value", self.max_p_value, True, False),
+            ("fdr", self.max_fdr, True, False),
+            ("correlation", self.min_abs_correlation, False, True),
+            ("fold_change", self.min_abs_fold_change, False, True),
+        ]
+        return [f for f in filters if f[1] is not None]
+
+
+def result_table_to_json(
+    df: pd.DataFrame,
+    query: Optional[ResultTableQuery],
+    column_names: Dict[str, str],
+) -> Response:
+    """JSON response with the requested page of the result table and the number of matching rows."""
+    if query is None or query.is_empty():
+        response = utils.df_to_json(df)
+        response.headers[TOTAL_COUNT_HEADER] = str(len(df.index))
+        return response
+
+    filtered_df = query.filter(df, column_names)
+    response = utils.df_to_json(query.sort_and_page(filtered_df))
+    response.headers[TOTAL_COUNT_HEADER] = str(len(filtered_df.index))
+    return response
@@ -22,6 +22,9 @@ class ApiRoutes(str, Enum):
 
     PATIENT_REPORT_TABLE = "/<int:cohort_index>/patient_reports/<string:patient>/<data_type:level>/<string:downloadmethod>"
     PATIENT_REPORT_TABLE_XLSX = "/<int:cohort_index>/patient_reports/<string:patients>"
+    PATIENT_REPORT_TABLE_BATCH = "/<int:cohort_index>/patient_reports_batch/<data_type:level>/<string:patients>"
+    PATIENT_REPORT_STORE_STATUS = "/<int:cohort_index>/patient_reports_store/status"
+    PATIENT_REPORT_STORE_BUILD = "/<int:cohort_index>/patient_reports_store/build"
 
     ENTITY_STATUS = "/entityscore/status"
     CORRELATION_FPKM_PROTEIN = "/correlation/fpkmprotein/<int:cohort_index>"
@@ -48,9 +51,17 @@ class ApiRoutes(str, Enum):
     VENN_BATCH_COMPARE = (
         "/venn/<int:cohort_index>/batchcompare/<string:pp_fp>/<string:batchlists>"
     )
+    VENN_COMPARE = "/venn/<int:cohort_index>/compare/<string:pp_fp>/<string:modality>/<string:groups>"
 
     UPDATE_LOG = "/update/logs"
     ERROR_LOG = "/error/logs"
+    CACHE_STATS = "/cache/stats"
+
+    JOBS = "/jobs"
+    JOB_SUBMIT = "/jobs/submit/<string:job_type>"
+    JOB_STATUS = "/jobs/<string:job_id>"
+    JOB_RESULT = "/jobs/<string:job_id>/result"
+    JOB_CANCEL = "/jobs/<string:job_id>/cancel"
 
     PATIENT_CENTRIC_PP_INTENSITY = (
         "/patientcentric/ppintensity/<int:cohort_index>/<string:dtype>"
@@ -58,6 +69,7 @@ class ApiRoutes(str, Enum):
     PATIENT_CENTRIC_PROTEIN_COUNTS = (
         "/patientcenteric/proteincounts/<int:cohort_index>/<string:fp_pp>"
     )
+    PATIENT_CENTRIC_BATCH_COUNTS = "/patientcentric/batchcounts/<int:cohort_index>"
 
     TOPAS = "/topas/<int:cohort_index>/<string:topas_names>/<string:score_type>"
     TOPAS_ANNOTATIONS = "/topas/annotations"
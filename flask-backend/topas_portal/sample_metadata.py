@@ -0,0 +1,154 @@
+"""
+Canonical sample metadata per cohort: the sample annotation indexed by sample name and the
+patient metadata indexed by the sample name without replicate suffix (-R1, -R2, ...).
+
+It is built once after loading a cohort, such that results can be annotated by reindexing
+instead of deduplicating the metadata and stripping replicate suffixes with regular
+expressions on every request. The results are the same as for
+utils.merge_with_sample_annotation_df and utils.merge_with_patients_meta_df.
+"""
+
+# needed to prevent circular import of db.CohortDataAPI
+from __future__ import annotations
+
+from typing import List, TYPE_CHECKING, Union
+
+import pandas as pd
+
+from topas_portal.result_cache import CohortResultCache
+
+if TYPE_CHECKING:
+    import topas_portal.data_api.data_api as data_api
+
+REPLICATE_SUFFIX_REGEX = r"-R[0-9]$"
+TRUNCATED_SAMPLE_NAME = "Sample_name_rep_truncated"
+
+sample_metadata_cache = CohortResultCache("sample_metadata", max_entries=64)
+
+
+class SampleMetadata:
+    """Sample annotation and patient metadata of a cohort, indexed for joining results"""
+
+    def __init__(self, sample_annotation_df: pd.DataFrame, patients_df: pd.DataFrame):
+        self.sample_annotation_df = None
+        if isinstance(sample_annotation_df, pd.DataFrame):
+            if "Entity" in sample_annotation_df.columns:
+                sample_annotation_df = sample_annotation_df.drop("Entity", axis=1)
+            sample_annotation_df = sample_annotation_df.drop_duplicates(
+                subset="Sample name", keep="first"
+            )
+            self.sample_annotation_df = sample_annotation_df.set_index("Sample name")
+
+        self.patients_df = None
+        if isinstance(patients_df, pd.DataFrame):
+            patients_df = patients_df.drop_duplicates(subset="Sample name", keep="first")
+            if "Batch_No" in patients_df.columns:
+                patients_df = patients_df.drop(["Batch_No"], axis=1)
+            patients_df = patients_df.rename(columns={"Sample name": "patient_id"})
+            patients_df["patient_id"] = truncate_replicate_suffix(patients_df["patient_id"])
+            patients_df = patients_df.dropna(subset=["patient_id"])
+            patients_df = patients_df.drop_duplicates(subset=["patient_id"], keep="first")
+            self.patients_df = patients_df.set_index("patient_id")
+
+        self._annotated_samples_df = None
+
+        # replicate-truncated names of all known samples, unknown samples are truncated on the fly
+        known_samples = pd.Index([])
+        if self.sample_annotation_df is not None:
+            known_samples = self.sample_annotation_df.index.dropna()
+        self._truncated_sample_names = pd.Series(
+            truncate_replicate_suffix(known_samples.to_series()).to_numpy(),
+            index=known_samples,
+        )
+
+    def truncate_sample_names(self, sample_names: pd.Series) -> pd.Series:
+        truncated_names = sample_names.map(self._truncated_sample_names)
+        unknown_samples = truncated_names.isna() & sample_names.notna()
+        if unknown_samples.any():
+            truncated_names[unknown_samples] = truncate_replicate_suffix(
+                sample_names[unknown_samples]
+            )
+        return truncated_names
+
+    def merge_with_sample_annotation(self, scores_df: pd.DataFrame) -> pd.DataFrame:
+        """Same as utils.merge_with_sample_annotation_df"""
+        if self.sample_annotation_df is None or "Sample name" not in scores_df.columns:
+            return scores_df
+        annotation_df = self.sample_annotation_df.reindex(scores_df["Sample name"])
+        return _join_columns(scores_df, annotation_df)
+
+    def merge_with_patients_meta(self, scores_df: pd.DataFrame) -> pd.DataFrame:
+        """Same as utils.merge_with_patients_meta_df"""
+        if self.patients_df is None or "Sample name" not in scores_df.columns:
+            return scores_df
+
+        scores_table = scores_df.copy()
+        scores_table[TRUNCATED_SAMPLE_NAME] = self.truncate_sample_names(
+            scores_table["Sample name"]
+        )
+        scores_table = scores_table.dropna(subset=[TRUNCATED_SAMPLE_NAME])
+        if len(scores_table) == 0 or len(self.patients_df) == 0:
+            return scores_df
+        patients_df = self.patients_df.reindex(scores_table[TRUNCATED_SAMPLE_NAME])
+        return _join_columns(scores_table, patients_df)
+
+    def get_annotated_samples_df(self) -> pd.DataFrame:
+        """All samples of the sample annotation with their patient metadata, without the Entity column"""
+        if self.sample_annotation_df is None:
+            return pd.DataFrame(columns=["Sample name"])
+        if self._annotated_samples_df is None:
+            self._annotated_samples_df = self.merge_with_patients_meta(
+                self.sample_annotation_df.reset_index()
+            )
+        return self._annotated_samples_df.copy()
+
+    def merge(self, scores_df: pd.DataFrame) -> pd.DataFrame:
+        """Annotates scores_df with the sample annotation and the patient metadata"""
+        return self.merge_with_patients_meta(self.merge_with_sample_annotation(scores_df))
+
+
+def truncate_replicate_suffix(sample_names: pd.Series) -> pd.Series:
+    return sample_names.str.replace(REPLICATE_SUFFIX_REGEX, "", regex=True)
+
+
+def get_sample_metadata(
+    cohorts_db: data_api.CohortDataAPI, cohort_index: Union[int, str]
+) -> SampleMetadata:
+    return sample_metadata_cache.get_or_compute(
+        cohort_index,
+        "sample_metadata",
+        lambda: SampleMetadata(
+            cohorts_db.get_sample_annotation_df(cohort_index),
+            cohorts_db.get_patient_metadata_df(cohort_index),
+        ),
+    )
+
+
+def build_sample_metadata(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[Union[int, str]] = None
+):
+    """Builds the sample metadata of the cohorts right after loading instead of on first use."""
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    for cohort_index in cohort_indices:
+        try:
+            get_sample_metadata(cohorts_db, cohort_index)
+        except Exception as err:
+            cohorts_db.logger.log_message(
+                f"Sample metadata of cohort {cohort_index} was not built: {err}"
+            )
+
+
+def _join_columns(left_df: pd.DataFrame, right_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Row-wise join of the columns of right_df, which is aligned to the rows of left_df.
+    Columns in both frames get the suffixes _x and _y, as in a left merge.
+    """
+    common_columns = left_df.columns.intersection(right_df.columns)
+    left_df = left_df.reset_index(drop=True)
+    right_df = right_df.reset_index(drop=True)
+    if len(common_columns) > 0:
+        left_df = left_df.rename(columns={c: f"{c}_x" for c in common_columns})
+        right_df = right_df.rename(columns={c: f"{c}_y" for c in common_columns})
+    return pd.concat([left_df, right_df], axis=1)
@@ -14,6 +14,44 @@ if PORTAL_CONFIG_FILE is None:
 
 PORTAL_LOG_FILE = "record.log"
 
+# folder for derived data that is persisted across restarts, e.g. the PhosphoSitePlus annotation index,
+# flask-backend/portal_cache by default independent of the working directory (set in the Dockerfile)
+PORTAL_CACHE_DIR = os.path.abspath(
+    os.getenv(
+        "PORTAL_CACHE_DIR",
+        default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "portal_cache"),
+    )
+)
+
+# responses of expensive routes are cached in PORTAL_CACHE_DIR/responses and shared by all workers,
+# for RESPONSE_CACHE_TIMEOUT seconds (0 keeps them until the data or the code version changes)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", default=2000))
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", default=24 * 60 * 60))
+# version of the deployed code in the response cache keys and ETags, e.g. the git commit,
+# by default a hash of the backend source files
+PORTAL_CODE_VERSION = os.getenv("PORTAL_CODE_VERSION", default="")
+
+# background jobs for long-running analyses, see topas_portal/jobs.py
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", default=2))  # per worker process
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", default=4000))  # 0 means no timeout
+JOB_MAX_MEMORY_GB = float(os.getenv("JOB_MAX_MEMORY_GB", default=0))  # 0 means no limit
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", default=200))  # finished jobs kept on disk
+
+# memory of the imputed expression matrices kept for reuse by all cohorts, see topas_portal/imputation.py
+IMPUTED_MATRICES_CACHE_MAX_GB = float(os.getenv("IMPUTED_MATRICES_CACHE_MAX_GB", default=2))
+
+# maximum number of PCA/UMAP embeddings persisted per cohort, see topas_portal/embedding_cache.py
+EMBEDDING_CACHE_MAX_FILES = int(os.getenv("EMBEDDING_CACHE_MAX_FILES", default=64))
+
+# silhouette scores, see topas_portal/silhouette.py: cohorts with more samples are scored approximately,
+# with the distances to SILHOUETTE_MAX_REFERENCE_SAMPLES random samples instead of the full distance matrix
+SILHOUETTE_MAX_EXACT_SAMPLES = int(os.getenv("SILHOUETTE_MAX_EXACT_SAMPLES", default=5000))
+SILHOUETTE_MAX_REFERENCE_SAMPLES = int(os.getenv("SILHOUETTE_MAX_REFERENCE_SAMPLES", default=2000))
+SILHOUETTE_CHUNK_SIZE = int(os.getenv("SILHOUETTE_CHUNK_SIZE", default=256))  # samples scored at once
+
+# compile the numba functions of UMAP after loading the data instead of on the first UMAP request
+WARM_UP_DIMENSIONALITY_REDUCTION = os.getenv("WARM_UP_DIMENSIONALITY_REDUCTION", default="false").lower() == "true"
+
 CI_BACKEND_PORT = os.getenv("CI_BACKEND_PORT", default=3832)
 
 # the chunked data size for import to DB (10000000) was tested with 512 GB RAM
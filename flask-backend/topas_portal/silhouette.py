@@ -0,0 +1,149 @@
+"""
+Silhouette scores of the QC views for large cohorts.
+
+The scores are computed in chunks of samples, such that only chunk x samples distances are
+held besides the pairwise distance matrix, which is cached per cohort and input matrix and
+reused when the samples are grouped by another metadata column. For cohorts with more than
+SILHOUETTE_MAX_EXACT_SAMPLES samples (or if requested), the scores are approximated with the
+distances to a random subset of the samples, without computing the distance matrix.
+"""
+
+import hashlib
+from typing import List, Optional, Union
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from sklearn.metrics import pairwise_distances, pairwise_distances_chunked
+
+from topas_portal import settings
+from topas_portal import imputation
+from topas_portal.result_cache import CohortResultCache
+
+distance_matrices_cache = CohortResultCache("distance_matrices", max_entries=4)
+
+
+def get_silhouette_samples(
+    features_df: pd.DataFrame,
+    samples: List[str],
+    labels: npt.ArrayLike,
+    cohort_index: Union[int, str, None] = None,
+    approximate: Optional[bool] = None,
+) -> npt.NDArray[np.float64]:
+    """
+    Silhouette score of each of the samples, with euclidean distances between the rows of
+    features_df (samples x features) and the clusters given by labels.
+
+    Args:
+        approximate: use distances to a random subset of the samples instead of the full
+            distance matrix, by default only for more than SILHOUETTE_MAX_EXACT_SAMPLES rows.
+    """
+    features_df = features_df[~features_df.index.duplicated()]
+    positions = features_df.index.get_indexer(samples)
+    if approximate is None:
+        approximate = len(features_df.index) > settings.SILHOUETTE_MAX_EXACT_SAMPLES
+
+    if approximate:
+        x = features_df.to_numpy(dtype=np.float64)[positions]
+        reference_indices = sample_reference_indices(
+            labels, settings.SILHOUETTE_MAX_REFERENCE_SAMPLES
+        )
+        return silhouette_samples_chunked(labels, x=x, reference_indices=reference_indices)
+
+    distances = get_distance_matrix(features_df, cohort_index)
+    return silhouette_samples_chunked(labels, distances=distances[np.ix_(positions, positions)])
+
+
+def get_distance_matrix(
+    features_df: pd.DataFrame, cohort_index: Union[int, str, None] = None
+) -> npt.NDArray[np.float32]:
+    """Euclidean distances between the rows of features_df, cached per cohort and input matrix"""
+    if cohort_index is None:
+        return _compute_distance_matrix(features_df.to_numpy(dtype=np.float64))
+
+    x = np.ascontiguousarray(features_df.to_numpy(dtype=np.float64))
+    matrix_key = hashlib.sha1(x.tobytes())
+    matrix_key.update(imputation.index_fingerprint(features_df.index).encode("utf-8"))
+    matrix_key.update(str(x.shape).encode("utf-8"))
+    return distance_matrices_cache.get_or_compute(
+        cohort_index, matrix_key.hexdigest(), lambda: _compute_distance_matrix(x)
+    )
+
+
+def _compute_distance_matrix(x: npt.NDArray[np.float64]) -> npt.NDArray[np.float32]:
+    distances = np.empty((x.shape[0], x.shape[0]), dtype=np.float32)
+    start = 0
+    for distances_chunk in pairwise_distances_chunked(x):
+        distances[start : start + len(distances_chunk)] = distances_chunk
+        start += len(distances_chunk)
+    return distances
+
+
+def sample_reference_indices(
+    labels: npt.ArrayLike, max_reference_samples: int, random_state: int = 42
+) -> npt.NDArray[np.int64]:
+    """Random subset of the samples, with at least two samples of every cluster if possible"""
+    codes, _ = pd.factorize(np.asarray(labels))
+    if len(codes) <= max_reference_samples:
+        return np.arange(len(codes))
+
+    rng = np.random.default_rng(random_state)
+    reference_indices = rng.choice(len(codes), max_reference_samples, replace=False)
+    first_of_each_cluster = pd.Series(np.arange(len(codes))).groupby(codes).head(2)
+    return np.union1d(reference_indices, first_of_each_cluster.to_numpy())
+
+
+def silhouette_samples_chunked(
+    labels: npt.ArrayLike,
+    distances: Optional[npt.NDArray] = None,
+    x: Optional[npt.NDArray[np.float64]] = None,
+    reference_indices: Optional[npt.NDArray[np.int64]] = None,
+    chunk_size: Optional[int] = None,
+) -> npt.NDArray[np.float64]:
+    """
+    Same as sklearn.metrics.silhouette_samples, but computed in chunks of samples from either
+    the distance matrix or the feature matrix x. The mean distances to the clusters are taken
+    over the reference samples only, all samples by default.
+    """
+    codes, uniques = pd.factorize(np.asarray(labels))
+    num_samples = len(codes)
+    if not 2 <= len(uniques) <= num_samples - 1:
+        raise ValueError(
+            f"Number of labels is {len(uniques)}. Valid values are 2 to n_samples - 1 (inclusive)"
+        )
+    if reference_indices is None:
+        reference_indices = np.arange(num_samples)
+    chunk_size = chunk_size or settings.SILHOUETTE_CHUNK_SIZE
+
+    # samples x clusters membership of the reference samples
+    reference_membership = np.zeros((len(reference_indices), len(uniques)))
+    reference_membership[np.arange(len(reference_indices)), codes[reference_indices]] = 1
+    reference_counts = reference_membership.sum(axis=0)
+    is_reference = np.zeros(num_samples, dtype=bool)
+    is_reference[reference_indices] = True
+    cluster_sizes = np.bincount(codes)
+
+    scores = np.zeros(num_samples)
+    for start in range(0, num_samples, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, num_samples))
+        if distances is not None:
+            chunk_distances = distances[rows][:, reference_indices]
+        else:
+            chunk_distances = pairwise_distances(x[rows], x[reference_indices])
+
+        own_clusters = codes[rows]
+        counts = np.tile(reference_counts, (len(rows), 1))
+        # the distance of a sample to itself is 0, but it must not be counted as a member
+        counts[np.arange(len(rows)), own_clusters] -= is_reference[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_distances = (chunk_distances @ reference_membership) / counts
+            intra = mean_distances[np.arange(len(rows)), own_clusters]
+            mean_distances[np.arange(len(rows)), own_clusters] = np.inf
+            mean_distances[counts == 0] = np.inf
+            inter = mean_distances.min(axis=1)
+            chunk_scores = (inter - intra) / np.maximum(intra, inter)
+
+        undefined = (cluster_sizes[own_clusters] == 1) | ~np.isfinite(intra)
+        chunk_scores[undefined] = 0
+        scores[rows] = np.nan_to_num(chunk_scores)
+    return scores
@@ -1,20 +1,27 @@
 # needed to prevent circular import of db.CohortDataAPI
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import Dict, List, TYPE_CHECKING, Union
 
+import numpy as np
 import pandas as pd
 
 import topas_portal.genomics_preprocess as gp
 from topas_portal import settings
 from topas_portal import utils
+from topas_portal import sample_metadata
 import topas_portal.topas_scores_meta as topas
 import topas_portal.IFN_topas_scoring as topas_scoring
 import topas_portal.file_loaders.topas as topas_loader
+from topas_portal.result_cache import CohortResultCache
 
 if TYPE_CHECKING:
     import topas_portal.data_api.data_api as data_api
 
+TOPAS_SCORES_LONG_UNITS = [utils.IntensityUnit.SCORE, utils.IntensityUnit.Z_SCORE]
+
+topas_scores_long_cache = CohortResultCache("topas_scores_long")
+
 
 def get_topas_weights(topas_annotations_df: pd.DataFrame) -> pd.DataFrame:
     """Returns a DataFrame with gene weights (not p-sites!) for all topass.
@@ -37,30 +44,27 @@ def get_topas_weights(topas_annotations_df: pd.DataFrame) -> pd.DataFrame:
 
 def _merge_topass_with_metadata(
     topas_df: pd.DataFrame,
-    sample_annotation_df: pd.DataFrame,
-    patients_df: pd.DataFrame,
+    cohort_sample_metadata: sample_metadata.SampleMetadata,
 ):
     """
     Merges topas data with sample annotation and patient metadata, and fills missing patient-related values.
 
     Args:
         topas_df (pd.DataFrame): The DataFrame containing the topas data (e.g., gene or protein measurements).
-        sample_annotation_df (pd.DataFrame): The DataFrame containing the sample annotation (e.g., sample names and groupings).
-        patients_df (pd.DataFrame): The DataFrame containing patient metadata (e.g., clinical data).
+        cohort_sample_metadata (SampleMetadata): The sample annotation (e.g., sample names and groupings) and patient metadata (e.g., clinical data) of the cohort.
 
     Returns:
         pd.DataFrame: The merged DataFrame containing topas data enriched with sample annotation and patient metadata.
     
     Notes:
-        - Merges `topas_df` with `sample_annotation_df` based on sample identifiers.
-        - Enriches the merged DataFrame with patient metadata from `patients_df`.
+        - Merges `topas_df` with the sample annotation based on sample identifiers.
+        - Enriches the merged DataFrame with the patient metadata.
         - Fills missing values in patient-related columns in the resulting DataFrame.
     
     Example:
-        merged_df = _merge_topass_with_metadata(topas_df, sample_annotation_df, patients_df)
+        merged_df = _merge_topass_with_metadata(topas_df, sample_metadata.get_sample_metadata(cohorts_db, cohort_index))
     """
-    topas_df = utils.merge_with_sample_annotation_df(topas_df, sample_annotation_df)
-    topas_df = utils.merge_with_patients_meta_df(topas_df, patients_df)
+    topas_df = cohort_sample_metadata.merge(topas_df)
     topas_df = utils.fill_nans_patient_columns(topas_df)
     return topas_df
 
@@ -80,15 +84,13 @@ def get_topas_subscore_data(
         dict: A dictionary containing the sub-topas data in JSON format.
 
     Notes:
-        - Retrieves the report directory for the given cohort.
-        - Loads the sub-topas data table corresponding to the provided topas name.
+        - Takes the sub-topas data table of the provided topas name loaded with the cohort.
         - Strips leading/trailing whitespace and removes tab characters from the "topas" column.
     
     Example:
         topas_subscore_data = get_topas_subscore_data(cohorts_db, "1", "topas_name")
     """
-    report_dir = cohorts_db.config.get_report_directory(cohort_index)
-    topas_sub_df = topas_loader.load_topas_subscore_table(report_dir, topasname)
+    topas_sub_df = cohorts_db.get_topas_subscore_df(cohort_index, topasname)
     topas_sub_df["topas"].str.replace("\t", "")
     topas_sub_df["topas"].str.strip()
     return utils.df_to_json(topas_sub_df)
@@ -161,9 +163,7 @@ def get_topas_data(
     )
 
     topas_subset_df = _merge_topass_with_metadata(
-        topas_subset_df,
-        cohorts_db.get_sample_annotation_df(cohort_index),
-        cohorts_db.get_patient_metadata_df(cohort_index),
+        topas_subset_df, sample_metadata.get_sample_metadata(cohorts_db, cohort_index)
     )
     selected_columns = utils.intersection(settings.TOPAS_META_DATA, topas_subset_df.columns)
     topas_subset_df = topas_subset_df[selected_columns]
@@ -226,6 +226,68 @@ def get_topas_scores_long_format(topas_scores_df: pd.DataFrame) -> pd.DataFrame:
     return topas_scores_long
 
 
+class TopasScoresLongFormat:
+    """
+    Topas scores of a cohort in long format (see `get_topas_scores_long_format`) together
+    with the row positions of each sample, such that the scores of a patient are sliced
+    without scanning the whole table.
+    """
+
+    def __init__(self, topas_scores_df: pd.DataFrame):
+        self.df = get_topas_scores_long_format(topas_scores_df)
+        sample_codes, sample_names = pd.factorize(self.df["Sample name"])
+        sample_order = np.argsort(sample_codes, kind="stable")
+        bounds = np.searchsorted(sample_codes[sample_order], np.arange(len(sample_names) + 1))
+        self._sample_rows: Dict[str, np.ndarray] = {
+            sample_name: sample_order[bounds[i] : bounds[i + 1]]
+            for i, sample_name in enumerate(sample_names)
+        }
+
+    def get_sample(self, sample_name: str) -> pd.DataFrame:
+        """Rows of a single sample in the original order of the long format table."""
+        rows = self._sample_rows.get(str(sample_name), np.array([], dtype=np.intp))
+        return self.df.take(rows)
+
+
+def get_topas_scores_long_df(
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: str,
+    intensity_unit: utils.IntensityUnit,
+    patient_name: str = None,
+) -> pd.DataFrame:
+    """
+    Returns the topas scores of a cohort in long format, optionally only for a single patient.
+    The long format is built once per cohort and intensity unit and must not be modified.
+    """
+    topas_scores_long = topas_scores_long_cache.get_or_compute(
+        cohort_index,
+        intensity_unit,
+        lambda: TopasScoresLongFormat(
+            cohorts_db.get_topas_scores_df(cohort_index, intensity_unit)
+        ),
+    )
+    if patient_name is not None:
+        return topas_scores_long.get_sample(patient_name)
+    return topas_scores_long.df
+
+
+def build_topas_scores_long_formats(
+    cohorts_db: data_api.CohortDataAPI, cohort_indices: List[Union[int, str]] = None
+):
+    """Builds the long format topas scores of the cohorts right after loading instead of on first use."""
+    if cohort_indices is None:
+        cohort_indices = range(len(cohorts_db.config.get_cohort_names()))
+
+    for cohort_index in cohort_indices:
+        for intensity_unit in TOPAS_SCORES_LONG_UNITS:
+            try:
+                get_topas_scores_long_df(cohorts_db, cohort_index, intensity_unit)
+            except Exception as err:
+                cohorts_db.logger.log_message(
+                    f"Long format topas scores {intensity_unit.value} of cohort {cohort_index} were not built: {err}"
+                )
+
+
 def get_topas_subset_df(
     cohorts_db: data_api.CohortDataAPI,
     cohort_index: str,
@@ -246,9 +308,10 @@ def get_topas_subset_df(
         pd.DataFrame: A DataFrame containing the subset of topas scores for the specified cohort and topas names.
 
     Notes:
-        - If the topas name is "IFN_sig", TOPAS scores are calculated using protein abundance data.
+        - If the topas name is "IFN_sig", TOPAS scores are calculated using protein abundance data
+          (cached per cohort, see `IFN_topas_scoring.get_signature_scores`).
         - Otherwise, the function filters the topas scores DataFrame based on the provided topas names.
-        - The topas scores are returned in long format using `get_topas_scores_long_format`.
+        - The topas scores are returned in long format using `get_topas_scores_long_df`.
     
     Example:
         topas_subset_df = get_topas_subset_df(cohorts_db, "1", "topas1,topas2", "topas_score")
@@ -258,21 +321,16 @@ def get_topas_subset_df(
     else:
         score_unit = utils.IntensityUnit.Z_SCORE
 
-    topas_df = cohorts_db.get_topas_scores_df(cohort_index, score_unit)
-    topas_df = get_topas_scores_long_format(topas_df)
-
     if topas_names == "IFN_sig":
 
-        topas_df = topas_scoring.calculate_TOPAS_scores(
-            cohorts_db.get_protein_abundance_df(
-                cohort_index, intensity_unit=utils.IntensityUnit.Z_SCORE
-            ),
-            cohorts_db.get_patient_metadata_df(cohort_index),
+        topas_subset_df = topas_scoring.get_signature_scores(
+            cohorts_db,
+            cohort_index,
+            topas.IFN_proteins,
             score_type=score_type,
         )
-        print(topas_df)
-        topas_subset_df = topas_df
     else:
+        topas_df = get_topas_scores_long_df(cohorts_db, cohort_index, score_unit)
         topas_subset_df = topas_df[
             topas_df["Topas_id"].isin(topas_names.split(","))
         ]
@@ -288,7 +346,8 @@ def get_circular_barplot_data_pathways(topas_df: pd.DataFrame, patient: str):
     to include only the topass that are relevant to the patient and maps pathway categories to color codes.
 
     Args:
-        topas_df (pd.DataFrame): DataFrame containing topas scores with sample names and topas IDs.
+        topas_df (pd.DataFrame): Long format topas scores with sample names and topas IDs,
+            see `get_topas_scores_long_df`. May already be restricted to the patient.
         patient (str): The identifier of the patient for whom the data is being retrieved.
 
     Returns:
@@ -306,7 +365,6 @@ def get_circular_barplot_data_pathways(topas_df: pd.DataFrame, patient: str):
     Example:
         circular_barplot_data = get_circular_barplot_data_pathways(topas_df, "Patient_123")
     """
-    topas_df = get_topas_scores_long_format(topas_df)
     interested_topass = list(set(topas.TOPAS_CATEGORIES.keys()))
     df = topas_df[topas_df["Sample name"] == str(patient)].set_index("Sample name")
     df = df[df.Topas_id.isin(interested_topass)]
@@ -387,8 +445,8 @@ def getlolipop_expression_topas(
     Args:
         expression_z_scores_df (pd.DataFrame): DataFrame containing protein expression Z-scores, 
                                                 with proteins as rows and samples as columns.
-        topas_z_scores_df (pd.DataFrame): DataFrame containing topas Z-scores, with topass as 
-                                           rows and samples as columns.
+        topas_z_scores_df (pd.DataFrame): Long format topas Z-scores, see `get_topas_scores_long_df`.
+                                           May already be restricted to the patient.
         patient (str): The identifier of the patient whose data is being retrieved.
         type_to_filter (str, optional): The topas category to filter the data by. Defaults to "RTK".
 
@@ -425,7 +483,6 @@ def getlolipop_expression_topas(
     expression_df["label"] = expression_df.index
     expression_df["expression_score"][expression_df["expression_score"] < 0] = 0
 
-    topas_z_scores_df = get_topas_scores_long_format(topas_z_scores_df)
     topas_df = topas_z_scores_df[
         (
             topas_z_scores_df["Sample name"].isin([patient])
@@ -462,7 +519,8 @@ def getlolipop_expression_topas(
 
 
 def get_topas_subscore_data_per_type(
-    report_dir: str,
+    cohorts_db: data_api.CohortDataAPI,
+    cohort_index: str,
     topas_name: str,
     sub_type: str = "important phosphorylation",
     return_json: bool = False,
@@ -471,13 +529,14 @@ def get_topas_subscore_data_per_type(
     Retrieves sub-topas data for a specific topas and sub-type (e.g., phosphorylation), 
     and optionally returns the data in JSON format.
 
-    This function loads sub-topas data from a report directory, filters it by the specified 
+    This function takes the sub-topas data loaded with the cohort, filters it by the specified 
     sub-type (e.g., "important phosphorylation"), and returns the data either as a DataFrame 
     or in JSON format, based on the `return_json` flag. If the sub-topas data for the specified 
     topas is not found, it raises an error.
 
     Args:
-        report_dir (str): The directory where the report data is stored.
+        cohorts_db (data_api.CohortDataAPI): The CohortDataAPI instance for accessing cohort data.
+        cohort_index (str): The index of the cohort to retrieve data for.
         topas_name (str): The name of the topas for which the sub-topas data is being retrieved.
         sub_type (str, optional): The type of sub-topas data to filter by. Defaults to "important phosphorylation".
         return_json (bool, optional): Flag indicating whether to return the data in JSON format. Defaults to False.
@@ -491,14 +550,14 @@ def get_topas_subscore_data_per_type(
 
     Example:
         # To get sub-topas data as a DataFrame for the topas "Topas1" and sub-type "important phosphorylation"
-        df = get_topas_subscore_data_per_type(report_dir="path/to/reports", topas_name="Topas1")
+        df = get_topas_subscore_data_per_type(cohorts_db, "0", topas_name="Topas1")
         
         # To get the same data in JSON format
-        json_data = get_topas_subscore_data_per_type(report_dir="path/to/reports", topas_name="Topas1", return_json=True)
+        json_data = get_topas_subscore_data_per_type(cohorts_db, "0", topas_name="Topas1", return_json=True)
     """
     try:
-        df = topas_loader.load_topas_subscore_table(
-            report_dir, topas_name, return_wide=True
+        df = cohorts_db.get_topas_subscore_df(
+            cohort_index, topas_name, return_wide=True
         )
         df = df.set_index("Sample name")
         df = df.filter(regex=sub_type)
@@ -4,6 +4,7 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import topas_portal.utils as utils
+import topas_portal.density_plots as density_plots
 
 if TYPE_CHECKING:
     import topas_portal.data_api.data_api as data_api
@@ -31,10 +32,11 @@ def get_density_calc_fpkm(
         dict: A JSON-compatible dictionary representation of the density plot data.
 
     Notes:
-        - The function first retrieves the FPKM data matrix from `cohorts_db`.
-        - The data is then transformed into a density plot-friendly format using `count_df_to_density_plot_df`.
+        - The background histogram of the FPKM data matrix is computed once and cached, only the
+          histogram of the identifier is computed per call (see `density_plots`).
         - The processed data is converted to JSON format before being returned.
     """
-    fpkm_df = cohorts_db.get_fpkm_df(intensity_unit=intensity_unit)
-    count_df_fpkm = utils.count_df_to_density_plot_df(fpkm_df, identifier,list(fpkm_df.columns))
+    count_df_fpkm = density_plots.get_fpkm_density_plot_df(
+        cohorts_db, identifier, intensity_unit
+    )
     return utils.df_to_json(count_df_fpkm)
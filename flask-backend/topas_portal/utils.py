@@ -1,16 +1,22 @@
+import io
 import os
 import random
 import json
+import zipfile
 from enum import Enum
 
 import pandas as pd
 import numpy as np
-from flask import Response
+from flask import Response, has_request_context, request
 from typing import List
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:  # optional, the json module is used instead
+    orjson = None
+
 from topas_portal import settings
-import topas_portal.plotly_preprocess as plotlyprepare
 from topas_portal.config_reader import *
 
 
@@ -365,15 +371,129 @@ def check_all_config_file(configs):
         return {}
 
 
+JSON_MIMETYPE = "application/json"
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
 def df_to_json(df):
     """
-    Makes flask JSON response from a dataframe
+    Makes flask JSON response from a dataframe, a list with one object per row.
+
+    Clients can opt in to more compact forms: an object with one list per column with the
+    query argument ?orient=columns, or an Arrow IPC stream with the Accept header
+    application/vnd.apache.arrow.stream (falls back to JSON if pyarrow is not available).
+    Missing values are serialized as null.
     """
-    return Response(
-        json.dumps(df.to_dict(orient="records")), mimetype="application/json"
+    if has_request_context():
+        accepted = request.accept_mimetypes.best_match([JSON_MIMETYPE, ARROW_STREAM_MIMETYPE])
+        if accepted == ARROW_STREAM_MIMETYPE:
+            arrow_stream = df_to_arrow_stream(df)
+            if arrow_stream is not None:
+                return Response(arrow_stream, mimetype=ARROW_STREAM_MIMETYPE)
+        if request.args.get("orient") == "columns":
+            return Response(df_to_json_columns(df), mimetype=JSON_MIMETYPE)
+    return Response(df_to_json_records(df), mimetype=JSON_MIMETYPE)
+
+
+def df_to_json_records(df: pd.DataFrame) -> bytes:
+    if orjson is None:
+        return json.dumps(_nan_to_none(df).to_dict(orient="records")).encode("utf-8")
+    return orjson.dumps(
+        df.to_dict(orient="records"),
+        default=_orjson_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def df_to_json_columns(df: pd.DataFrame) -> bytes:
+    """JSON object with one list of values per column, column names are not repeated per row"""
+    if orjson is None:
+        df = _nan_to_none(df)
+        columns = {
+            str(column): df.iloc[:, position].tolist()
+            for position, column in enumerate(df.columns)
+        }
+        return json.dumps(columns).encode("utf-8")
+
+    columns = {}
+    for position, column in enumerate(df.columns):
+        values = df.iloc[:, position]
+        if values.dtype.kind in "biuf":
+            # numeric columns are serialized directly from the numpy array, NaN becomes null
+            columns[str(column)] = np.ascontiguousarray(values.to_numpy())
+        else:
+            columns[str(column)] = values.astype(object).where(values.notna(), None).tolist()
+    return orjson.dumps(
+        columns, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY
     )
 
 
+def df_to_arrow_stream(df: pd.DataFrame):
+    """Arrow IPC stream of the dataframe, None if pyarrow is not available or cannot convert it"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError):
+        return None
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _nan_to_none(df: pd.DataFrame) -> pd.DataFrame:
+    """The json module writes NaN, which is not valid JSON, missing values become null instead"""
+    return df.astype(object).where(df.notna(), None)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, (pd.Timestamp, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class _ZipOutputStream(io.RawIOBase):
+    """Write-only, non-seekable buffer that zipfile writes to and the response generator drains"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_stored(file_paths: List[str], chunk_size: int = 1024 * 1024):
+    """
+    Yields an uncompressed zip archive of the files chunk by chunk, such that large archives
+    can be streamed without writing them to disk or holding them in memory.
+    """
+    stream = _ZipOutputStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        for file_path in file_paths:
+            zip_info = zipfile.ZipInfo.from_file(file_path, os.path.basename(file_path))
+            with open(file_path, "rb") as src, zip_file.open(zip_info, "w") as dest:
+                while chunk := src.read(chunk_size):
+                    dest.write(chunk)
+                    yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+
 def get_cohort_names_from_config(config_path):
     """
     returns the list of cohorts in the config file
@@ -417,6 +537,9 @@ def merged_df_to_json(data_type: str, merged_df: pd.DataFrame, title="Scores"):
         )
 
         plot_df = merged_df.drop(sample_annot_cols, axis=1)
+        # plotly is only imported when a plot is requested, it slows down the worker start
+        import topas_portal.plotly_preprocess as plotlyprepare
+
         return plotlyprepare.get_simple_heatmap(plot_df, title)
     else:
         meta_data = merged_df[sample_annot_cols]
@@ -429,21 +552,55 @@ def calculate_z_scores(df: pd.DataFrame, col_name="sum"):
     :df: a unicolumn pandas dataFrame
     :col_name:  the column the zscoring is based on tha column
     """
-    print("Calculating zscores")
     try:
-        z_scores = []
-        # TODO: replace this with Metrics LOO z-scoring function from topas-pipeline
-        for i in df.index:
-            loo_df = df.drop(i, axis=0)
-            median = float(loo_df.median())
-            stdev = float(loo_df.std())
-            z_scores.append((df.loc[i, col_name] - median) / stdev)
-        return z_scores
+        values = pd.to_numeric(df[col_name]).to_numpy(dtype=float)
+        return list(loo_z_scores(values))
     except Exception as err:
         print(f"Unexpected {err=}, {type(err)=}")
         return ["n.d."]*len(df.index)
 
 
+def loo_z_scores(values: np.ndarray) -> np.ndarray:
+    """
+    Leave-one-out z-scores: each value is scored against the median and standard
+    deviation of all other non-missing values. Vectorised replacement of dropping
+    every element in turn; missing values get a NaN z-score.
+    :values: 1d array of scores
+    """
+    values = np.asarray(values, dtype=float)
+    z_scores = np.full(values.shape, np.nan)
+    observed = ~np.isnan(values)
+    x = values[observed]
+    num_loo = len(x) - 1
+    if num_loo < 1:
+        return z_scores
+
+    # median of the remaining values: position p in the LOO array corresponds to
+    # position p (or p + 1 if at or after the left out value) in the sorted array
+    order = np.argsort(x, kind="stable")
+    sorted_x = x[order]
+    ranks = np.empty(len(x), dtype=int)
+    ranks[order] = np.arange(len(x))
+
+    def loo_value_at(position: int) -> np.ndarray:
+        return sorted_x[position + (position >= ranks)]
+
+    if num_loo % 2 == 1:
+        loo_median = loo_value_at(num_loo // 2)
+    else:
+        loo_median = (loo_value_at(num_loo // 2 - 1) + loo_value_at(num_loo // 2)) / 2
+
+    # sample standard deviation of the remaining values from (shifted) sums
+    shifted = x - x.mean()
+    loo_sum = shifted.sum() - shifted
+    loo_sum_squares = (shifted**2).sum() - shifted**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loo_var = (loo_sum_squares - loo_sum**2 / num_loo) / (num_loo - 1)
+        loo_std = np.sqrt(np.clip(loo_var, 0, None))
+        z_scores[observed] = (x - loo_median) / loo_std
+    return z_scores
+
+
 def whitespace_remover(df: pd.DataFrame) -> pd.DataFrame:
     for col in df.columns:
         if df[col].dtype == "object":
@@ -15,6 +15,9 @@ export const api = {
     COLUMN_NAMES: () => `${API_HOST}/colnames`,
     PATIENT_REPORT_TABLE: ({cohort_index, patient, level, downloadmethod}) => `${API_HOST}/${cohort_index}/patient_reports/${patient}/${level}/${downloadmethod}`,
     PATIENT_REPORT_TABLE_XLSX: ({cohort_index, patients}) => `${API_HOST}/${cohort_index}/patient_reports/${patients}`,
+    PATIENT_REPORT_TABLE_BATCH: ({cohort_index, level, patients}) => `${API_HOST}/${cohort_index}/patient_reports_batch/${level}/${patients}`,
+    PATIENT_REPORT_STORE_STATUS: ({cohort_index}) => `${API_HOST}/${cohort_index}/patient_reports_store/status`,
+    PATIENT_REPORT_STORE_BUILD: ({cohort_index}) => `${API_HOST}/${cohort_index}/patient_reports_store/build`,
     ENTITY_STATUS: () => `${API_HOST}/entityscore/status`,
     CORRELATION_FPKM_PROTEIN: ({cohort_index}) => `${API_HOST}/correlation/fpkmprotein/${cohort_index}`,
     ONCOKB_CNV: ({identifier, cnv_type}) => `${API_HOST}/oncokb/api/cnv/${identifier}/${cnv_type}`,
@@ -33,10 +36,18 @@ export const api = {
     ANNOTATION_MODALITY: ({cohort_index, modality}) => `${API_HOST}/annotation/${cohort_index}/${modality}`,
     VENN_PATIENT_COMPARE: ({cohort_index, pp_fp, patientslists}) => `${API_HOST}/venn/${cohort_index}/patientcompare/${pp_fp}/${patientslists}`,
     VENN_BATCH_COMPARE: ({cohort_index, pp_fp, batchlists}) => `${API_HOST}/venn/${cohort_index}/batchcompare/${pp_fp}/${batchlists}`,
+    VENN_COMPARE: ({cohort_index, pp_fp, modality, groups}) => `${API_HOST}/venn/${cohort_index}/compare/${pp_fp}/${modality}/${groups}`,
     UPDATE_LOG: () => `${API_HOST}/update/logs`,
     ERROR_LOG: () => `${API_HOST}/error/logs`,
+    CACHE_STATS: () => `${API_HOST}/cache/stats`,
+    JOBS: () => `${API_HOST}/jobs`,
+    JOB_SUBMIT: ({job_type}) => `${API_HOST}/jobs/submit/${job_type}`,
+    JOB_STATUS: ({job_id}) => `${API_HOST}/jobs/${job_id}`,
+    JOB_RESULT: ({job_id}) => `${API_HOST}/jobs/${job_id}/result`,
+    JOB_CANCEL: ({job_id}) => `${API_HOST}/jobs/${job_id}/cancel`,
     PATIENT_CENTRIC_PP_INTENSITY: ({cohort_index, dtype}) => `${API_HOST}/patientcentric/ppintensity/${cohort_index}/${dtype}`,
     PATIENT_CENTRIC_PROTEIN_COUNTS: ({cohort_index, fp_pp}) => `${API_HOST}/patientcenteric/proteincounts/${cohort_index}/${fp_pp}`,
+    PATIENT_CENTRIC_BATCH_COUNTS: ({cohort_index}) => `${API_HOST}/patientcentric/batchcounts/${cohort_index}`,
     TOPAS: ({cohort_index, topas_names, score_type}) => `${API_HOST}/topas/${cohort_index}/${topas_names}/${score_type}`,
     TOPAS_ANNOTATIONS: () => `${API_HOST}/topas/annotations`,
     TOPAS_LOLLIPOP: ({cohort_index, patient}) => `${API_HOST}/topas/lolipopdata/${cohort_index}/${patient}`,